@@ -9,12 +9,13 @@ Requirements
 ------------
 PyQt4 (or PySide), for Qt4 bindings
 numpy, matplotlib.
+pyqtgraph, optionally, for the faster --backend pyqtgraph.
+ffmpeg, optionally, for --headless --video. --headless itself needs neither Qt nor a display.
 
 TODO: 
 ----- 
 * Zoom in on selected area
 * Tabbed versions
-* Pause & explore plot
 * save image
 * show which beam is which
 
@@ -24,18 +25,93 @@ __version__ = "0.1"
 __author__  = "Danny Price"
 
 # Imports
-import sys, os
-import socket
-import json                     # Pack/unpack python dictionaries over UDP 
-from collections import deque   # Ring buffer
+import sys, os, time
 from optparse import OptionParser
 
-try:
-    print "Using uJson"
-    import ujson as json
-except:
-    print "Warning: uJson not installed. Reverting to python's native Json (slower)"
-    import json
+from hipsr_ingest import IngestWorker, Recorder, Replayer
+from hipsr_archive import SpectrumArchive
+from hipsr_fanout import FanoutServer, FanoutClient, parse_address
+from hipsr_shm import SharedSpectraWriter, SharedMemorySource
+
+def parse_options(argv):
+    """ Option parsing to allow command line arguments to be parsed """
+    p = OptionParser()
+    p.set_usage('hipsr_gui.py [options]')
+    p.set_description(__doc__)
+    p.add_option("-i", "--hostip", dest="hostip", type="string", default="127.0.0.1",
+                 help="change host IP address to run server. Default is localhost (127.0.0.1)")
+    p.add_option("-p", "--hostport", dest="hostport", type="int", default=59012,
+                 help="change host port for server. Default is 59012")
+    p.add_option("--rcvbuf-kib", dest="rcvbuf_kib", type="int", default=8192,
+                 help="UDP socket receive buffer size, in KiB. Default is 8192 (8 MiB)")
+    p.add_option("-f", "--fps", dest="fps", type="float", default=10.0,
+                 help="target display frame rate, in frames per second. Default is 10")
+    p.add_option("-r", "--record", dest="record", type="string", default=None,
+                 help="record all received UDP packets to file")
+    p.add_option("--replay", dest="replay", type="string", default=None,
+                 help="replay packets from a recording instead of listening on UDP")
+    p.add_option("-s", "--speed", dest="speed", type="float", default=1.0,
+                 help="replay speed relative to real time; 0 replays as fast as possible. Default is 1")
+    p.add_option("--serve", dest="serve", type="string", default=None,
+                 help="run headless as an ingest daemon, serving viewers on TCP [HOST:]PORT")
+    p.add_option("--connect", dest="connect", type="string", default=None,
+                 help="receive data from an ingest daemon at [HOST:]PORT instead of listening on UDP")
+    p.add_option("--serve-shm", dest="serve_shm", type="string", default=None,
+                 help="run headless as an ingest daemon, serving viewers on this machine through shared memory NAME")
+    p.add_option("--connect-shm", dest="connect_shm", type="string", default=None,
+                 help="read data from an ingest daemon's shared memory NAME instead of listening on UDP")
+    p.add_option("--subscribe-rate", dest="subscribe_rate", type="float", default=0.0,
+                 help="with --connect: maximum spectra per second per beam. Default is 0 (all)")
+    p.add_option("--subscribe-nchan", dest="subscribe_nchan", type="int", default=0,
+                 help="with --connect: channels per spectrum to receive, averaged down by the ingest "
+                      "daemon. Must divide the stream's channel count. Default is 0 (all)")
+    p.add_option("--backend", dest="backend", type="choice", choices=["matplotlib", "pyqtgraph"],
+                 default="matplotlib",
+                 help="plotting backend, matplotlib or pyqtgraph (faster, needs pyqtgraph). Default is matplotlib")
+    p.add_option("-c", "--nchan", dest="nchan", type="int", default=256,
+                 help="channels per polarisation to expect. The stream's channel count is detected and "
+                      "takes precedence. Default is 256")
+    p.add_option("--beams", dest="beams", type="string", default="1-13",
+                 help="beams to monitor, e.g. 1-7 or 1,2,5. Others are ignored. Default is 1-13")
+    p.add_option("--rfi-sigma", dest="rfi_sigma", type="float", default=5.0,
+                 help="flag channels this many standard deviations from their running mean as RFI. Default is 5")
+    p.add_option("--history", dest="history", type="float", default=12.0,
+                 help="hours of waterfall history to keep per beam. With --connect-shm, the ingest "
+                      "daemon's is shown instead. Default is 12")
+    p.add_option("--wf-reduce", dest="wf_reduce", type="choice", choices=["mean", "max"], default="mean",
+                 help="how older waterfall history is decimated: mean or max (max-hold). With --connect-shm, "
+                      "the ingest daemon's setting applies. Default is mean")
+    p.add_option("-a", "--archive", dest="archive", type="string", default=None,
+                 help="archive every spectrum to this directory, and load beam history from it")
+    p.add_option("--perf-log", dest="perf_log", type="string", default=None,
+                 help="append performance counters and stage timings to file, as JSON lines")
+    p.add_option("--perf-interval", dest="perf_interval", type="float", default=1.0,
+                 help="seconds between performance overlay and log updates. Default is 1")
+
+    p.add_option("--headless", dest="headless", action="store_true", default=False,
+                 help="run without Qt or a display, writing snapshots of the views to --snapshot-dir")
+    p.add_option("--snapshot-dir", dest="snapshot_dir", type="string", default="snapshots",
+                 help="with --headless: output directory. Default is snapshots")
+    p.add_option("--snapshot-interval", dest="snapshot_interval", type="float", default=10.0,
+                 help="with --headless: seconds between snapshots. Default is 10")
+    p.add_option("--snapshot-views", dest="snapshot_views", type="string", default="mb,wf,p",
+                 help="with --headless: views to write, any of mb,sb,p,wf,wg. Default is mb,wf,p")
+    p.add_option("--snapshot-size", dest="snapshot_size", type="string", default="800x600",
+                 help="with --headless: size of each view, in pixels. Default is 800x600")
+    p.add_option("--video", dest="video", action="store_true", default=False,
+                 help="with --headless: encode snapshots into a video per view with ffmpeg, instead of PNG")
+    (options, args) = p.parse_args(argv)
+    if options.fps <= 0:
+        p.error("--fps must be greater than 0")
+    return options, args
+
+if __name__ == '__main__':
+    (options, args) = parse_options(sys.argv[1:])
+    if options.headless:
+        # Headless rendering needs neither Qt nor a display
+        import hipsr_headless
+        hipsr_headless.run(options)
+        sys.exit()
 
 try:
     import hipsr_core.qt_compat as qt_compat
@@ -46,8 +122,6 @@ except:
     print "Error: cannot load PySide or PyQt4. Please check your install."
     raise
 
-import numpy as np
-
 import matplotlib
 if matplotlib.__version__ == '0.99.3':
     print "Error: your matplotlib version is too old to run this. Please upgrade."
@@ -62,17 +136,9 @@ else:
         matplotlib.rcParams['backend.qt4']='PyQt4'
     from matplotlib.backends.backend_qt4agg import FigureCanvasQTAgg as FigureCanvas
     from matplotlib.backends.backend_qt4agg import NavigationToolbar2QT as NavigationToolbar
-    from matplotlib.figure import Figure
-    import matplotlib.gridspec as gridspec
-try:
-    import pylab as plt
-except:
-    print "Error: cannot load Pylab. Check your matplotlib install."
-    exit()
 
+from hipsr_monitor import HipsrMonitor, parse_beams, waterfall_tiers, wf_rows, wf_factor, ntime
 
-nbeams = 5
-ntime = 120
 
 class SettingsWindow(QtGui.QWidget):
     def __init__(self):
@@ -81,24 +147,39 @@ class SettingsWindow(QtGui.QWidget):
         self.hostEdit = QtGui.QLineEdit()
         portLabel     = QtGui.QLabel("Port:")
         self.portEdit = QtGui.QLineEdit()
+        fpsLabel      = QtGui.QLabel("Target FPS:")
+        self.fpsEdit  = QtGui.QLineEdit()
+        self.fpsEdit.setValidator(QtGui.QDoubleValidator(0.1, 100.0, 1, self.fpsEdit))
+        measuredLabel = QtGui.QLabel("Measured FPS:")
+        self.measuredFpsLabel = QtGui.QLabel("-")
+        bufferLabel   = QtGui.QLabel("Socket buffer:")
+        self.bufferSizeLabel = QtGui.QLabel("-")
         self.okButton = QtGui.QPushButton("OK", self)
         self.okButton.clicked.connect(self.updateSettings)
         
         self.host = options.hostip
         self.port = options.hostport
+        self.fps  = options.fps
         
         settingsLayout = QtGui.QGridLayout()
         settingsLayout.addWidget(hostLabel, 0, 0)
         settingsLayout.addWidget(self.hostEdit, 0, 1)
         settingsLayout.addWidget(portLabel, 1, 0)
         settingsLayout.addWidget(self.portEdit, 1, 1)
-        settingsLayout.addWidget(self.okButton, 2, 1)
+        settingsLayout.addWidget(fpsLabel, 2, 0)
+        settingsLayout.addWidget(self.fpsEdit, 2, 1)
+        settingsLayout.addWidget(measuredLabel, 3, 0)
+        settingsLayout.addWidget(self.measuredFpsLabel, 3, 1)
+        settingsLayout.addWidget(bufferLabel, 4, 0)
+        settingsLayout.addWidget(self.bufferSizeLabel, 4, 1)
+        settingsLayout.addWidget(self.okButton, 5, 1)
         
         self.setLayout(settingsLayout)
         self.setWindowTitle("Settings")
         
         self.hostEdit.setText(self.host)
         self.portEdit.setText(str(self.port))
+        self.fpsEdit.setText(str(self.fps))
         
         self.hostEdit.setReadOnly(True)
         self.portEdit.setReadOnly(True)
@@ -106,6 +187,11 @@ class SettingsWindow(QtGui.QWidget):
     def updateSettings(self):
         self.host = self.hostEdit.text()
         self.port = self.portEdit.text()
+        if self.fpsEdit.hasAcceptableInput():
+            self.fps = float(self.fpsEdit.text())
+        else:
+            # Empty, or outside the validator's range, e.g. 0: keep the current rate
+            self.fpsEdit.setText(str(self.fps))
         self.hide()
     
     def toggle(self):
@@ -117,111 +203,169 @@ class HipsrGui(QtGui.QMainWindow):
     """ HIPSR GUI class
     
     A Qt4 Widget that uses matplotlib to display data from UDP packets.    
+    The plots and history buffers themselves live in a HipsrMonitor.
     """
     def __init__(self):
         super(HipsrGui, self).__init__()
         
+        beams = parse_beams(options.beams)
+        archive = None
+        if options.archive:
+            print "Archiving spectra to %s"%options.archive
+            try:
+                archive = SpectrumArchive(options.archive, beams, options.nchan)
+            except ValueError, e:
+                print "Warning: not archiving: %s. Use --nchan to match the archive."%e
+        if options.backend == "pyqtgraph":
+            from hipsr_pyqtgraph import PyqtgraphMonitor
+            monitor_class = PyqtgraphMonitor
+        else:
+            monitor_class = HipsrMonitor
+        self.monitor = monitor_class(FigureCanvas, fps=options.fps, history=3600 * options.history,
+                                     wf_reduce=options.wf_reduce, archive=archive, nchan=options.nchan,
+                                     beams=beams, rfi_sigma=options.rfi_sigma)
+        
         # Initialize user interface
         self.initUI(width=1024, height=768)
 
         # Setup UDP port
         self.host = options.hostip
         self.port = options.hostport
-        self.udpCount = 0
-        self.udpBuffer = deque(maxlen=100)
-
-        print "Listening on %s port %s..."%(self.host, self.port)        
-        self.udpServer = QtNetwork.QUdpSocket(self)
-        self.udpServer.bind(QtNetwork.QHostAddress(self.host), self.port)
-        self.udpServer.readyRead.connect(self.bufferUDPData)
 
-        self.ra = 0.0
-        self.dec = 0.0
+        self.recorder = None
+        self.shared_history = None
+        if options.connect_shm:
+            print "Reading from ingest daemon shared memory %s..."%options.connect_shm
+            self.ingest = SharedMemorySource(options.connect_shm, perf=self.monitor.perf)
+        elif options.connect:
+            host, port = parse_address(options.connect)
+            print "Connecting to ingest daemon at %s port %s..."%(host, port)
+            self.ingest = FanoutClient(host, port, self.subscribedBeams(), nchan=options.subscribe_nchan or None,
+                                       rate=options.subscribe_rate or None, perf=self.monitor.perf)
+        elif options.replay:
+            print "Replaying %s at %sx speed..."%(options.replay, options.speed or "max")
+            self.ingest = Replayer(options.replay, options.speed, perf=self.monitor.perf)
+        else:
+            if options.record:
+                print "Recording to %s"%options.record
+                self.recorder = Recorder(options.record)
+            print "Listening on %s port %s..."%(self.host, self.port)        
+            self.ingest = self.createIngestWorker()
+        self.ingest.start()
+        
+        # Performance overlay and log, refreshed periodically
+        self.perf_dropped = 0
+        self.perf_kernel_drops = 0
+        self.perf_log = None
+        if options.perf_log:
+            self.perf_log = open(options.perf_log, 'a')
+        self.perfTimer = QtCore.QTimer(self)
+        self.perfTimer.timeout.connect(self.updatePerfOverlay)
+        self.perfTimer.start(int(1000 * options.perf_interval))
+        
+        # Render scheduler: ingest and draw at a fixed frame rate, independent of packet rate
+        self.renderTimer = QtCore.QTimer(self)
+        self.renderTimer.timeout.connect(self.onRenderTimer)
+        self.setTargetFps(options.fps)
+        self.settings_window.okButton.clicked.connect(self.applySettings)
     
-    def keyLookup(self, key, data):
-        """ A pythonic case statement that searches for keys in a dict. """
-        
-        return {
-            "tcs-bandwidth": self.keyTcsBandwidth,
-            "tcs-frequency": self.keyTcsFrequency,
-            "tcs-ra"  : self.keyRa,
-            "tcs-dec" : self.keyDec,
-            "beam_01" : self.keyBeam,
-            "beam_02" : self.keyBeam,
-            "beam_03" : self.keyBeam,
-            "beam_04" : self.keyBeam,
-            "beam_05" : self.keyBeam,
-            "beam_06" : self.keyBeam,
-            "beam_07" : self.keyBeam,
-            "beam_08" : self.keyBeam,
-            "beam_09" : self.keyBeam,
-            "beam_10" : self.keyBeam,
-            "beam_11" : self.keyBeam,
-            "beam_12" : self.keyBeam,
-            "beam_13" : self.keyBeam,
-
-            }.get(str(key), self.keyNoMatch)(key, data)    # setNoMatch is default if cmd not found
+    def modifyUDPSocket(self):
+        """ Restart the ingest worker on the current host and port """
+        self.ingest.stop()
+        self.ingest = self.createIngestWorker()
+        self.ingest.start()
     
-    def keyNoMatch(self, key, data=0):
-        print "Info: Unexpected key encountered."
-
-    def keyRa(self, key, data):
-        """ update RA  """
-        self.ra = float(data[key])
-
-    def keyDec(self, key, data):
-        """ update DEC  """
-        self.dec = float(data[key])
-
-    def keyTcsFrequency(self, key, data):
-        """ Update plots with new TCS Frequency """
-        self.sb_c_freq =  float(data[key])
-        cf = self.sb_c_freq
-        bw = np.abs(self.sb_bandwidth)
-        
-        x_data = np.linspace(cf-bw/2, cf+bw/2, 256)
-        self.sb_xpol.set_xdata(x_data)
-        self.sb_ypol.set_xdata(x_data)
-        self.sb_ax.set_xlabel("Frequency (MHz)")
-        self.sb_ax.set_xlim(cf-bw/2, cf+bw/2)
-        
-        wf_ticks = np.linspace(cf-bw/2, cf+bw/2, 256)[::32]
-        self.wf_ax.set_xlabel("Frequency (MHz)")
-        self.wf_ax.set_xticks(range(0,256)[::32])
-        self.wf_ax.set_xticklabels([int(t) for t in wf_ticks])
-        
-        for beam in ["beam_09", "beam_10"]:
-            self.mb_ax[beam].set_xlabel("Frequency (MHz)")
-            self.mb_ax[beam].set_xticks(range(0,256)[::32])
-            self.mb_ax[beam].set_xticklabels([int(t) for t in wf_ticks], rotation=45)
-
-    def keyTcsBandwidth(self, key, data):
-        """ Update with new TCS bandwidth """
-        self.sb_bandwidth =  float(data[key])
+    def createIngestWorker(self):
+        """ Create an ingest worker with the requested socket buffer, and report what was granted """
+        rcvbuf = options.rcvbuf_kib * 1024
+        ingest = IngestWorker(self.host, self.port, recorder=self.recorder, perf=self.monitor.perf,
+                              rcvbuf=rcvbuf)
+        print "Socket buffer: requested %i KiB, granted %i KiB, queue %i frames"%(
+              rcvbuf / 1024, ingest.rcvbuf / 1024, ingest.frames.maxlen)
+        if ingest.rcvbuf < rcvbuf:
+            print "Warning: socket buffer smaller than requested. Raise net.core.rmem_max to allow more."
+        self.settings_window.bufferSizeLabel.setText("%i KiB (requested %i KiB)"%(
+              ingest.rcvbuf / 1024, rcvbuf / 1024))
+        return ingest
     
-    def keyBeam(self, key, data):
-        """ Update plots with beam data """
-        if self.sb_bandwidth < 0:
-            xx = data[key]["xx"][::-1]
-            yy = data[key]["yy"][::-1]
-        else: 
-            xx = data[key]["xx"]
-            yy = data[key]["yy"]
-        self.mb_xpols[key].set_ydata(xx)
-        self.mb_ypols[key].set_ydata(yy)
-        dmax, dmin = np.max([xx[1:-1], yy[1:-1]])*1.1, np.min([xx[1:-1], yy[1:-1]])*0.9
-        self.mb_ax[key].set_ylim(dmin, dmax)
-        self.updateOverallPowerPlot(key, np.array(xx).sum(), np.array(yy).sum())
-        self.updateTimeSeriesData(key, xx)
-        
-        if key == self.activeBeam:
-            self.updateSingleBeamPlot(xx, yy)
-            self.updateWaterfallPlot()
+    def closeEvent(self, event):
+        """ Stop the ingest worker and report its counters on exit """
+        self.renderTimer.stop()
+        self.perfTimer.stop()
+        self.ingest.stop()
+        if self.perf_log is not None:
+            self.perf_log.close()
+        if self.monitor.archive is not None:
+            self.monitor.archive.close()
+        if self.recorder is not None:
+            self.recorder.close()
+            print "Recorded %i packets to %s"%(self.recorder.n_records, self.recorder.filename)
+        stats = self.ingest.stats()
+        print "Ingest: %(received)i received, %(decoded)i decoded, %(errors)i errors, " \
+              "%(dropped)i dropped, %(decode_us)2.1f us/packet decode"%stats
+        if stats.get("kernel_drops") is not None:
+            print "Kernel: %(kernel_drops)i dropped, %(rcvbuf)i byte socket buffer"%stats
+        m = self.monitor
+        print "Render: %i frames rendered, %i skipped, %2.1f fps (target %2.1f fps)"%(
+              m.n_rendered, m.n_skipped, m.measuredFps(), m.target_fps)
+        event.accept()
     
-    def modifyUDPSocket(self):
-        self.udpServer.close()
-        self.udpServer(QtNetwork.QHostAddress(self.host), self.port)
-        self.udpServer.readyRead.connect(self.bufferUDPData)
+    def changeEvent(self, event):
+        """ Stop rendering the multibeam plot while the window is minimized """
+        if event.type() == QtCore.QEvent.WindowStateChange:
+            self.monitor.setViewVisible("mb", not self.isMinimized())
+            self.updateSubscription()
+        super(HipsrGui, self).changeEvent(event)
+    
+    def setTargetFps(self, fps):
+        """ Set the frame rate the render scheduler aims for """
+        self.monitor.setTargetFps(fps)
+        self.renderTimer.start(int(1000 * self.monitor.frame_interval))
+    
+    def updatePerfOverlay(self):
+        """ Refresh the performance counters, status bar overlay and log """
+        stats = self.ingest.stats()
+        m = self.monitor
+        kernel_drops = stats.get("kernel_drops") or 0
+        behind = (stats["dropped"] > self.perf_dropped or kernel_drops > self.perf_kernel_drops
+                  or m.measuredFps() < 0.8 * m.target_fps)
+        self.perf_dropped = stats["dropped"]
+        self.perf_kernel_drops = kernel_drops
+        
+        counters = [
+            ("received", stats["received"]),
+            ("decoded",  stats["decoded"]),
+            ("errors",   stats["errors"]),
+            ("dropped",  stats["dropped"]),
+            ]
+        if stats.get("kernel_drops") is not None:
+            counters += [
+                ("kernel drops", stats["kernel_drops"]),
+                ("rx queue",     "%i/%iKiB"%(stats["rx_queue"] / 1024, stats["rcvbuf"] / 1024)),
+                ]
+        counters += [
+            ("rendered", m.n_rendered),
+            ("skipped",  m.n_skipped),
+            ("fps",      round(m.measuredFps(), 1)),
+            ("rfi chans", m.stats.nFlagged(m.beam_index[m.activeBeam])),
+            ]
+        m.perf.setCounters(counters)
+        if self.statusBar().isVisible():
+            self.statusBar().showMessage("%s | %s"%("BEHIND" if behind else "OK", m.perf.text()))
+        if self.perf_log is not None:
+            m.perf.writeJson(self.perf_log)
+    
+    def togglePerfOverlay(self):
+        """ Toggles the visibility of the performance status bar """
+        if self.statusBar().isVisible(): self.statusBar().hide()
+        else:
+            self.statusBar().show()
+            self.updatePerfOverlay()
+    
+    def applySettings(self):
+        """ Apply changes made in the settings window """
+        if self.settings_window.fps != self.monitor.target_fps:
+            self.setTargetFps(self.settings_window.fps)
 
     def initUI(self, width=1200, height=750):
         """ Initialize the User Interface 
@@ -234,20 +378,12 @@ class HipsrGui(QtGui.QMainWindow):
             height of the UI, in pixels. Defaults to 768px
         """
         
-        # Create plots
-        self.mb_fig, self.mb_ax, self.mb_xpols, self.mb_ypols = self.createMultiBeamPlot()
-        self.sb_fig, self.sb_ax, self.sb_xpol,  self.sb_ypol, self.sb_title = self.createSingleBeamPlot()
-        self.p_fig, self.p_ax, self.p_lines = self.createOverallPowerPlot()
-        self.wf_fig, self.wf_ax, self.wf_imshow, self.wf_data, self.wf_colorbar = self.createWaterfallPlot()
-        
-        self.sb_c_freq    = 1355.0
-        self.sb_bandwidth = -400.0
-        
-        # generate the canvas to display the plot
-        self.mb_canvas = FigureCanvas(self.mb_fig)
-        self.sb_canvas = FigureCanvas(self.sb_fig)
-        self.p_canvas  = FigureCanvas(self.p_fig)
-        self.wf_canvas = FigureCanvas(self.wf_fig)
+        # Canvases of the monitor's plots
+        self.mb_canvas = self.monitor.canvas("mb")
+        self.sb_canvas = self.monitor.canvas("sb")
+        self.p_canvas  = self.monitor.canvas("p")
+        self.wf_canvas = self.monitor.canvas("wf")
+        self.wg_canvas = self.monitor.canvas("wg")
         
         self.settings_window = SettingsWindow()
         self.settings_window.hide()
@@ -255,37 +391,50 @@ class HipsrGui(QtGui.QMainWindow):
         # Create combo box for beam selection        
         combo = QtGui.QComboBox(self)
         combo.activated[str].connect(self.onBeamSelect)    
-        self.activeBeam = "beam_01"
-        self.time_series_data = {}
-        
-        beam_ids = ["beam_01","beam_02","beam_03","beam_04","beam_05","beam_06","beam_07", "beam_08","beam_09","beam_10","beam_11","beam_12","beam_13"]        
-        for beam in beam_ids: 
+        for beam in self.monitor.beams: 
             combo.addItem(beam)
-            self.time_series_data[beam] = np.ones([150,256])
         
         # Widget layout
         self.sb_widget = QtGui.QWidget()
-        self.sb_mpl_toolbar = NavigationToolbar(self.sb_canvas, self.sb_widget)
         vbox = QtGui.QVBoxLayout()
         vbox.addWidget(combo)
         vbox.addWidget(self.sb_canvas)
-        vbox.addWidget(self.sb_mpl_toolbar)
+        self.sb_mpl_toolbar = self.addNavigationToolbar(vbox, self.sb_canvas, self.sb_widget)
         self.sb_widget.setLayout(vbox)
         self.sb_dock = QtGui.QDockWidget("Beam scope", self)
         self.sb_dock.setWidget(self.sb_widget)
                 
         self.wf_widget = QtGui.QWidget()
-        self.wf_thr = 3
-        self.wf_mpl_toolbar = NavigationToolbar(self.wf_canvas, self.wf_widget)
         self.wf_line_edit = QtGui.QLineEdit()
         self.wf_line_edit.setToolTip("No. of stdev from average")
         self.wf_line_edit.setValidator(QtGui.QDoubleValidator(-999.0, 999.0, 2, self.wf_line_edit))
         self.wf_set_button = QtGui.QPushButton("Set", self)
         self.wf_set_button.clicked.connect(self.updateWaterfallThreshold)
-        self.wf_line_edit.setText(str(self.wf_thr))
+        self.wf_line_edit.setText(str(self.monitor.wf_thr))
         wf_label = QtGui.QLabel("Color scaling:")
         
+        # History spans, one per tier of waterfall history
+        self.wf_span_combo = QtGui.QComboBox(self)
+        self.wf_span_combo.setToolTip("Time span shown; older history is shown at lower time resolution")
+        self.updateSpanCombo()
+        self.wf_span_combo.currentIndexChanged[int].connect(self.monitor.setWaterfallTier)
+        wf_span_label = QtGui.QLabel("History:")
+        
+        # Paging back through the archive, in the waterfall and beam scope
+        self.wf_lookback_spin = QtGui.QSpinBox(self)
+        self.wf_lookback_spin.setRange(0, 7 * 24 * 60)
+        self.wf_lookback_spin.setSuffix(" min ago")
+        self.wf_lookback_spin.setSpecialValueText("live")
+        self.wf_lookback_spin.setToolTip("Show archived spectra from this long ago in the waterfall and beam scope")
+        self.wf_lookback_spin.setEnabled(self.monitor.archive is not None)
+        self.wf_lookback_spin.valueChanged[int].connect(self.onLookback)
+        wf_lookback_label = QtGui.QLabel("Look back:")
+        
         hbox = QtGui.QHBoxLayout()
+        hbox.addWidget(wf_span_label)
+        hbox.addWidget(self.wf_span_combo)
+        hbox.addWidget(wf_lookback_label)
+        hbox.addWidget(self.wf_lookback_spin)
         hbox.addStretch(1)
         hbox.addWidget(wf_label)
         hbox.addWidget(self.wf_line_edit)
@@ -294,26 +443,42 @@ class HipsrGui(QtGui.QMainWindow):
         vbox = QtGui.QVBoxLayout()
         vbox.addLayout(hbox)
         vbox.addWidget(self.wf_canvas)
-        vbox.addWidget(self.wf_mpl_toolbar)
+        self.wf_mpl_toolbar = self.addNavigationToolbar(vbox, self.wf_canvas, self.wf_widget)
         self.wf_widget.setLayout(vbox)
         self.wf_dock = QtGui.QDockWidget("Waterfall plot", self)
         self.wf_dock.setWidget(self.wf_widget)
 
         self.p_widget = QtGui.QWidget()
-        self.p_mpl_toolbar = NavigationToolbar(self.p_canvas, self.p_widget)
         vbox = QtGui.QVBoxLayout()
         vbox.addWidget(self.p_canvas)
-        vbox.addWidget(self.p_mpl_toolbar)
+        self.p_mpl_toolbar = self.addNavigationToolbar(vbox, self.p_canvas, self.p_widget)
         self.p_widget.setLayout(vbox)            
         self.p_dock = QtGui.QDockWidget("Power monitor", self)
         self.p_dock.setWidget(self.p_widget)
         
+        self.wg_widget = QtGui.QWidget()
+        vbox = QtGui.QVBoxLayout()
+        vbox.addWidget(self.wg_canvas)
+        self.wg_mpl_toolbar = self.addNavigationToolbar(vbox, self.wg_canvas, self.wg_widget)
+        self.wg_widget.setLayout(vbox)
+        self.wg_dock = QtGui.QDockWidget("Waterfall grid", self)
+        self.wg_dock.setWidget(self.wg_widget)
+        
         # Add widgets to main window        
         self.setCentralWidget(self.mb_canvas)
         self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.sb_dock)
         self.addDockWidget(QtCore.Qt.BottomDockWidgetArea, self.p_dock)
         self.addDockWidget(QtCore.Qt.BottomDockWidgetArea, self.wf_dock)
-        self.wf_dock.hide(), self.sb_dock.hide(), self.p_dock.hide()
+        self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.wg_dock)
+        self.wf_dock.hide(), self.sb_dock.hide(), self.p_dock.hide(), self.wg_dock.hide()
+        for view in ("sb", "p", "wf", "wg"):
+            self.monitor.setViewVisible(view, False)
+        
+        # Hidden docks are not rendered; catch them up from history when shown
+        self.sb_dock.visibilityChanged.connect(self.onSingleBeamVisible)
+        self.p_dock.visibilityChanged.connect(self.onOverallPowerVisible)
+        self.wf_dock.visibilityChanged.connect(self.onWaterfallVisible)
+        self.wg_dock.visibilityChanged.connect(self.onWaterfallGridVisible)
         
         # Add toolbar icons
         
@@ -327,26 +492,88 @@ class HipsrGui(QtGui.QMainWindow):
         pAction.triggered.connect(self.toggleOverallPowerPlot)
         wfAction    = QtGui.QAction(QtGui.QIcon(os.path.join(abspath, 'icons/spectrum.png')), 'Waterfall plot', self)
         wfAction.triggered.connect(self.toggleWaterfallPlot)
+        wgAction    = QtGui.QAction(QtGui.QIcon(os.path.join(abspath, 'icons/spectrum.png')), 'Waterfall grid', self)
+        wgAction.setToolTip('Waterfalls of all beams, for comparing RFI')
+        wgAction.triggered.connect(self.toggleWaterfallGrid)
         settingsAction = QtGui.QAction(QtGui.QIcon(os.path.join(abspath, 'icons/settings.png')), 'Change config', self)
         settingsAction.triggered.connect(self.settings_window.toggle)
+        self.pauseAction = QtGui.QAction('Pause', self)
+        self.pauseAction.setToolTip('Freeze the display to explore recent frames; data keep being recorded')
+        self.pauseAction.setCheckable(True)
+        self.pauseAction.toggled.connect(self.togglePause)
+        self.scrubSlider = QtGui.QSlider(QtCore.Qt.Horizontal, self)
+        self.scrubSlider.setToolTip('Scrub through the frames received before pausing')
+        self.scrubSlider.setMaximumWidth(300)
+        self.scrubSlider.setEnabled(False)
+        self.scrubSlider.valueChanged.connect(self.onScrub)
+        self.scrubLabel = QtGui.QLabel(" live ")
+        perfAction = QtGui.QAction('Performance', self)
+        perfAction.setToolTip('Show hot-path timing and packet counters')
+        perfAction.triggered.connect(self.togglePerfOverlay)
         
         self.toolbar = self.addToolBar("HIPSR toolbar")
         self.toolbar.addAction(exitAction)
         self.toolbar.addAction(sbAction)
         self.toolbar.addAction(pAction)
         self.toolbar.addAction(wfAction)
+        self.toolbar.addAction(wgAction)
         self.toolbar.addAction(settingsAction)
+        self.toolbar.addAction(perfAction)
+        self.toolbar.addSeparator()
+        self.toolbar.addAction(self.pauseAction)
+        self.toolbar.addWidget(self.scrubSlider)
+        self.toolbar.addWidget(self.scrubLabel)
+        self.statusBar().hide()
          
         self.setGeometry(300, 300, width, height)
         self.setWindowTitle('HIPSR GUI')    
         self.show()
 
+    def addNavigationToolbar(self, layout, canvas, parent):
+        """ Add a matplotlib navigation toolbar for a canvas to a layout
         
+        pyqtgraph views zoom and pan with the mouse, so get no toolbar; returns None.
+        """
+        if options.backend != "matplotlib":
+            return None
+        toolbar = NavigationToolbar(canvas, parent)
+        layout.addWidget(toolbar)
+        return toolbar
+
+    def togglePause(self, paused):
+        """ Pause the display and scrub through recent frames, or go back to live """
+        if paused:
+            self.monitor.pause()
+            n = self.monitor.nSnapshots()
+            self.scrubSlider.blockSignals(True)
+            self.scrubSlider.setRange(0, max(n - 1, 0))
+            self.scrubSlider.setValue(max(n - 1, 0))
+            self.scrubSlider.blockSignals(False)
+            self.scrubSlider.setEnabled(n > 0)
+            self.scrubLabel.setText(" paused ")
+        else:
+            self.scrubSlider.setEnabled(False)
+            self.scrubLabel.setText(" live ")
+            self.monitor.resume()
+    
+    def onScrub(self, index):
+        """ Show a frame received before pausing """
+        if not self.monitor.paused:
+            return
+        self.monitor.showSnapshot(index)
+        age = self.monitor.snapshotTime(self.monitor.nSnapshots() - 1) - self.monitor.snapshotTime(index)
+        self.scrubLabel.setText(" -%2.1f s "%age)
+
     def toggleWaterfallPlot(self):
         """ Toggles the visibility of a dock widget """
         if self.wf_dock.isVisible(): self.wf_dock.hide()
         else: self.wf_dock.show()
 
+    def toggleWaterfallGrid(self):
+        """ Toggles the visibility of a dock widget """
+        if self.wg_dock.isVisible(): self.wg_dock.hide()
+        else: self.wg_dock.show()
+
     def toggleSingleBeamPlot(self):
         """ Toggles the visibility of a dock widget """
         if self.sb_dock.isVisible(): self.sb_dock.hide()
@@ -361,307 +588,148 @@ class HipsrGui(QtGui.QMainWindow):
         """ Toggles the visibility of a dock widget """
         if self.p_dock.isVisible(): self.p_dock.hide()
         else: self.p_dock.show()
-        
-    def bufferUDPData(self):
-        """ A circular buffer for incoming UDP packets """
-        initialized = False
-        while self.udpServer.hasPendingDatagrams():
-            datagram, host, port = self.udpServer.readDatagram(self.udpServer.pendingDatagramSize())
-            
-            try:
-                self.udpBuffer.append(datagram.data())
-            except:
-                self.udpBuffer.append(datagram)
-            
-            self.udpCount += 1
-            #print self.udpCount
-            
-            if self.udpCount == 15:
-                self.updateAllPlots()
-       
-       
-    def onBeamSelect(self, beam):
-        """ Beam selection combo box actions"""
-        self.activeBeam = beam
-        self.sb_title.set_text("Beam monitor: %s"%beam)
-        self.updateAllPlots()
-
-    def createSingleBeamPlot(self, numchans=256, beamid='beam_01'):
-        """ Creates a single pylab plot for HIPSR data. """
-
-        fig = plt.figure(figsize=(3,4),dpi=80)
-        xpol_color = '#00CC00'
-        ypol_color = '#CC0000'
-        title = fig.suptitle("Beam monitor: %s"%beamid)
-        title.set_fontsize(14)
-        ax = plt.subplot(111)
-
-        xpol, = ax.plot(np.cumsum(np.ones(numchans)),np.ones(numchans), color=xpol_color)
-        ypol, = ax.plot(np.cumsum(np.ones(numchans)),np.ones(numchans), color=ypol_color)
-        
-        # Format plot
-        ax.set_ylim(0, 2)
-        ax.set_xlim(0,numchans)
-        ax.set_xlabel("Channel (-)")
-        ax.set_ylabel("Power (-)")  
-        
-        # Set border colour  
-        for child in ax.get_children():
-          if isinstance(child, matplotlib.spines.Spine):
-            child.set_color('#666666')
-              
-        fig.canvas.draw()
-        self.sb_max = 2
-        self.sb_min = 0
-      
-        return fig, ax, xpol, ypol, title
     
+    def onSingleBeamVisible(self, visible):
+        """ Start or stop rendering the beam scope with its dock """
+        self.monitor.setViewVisible("sb", visible)
+        self.updateSubscription()
+
+    def onOverallPowerVisible(self, visible):
+        """ Start or stop rendering the power monitor with its dock """
+        self.monitor.setViewVisible("p", visible)
+        self.updateSubscription()
+
+    def onWaterfallVisible(self, visible):
+        """ Start or stop rendering the waterfall plot with its dock """
+        self.monitor.setViewVisible("wf", visible)
+        self.updateSubscription()
+
+    def onWaterfallGridVisible(self, visible):
+        """ Start or stop rendering the waterfall grid with its dock """
+        self.monitor.setViewVisible("wg", visible)
+        self.updateSubscription()
+        
+    def updateSpanCombo(self):
+        """ List the time span of each tier of waterfall history """
+        self.wf_span_combo.blockSignals(True)
+        self.wf_span_combo.clear()
+        for span in self.monitor.waterfallSpans():
+            if span < 7200: self.wf_span_combo.addItem("%i min"%round(span / 60.))
+            else: self.wf_span_combo.addItem("%2.1f h"%(span / 3600.))
+        self.wf_span_combo.setCurrentIndex(self.monitor.wf_tier)
+        self.wf_span_combo.blockSignals(False)
+
+    def updateSharedHistory(self):
+        """ Draw the waterfall and power monitor from the history in the ingest daemon's
+        shared memory, whenever the block is (re)opened """
+        history = self.ingest.history
+        if history is None or history is self.shared_history:
+            return
+        self.shared_history = history
+        try:
+            self.monitor.setSharedHistory(*history)
+        except ValueError, e:
+            print "Warning: keeping history in this viewer: %s"%e
+            return
+        self.updateSpanCombo()
 
-    def createWaterfallPlot(self):
-        """ Creates a single imshow plot for HIPSR data. """
-        fig  = plt.figure(figsize=(3,4),dpi=80)
-        ax   = plt.subplot(111)
-        data = np.zeros([150,256])
-        data[0] = np.ones_like(data[0]) * 100
-        wf   = ax.imshow(data, cmap=plt.cm.gist_heat_r)
-        
-        ax.set_ylabel("Elapsed Time (m)")
-        ax.set_yticks([0,30,60,90,120,150])
-        ax.set_yticklabels([5,4,3,2,1,0])
-        ax.set_xlabel("Channel")
-        #ax.set_aspect(256./150)
-        
-        cb = fig.colorbar(wf)
-        cb.set_clim(0,80)
-        cb.set_label("Power (-)")
-        #cb.set_ticks([0,2,4,6,8,10])
-        fig.canvas.draw()
-        
-        return fig, ax, wf, data, cb
-        
-    def createMultiBeamPlot(self, numchans=256):
-          """ Creates 13 subplots in a hexagonal array representing the multibeam feeds """
-     
-          fig = plt.figure(figsize=(3,4),dpi=80)
-          
-          # Label the plots. There's gotta be a better way...
-          fig.text(0.53, 0.46, "01", size=20)
-          fig.text(0.53, 0.46+0.15, "06", size=20)
-          fig.text(0.53, 0.46-0.15, "03", size=20)
-          fig.text(0.53+0.15, 0.46-0.075, "04", size=20)
-          fig.text(0.53+0.15, 0.46+0.075, "05", size=20)
-          fig.text(0.53+0.15, 0.46-0.075-0.15, "10", size=20)
-          fig.text(0.53+0.15, 0.46+0.075+0.15, "12", size=20)
-          fig.text(0.53-0.15, 0.46-0.075, "02", size=20)
-          fig.text(0.53-0.15, 0.46+0.075, "07", size=20)
-          fig.text(0.53-0.15, 0.46-0.075-0.15, "09", size=20)
-          fig.text(0.53-0.15, 0.46+0.075+0.15, "13", size=20)
-          fig.text(0.53-0.3, 0.46, "08", size=20)
-          fig.text(0.53+0.3, 0.46, "11", size=20)
-
-          self.ra_dec_text = fig.text(0.05, 0.05, "RA: 00.00, DEC: 00.00", size=20)
-          #self.ra_dec_text.set_text("RA: 10.00, DEC: 20.00")
-
-          xpol_color = '#00CC00'
-          ypol_color = '#CC0000'
-      
-          title = fig.suptitle("Multibeam monitor")
-          title.set_fontsize(20)
-          
-          # Create 13 subplots arranged on a hexagonal grid
-          plotSize = 4
-          gridSize = 5*plotSize+1
-          gs = gridspec.GridSpec(gridSize, gridSize)
-          def beam(posx, posy, size): return gs[posx-size:posx+size, posy-size:posy+size]
-          ax1 = plt.subplot(beam(gridSize/2,gridSize/2,plotSize/2))
-          ax3 = plt.subplot(beam(gridSize/2+plotSize,gridSize/2,plotSize/2))
-          ax6 = plt.subplot(beam(gridSize/2-plotSize,gridSize/2,plotSize/2))
-          ax13 = plt.subplot(beam(gridSize/2-3*plotSize/2,gridSize/2-plotSize,plotSize/2))
-          ax7  = plt.subplot(beam(gridSize/2-plotSize/2,gridSize/2-plotSize,plotSize/2))
-          ax2  = plt.subplot(beam(gridSize/2+plotSize/2,gridSize/2-plotSize,plotSize/2))
-          ax9  = plt.subplot(beam(gridSize/2+3*plotSize/2,gridSize/2-plotSize,plotSize/2))
-          ax12 = plt.subplot(beam(gridSize/2-3*plotSize/2,gridSize/2+plotSize,plotSize/2))
-          ax5  = plt.subplot(beam(gridSize/2-plotSize/2,gridSize/2+plotSize,plotSize/2))
-          ax4  = plt.subplot(beam(gridSize/2+plotSize/2,gridSize/2+plotSize,plotSize/2))
-          ax10  = plt.subplot(beam(gridSize/2+3*plotSize/2,gridSize/2+plotSize,plotSize/2))
-          ax8 = plt.subplot(beam(gridSize/2,gridSize/2-2*plotSize,plotSize/2))
-          ax11 = plt.subplot(beam(gridSize/2,gridSize/2+2*plotSize,plotSize/2))
-    
-          axes = {
-            "beam_01" : ax1,
-            "beam_02" : ax2,
-            "beam_03" : ax3,
-            "beam_04" : ax4,
-            "beam_05" : ax5,
-            "beam_06" : ax6,
-            "beam_07" : ax7,
-            "beam_08" : ax8,
-            "beam_09" : ax9,
-            "beam_10" : ax10,
-            "beam_11" : ax11,
-            "beam_12" : ax12,
-            "beam_13" : ax13        
-          }
-          
-          xpols, ypols = {}, {}  
-      
-          for key in axes.keys():
-            # Create xpol and ypol lines
-            xpols[key], = axes[key].plot(np.cumsum(np.ones(numchans)),np.ones(numchans), color=xpol_color)
-            ypols[key], = axes[key].plot(np.cumsum(np.ones(numchans)),np.ones(numchans), color=ypol_color)
-        
-            # Format plot
-            dmax, dmin = 0, 2
-            axes[key].set_ylim(dmin, dmax)
-            axes[key].set_xlim(0,numchans)
-            
-            # Plot styling
-            axes[key].get_xaxis().set_visible(True)
-            axes[key].get_yaxis().set_visible(True)
-            
-            axes[key].set_yticklabels(["" for i in range(len(axes[key].get_yticks() ))])
-            axes[key].set_xticklabels(["" for i in range(len(axes[key].get_xticks() ))])
-            #axes["beam_08"].get_yaxis().set_visible(True)
-            #axes["beam_09"].get_xaxis().set_visible(True)
-            #axes["beam_10"].get_xaxis().set_visible(True)
-
-          fig.canvas.draw()
-          
-          return fig, axes, xpols, ypols
-
-    def createOverallPowerPlot(self, numchans=ntime, beamid='beam_01'):
-          """ Creates an overall power vs time plot. """
-          
-          fig = plt.figure(figsize=(3,4),dpi=80)
-          ax = plt.subplot(111)
-          
-          # Create 13 lines
-          lines = []
-          colors = [
-              '#cd4a4a', '#ff6e4a', '#9f8170', '#ffcf48', '#bab86c', '#c5e384', '#1dacd6',
-              '#71bc78', '#9aceeb', '#1a4876', '#9d81ba', '#cdc5c2', '#fc89ac'
-              ]
-           
-          x, y = np.cumsum(np.ones(numchans))*2, np.ones(numchans) * 1e4
-          for idx in range(13):
-              line, = ax.plot(x, y, color=colors[idx], lw=1.5, label='%02da'%(idx+1))
-              lines.append(line)
-              
-          for idx in range(13):
-              line, = ax.plot(x, y, color=colors[idx], lw=1.5, label='%02db'%(idx+1), linestyle='--')
-              lines.append(line)
-        
-          # Format plot
-          ax.set_ylim(0, 2)
-          ax.set_xlim(0,numchans*2)
-          ax.set_xlabel("Elapsed Time (s)")
-          ax.set_ylabel("Overall Power")
-
-          # Shink current axis by 20%
-          box = ax.get_position()
-          ax.set_position([box.x0, box.y0, box.width * 0.8, box.height])
-
-          # Put a legend to the right of the current axis
-          ax.legend(loc='center left', bbox_to_anchor=(1, 0.5), ncol=2)
-            
-          fig.canvas.draw()
-          
-          return fig, ax, lines
+    def bufferUDPData(self):
+        """ Add every frame decoded by the ingest worker since the last call to the history buffers """
+        t0 = time.time()
+        frames = self.ingest.popFrames()
+        if options.connect_shm:
+            self.updateSharedHistory()
+        self.monitor.ingestFrames(frames)
+        self.monitor.perf.add("bufferUDPData", time.time() - t0)
+        return len(frames)
     
-    def updateOverallPowerPlot(self, key, xx, yy):
-        """ Update power monitor plot. """
+    def onRenderTimer(self):
+        """ Render scheduler tick
         
-        key = int(key.lstrip("beam_")) -1
-  
-        g_max, g_min = self.p_lines[0].get_ydata().max(), self.p_lines[0].get_ydata().min()  
-        for line in self.p_lines:
-            l_max, l_min = line.get_ydata().max(), line.get_ydata().min()
-            if l_max > g_max: g_max = l_max
-            if l_min < g_min: g_min = l_min
-        
-        line_data_x, line_data_y = self.p_lines[key].get_ydata(), self.p_lines[key+13].get_ydata()
-        line_data_x, line_data_y = np.roll(line_data_x, 1), np.roll(line_data_y, 1)
-        line_data_x[0], line_data_y[0] = xx, yy
-        self.p_lines[key].set_ydata(line_data_x), self.p_lines[key+13].set_ydata(line_data_y)
-        self.p_ax.set_ylim(g_min/1.01, g_max*1.01)
+        All packets received since the last tick go into the history buffers, then the
+        monitor renders a new frame unless it is behind schedule.
+        """
+        n_frames = self.bufferUDPData()
+        if options.connect_shm and not n_frames:
+            # Shared memory generation unchanged: nothing new to draw
+            return
+        if self.monitor.renderFrame() and self.settings_window.isVisible():
+            self.settings_window.measuredFpsLabel.setText("%2.1f"%self.monitor.measuredFps())
+       
+    def onLookback(self, minutes):
+        """ Page the waterfall and beam scope back through the archive """
+        self.monitor.setLookback(60 * minutes)
+
+    def onBeamSelect(self, beam):
+        """ Beam selection combo box actions"""
+        self.monitor.setActiveBeam(beam)
+        self.updateSubscription()
     
-    def updateTimeSeriesData(self, key, new_data):
-        """ Update time series data for waterfall plot """
-        self.time_series_data[key] = np.roll(self.time_series_data[key], -1, axis=0)
-        self.time_series_data[key][0] = new_data
-            
-    def updateWaterfallPlot(self):
-        """ Updates waterfall plot with new values """
-        
-        self.wf_data = self.time_series_data[self.activeBeam]
-        self.wf_imshow.set_data(self.wf_data)
-
-        new_data = self.time_series_data[self.activeBeam][0]        
-        avg = np.average(new_data[20:-20])
-        std = np.std(new_data[20:-20])
-        thr = self.wf_thr
-        ticks = np.linspace(avg - thr*std , avg + thr*std )
-        
-        self.wf_ax.set_title("Beam: %s"%self.activeBeam)
-        #self.wf_colorbar.set_clim(avg - thr*std , avg + thr*std )
-        self.wf_imshow.set_clim(avg - thr*std , avg + thr*std )
-        #self.wf_colorbar.set_ticks(ticks, update_ticks = False)
-        #self.wf_colorbar.update_ticks()
+    def subscribedBeams(self):
+        """ Beams shown by the visible views: all of them for the multibeam, power and waterfall
+        grid plots, only the selected beam for the beam scope and waterfall """
+        visible = self.monitor.visible
+        if visible["mb"] or visible["p"] or visible["wg"]:
+            return self.monitor.beams
+        if visible["sb"] or visible["wf"]:
+            return [self.monitor.activeBeam]
+        return []
     
-    def updateSingleBeamPlot(self, xx, yy):
-        """ Updates single beam plot with new data """
-        self.sb_xpol.set_ydata(xx)
-        self.sb_ypol.set_ydata(yy)
-        
-        update_ax = False
-        dmax, dmin = np.max([xx[1:-1], yy[1:-1]]), np.min([xx[1:-1], yy[1:-1]])
-        if dmax > self.sb_max:
-            update_ax = True
-            self.sb_max = dmax
-        if dmin < self.sb_min:
-            update_ax = True 
-            self.sb_min = dmin
-        if dmax < 2 * self.sb_max:
-            update_ax = True
-        if dmin > 2 * self.sb_min:
-            update_ax = True
-        if update_ax:
-             self.sb_ax.set_ylim(self.sb_min, self.sb_max)
-             
-        self.sb_fig.canvas.draw()
-        
+    def updateSubscription(self):
+        """ When connected to an ingest daemon, only receive the beams that are shown """
+        if isinstance(getattr(self, "ingest", None), FanoutClient):
+            self.ingest.subscribe(self.subscribedBeams())
         
     def updateWaterfallThreshold(self):
         """ Change the threshold value for the waterfall plot """
-        self.wf_thr = float(self.wf_line_edit.text())
-        avg = np.average(self.wf_data[0][20:-20])
-        std = np.std(self.wf_data[0][20:-20])
-        self.wf_imshow.set_clim(avg - self.wf_thr*std , avg + self.wf_thr*std )
-        self.wf_fig.canvas.draw()
-
-    def updateAllPlots(self):
-        """ Redraw all graphs in GUI when new data arrives """ 
-        for elem in self.udpBuffer:
-            data = json.loads(elem)
-            
-            #print data.keys()
-            for key in data.keys():
-                self.keyLookup(key, data)
-        
-        # Redraw plots            
-        self.mb_fig.canvas.draw()
-        
-        self.p_fig.canvas.draw()
-        self.wf_fig.canvas.draw()
+        self.monitor.setWaterfallThreshold(float(self.wf_line_edit.text()))
 
-        self.ra_dec_text.set_text("RA: %2.2f, DEC: %2.2f"%(self.ra, self.dec))
-        # Clear buffer
-        self.udpCount = 0
-        self.udpBuffer.clear()    
 
 
 
 
+def serve():
+    """ Run headless as an ingest daemon, publishing the stream to viewers started with
+    --connect (over TCP) or --connect-shm (through shared memory) """
+    print "Starting HIPSR ingest daemon..."
+    if options.replay:
+        print "Replaying %s at %sx speed..."%(options.replay, options.speed or "max")
+        ingest = Replayer(options.replay, options.speed)
+    else:
+        recorder = Recorder(options.record) if options.record else None
+        print "Listening on %s port %s..."%(options.hostip, options.hostport)
+        ingest = IngestWorker(options.hostip, options.hostport, recorder=recorder, rcvbuf=options.rcvbuf_kib * 1024)
+    publishers = []
+    if options.serve:
+        host, port = parse_address(options.serve, "0.0.0.0")
+        server = FanoutServer(host, port)
+        server.start()
+        publishers.append(server)
+        print "Serving viewers on %s port %s..."%(host, port)
+    if options.serve_shm:
+        publishers.append(SharedSpectraWriter(options.serve_shm, options.nchan, wf_rows,
+                                              waterfall_tiers(3600 * options.history), wf_factor,
+                                              options.wf_reduce, ntime))
+        print "Serving viewers through shared memory %s..."%options.serve_shm
+    
+    ingest.start()
+    try:
+        while True:
+            frames = ingest.popFrames()
+            if not frames:
+                time.sleep(0.01)
+                continue
+            for publisher in publishers:
+                publisher.publish(frames)
+    except KeyboardInterrupt:
+        pass
+    
+    ingest.stop()
+    for publisher in publishers:
+        publisher.stop()
+        print "Published %i spectra"%publisher.n_published
+    print "Ingest: %(received)i received, %(decoded)i decoded, %(errors)i errors, " \
+          "%(dropped)i dropped"%ingest.stats()
 
 def main():
     print "Starting HIPSR User Interface..."
@@ -671,18 +739,7 @@ def main():
     sys.exit()    
 
 if __name__ == '__main__':
-    
-    # Option parsing to allow command line arguments to be parsed
-    p = OptionParser()
-    p.set_usage('hipsr_gui.py [options]')
-    p.set_description(__doc__)
-    p.add_option("-i", "--hostip", dest="hostip", type="string", default="127.0.0.1",
-                 help="change host IP address to run server. Default is localhost (127.0.0.1)")
-    p.add_option("-p", "--hostport", dest="hostport", type="int", default=59012,
-                 help="change host port for server. Default is 59012")
-    p.add_option("-b", "--buffer", dest="buffer", type="int", default=8192,
-                 help="change UDP buffer length. Default is 8192")
-
-    (options, args) = p.parse_args(sys.argv[1:])
-
-    main()
+    if options.serve or options.serve_shm:
+        serve()
+    else:
+        main()
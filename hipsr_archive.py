@@ -0,0 +1,167 @@
+"""
+hipsr_archive.py
+================
+
+On-disk archive of every spectrum received by the HIPSR GUI.
+
+Each beam is archived to its own pair of append-only files in the archive directory:
+
+* beam_XX.dat: a 16 byte header (the magic string ARCHIVE_MAGIC, a uint32 version and the
+  uint32 number of channels), followed by one (2, nchan) float32 record per spectrum,
+  xx then yy, in display channel order.
+* beam_XX.idx: the float64 UNIX timestamp of every record, in order.
+
+All values are little-endian. Both files are read through numpy memory maps, so looking
+back through hours of history only touches the records that are actually used, and the
+time index is searched with np.searchsorted. An archive left behind by a crash is trimmed
+to its last complete record when it is reopened, and can be appended to indefinitely.
+"""
+
+import os
+import struct
+
+import numpy as np
+
+ARCHIVE_MAGIC   = b"HIPSRARC"
+ARCHIVE_VERSION = 1
+ARCHIVE_HEADER  = struct.Struct("<8sII")
+
+
+class BeamArchive(object):
+    """ Append-only, memory-mapped archive of the spectra of one beam.
+
+    Parameters
+    ----------
+    filename: str
+        data file. The time index is stored next to it, with an .idx extension.
+    nchan: int
+        number of channels per polarisation. Must match an existing archive, unless it
+        holds no records yet, in which case it is started again at this channel count.
+    """
+    def __init__(self, filename, nchan=256):
+        self.filename = filename
+        self.index_filename = os.path.splitext(filename)[0] + ".idx"
+        self.nchan = nchan
+        self.record_size = 2 * nchan * 4
+
+        if os.path.exists(filename) and os.path.getsize(filename) >= ARCHIVE_HEADER.size:
+            with open(filename, 'rb') as fh:
+                magic, version, nchan = ARCHIVE_HEADER.unpack(fh.read(ARCHIVE_HEADER.size))
+            if magic != ARCHIVE_MAGIC:
+                raise ValueError("%s is not a HIPSR archive"%filename)
+            if version != ARCHIVE_VERSION:
+                raise ValueError("Unsupported archive version: %i"%version)
+            if nchan != self.nchan and self._hasRecords():
+                raise ValueError("%s holds %i channel spectra, not %i"%(filename, nchan, self.nchan))
+            create = nchan != self.nchan
+        else:
+            create = True
+        if create:
+            with open(filename, 'wb') as fh:
+                fh.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, self.nchan))
+
+        # Trim both files to the last record that made it into both
+        n_data  = (os.path.getsize(filename) - ARCHIVE_HEADER.size) // self.record_size
+        n_index = os.path.getsize(self.index_filename) // 8 if os.path.exists(self.index_filename) else 0
+        self.n_records = min(n_data, n_index)
+        with open(filename, 'r+b') as fh:
+            fh.truncate(ARCHIVE_HEADER.size + self.n_records * self.record_size)
+        with open(self.index_filename, 'ab') as fh:
+            fh.truncate(self.n_records * 8)
+
+        self.fh = open(filename, 'ab')
+        self.index_fh = open(self.index_filename, 'ab')
+        self._spectra = self._times = None   # Memory maps, recreated as the files grow
+        self._n_mapped = 0
+
+    def _hasRecords(self):
+        """ Whether the time index on disk holds at least one record """
+        return os.path.exists(self.index_filename) and os.path.getsize(self.index_filename) >= 8
+
+    def __len__(self):
+        return self.n_records
+
+    def append(self, spectrum, timestamp):
+        """ Append a (2, nchan) spectrum, xx then yy, taken at a UNIX time """
+        self.fh.write(np.asarray(spectrum, dtype='<f4').tobytes())
+        self.index_fh.write(struct.pack("<d", timestamp))
+        self.n_records += 1
+
+    def _map(self):
+        """ Map all records written so far """
+        if self._n_mapped == self.n_records:
+            return
+        self.fh.flush()
+        self.index_fh.flush()
+        if self.n_records:
+            self._spectra = np.memmap(self.filename, dtype='<f4', mode='r', offset=ARCHIVE_HEADER.size,
+                                      shape=(self.n_records, 2, self.nchan))
+            self._times = np.memmap(self.index_filename, dtype='<f8', mode='r', shape=(self.n_records,))
+        else:
+            self._spectra = np.zeros((0, 2, self.nchan), dtype='<f4')
+            self._times = np.zeros(0, dtype='<f8')
+        self._n_mapped = self.n_records
+
+    def spectra(self):
+        """ Return all archived spectra as a read-only (n, 2, nchan) memory map """
+        self._map()
+        return self._spectra
+
+    def times(self):
+        """ Return the timestamps of all archived spectra as a read-only memory map """
+        self._map()
+        return self._times
+
+    def indexAt(self, timestamp):
+        """ Return the index of the last spectrum taken at or before a UNIX time, or -1 """
+        return int(np.searchsorted(self.times(), timestamp, side='right')) - 1
+
+    def window(self, timestamp, nrows):
+        """ Return the nrows spectra up to and including a UNIX time, and their timestamps.
+
+        Only the records in the window are read from disk, when the arrays are used.
+        """
+        stop = self.indexAt(timestamp) + 1
+        start = max(0, stop - nrows)
+        return self.spectra()[start:stop], self.times()[start:stop]
+
+    def close(self):
+        self.fh.close()
+        self.index_fh.close()
+        self._spectra = self._times = None
+
+
+class SpectrumArchive(object):
+    """ Per-beam spectral archives kept in one directory.
+
+    Parameters
+    ----------
+    directory: str
+        archive directory, created if it does not exist. Existing archives are appended to.
+    beams: list
+        beam names, e.g. beam_01 .. beam_13. One BeamArchive is opened per beam.
+    nchan: int
+        number of channels per polarisation
+    """
+    def __init__(self, directory, beams, nchan=256):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.beams = {}
+        try:
+            for beam in beams:
+                self.beams[beam] = BeamArchive(os.path.join(directory, "%s.dat"%beam), nchan)
+        except ValueError:
+            self.close()
+            raise
+
+    def __getitem__(self, beam):
+        return self.beams[beam]
+
+    def append(self, beam, spectrum, timestamp):
+        """ Append a (2, nchan) spectrum of a beam """
+        self.beams[beam].append(spectrum, timestamp)
+
+    def close(self):
+        for archive in self.beams.values():
+            archive.close()
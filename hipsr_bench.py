@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+"""
+hipsr_bench.py
+==============
+
+Benchmarks for the HIPSR GUI data path. These run without Qt or a HIPSR backend.
+
+Benchmarks
+----------
+decode: compares decode throughput of JSON and binary beam packets, for a full
+        13-beam frame.
+gui:    end-to-end run of the GUI update path (HipsrMonitor) on the Agg backend, fed over
+        UDP by the synthetic packet generator. Reports packets/s decoded, frames/s
+        rendered, per-stage latency and packet loss.
+"""
+
+import sys
+import time
+import multiprocessing
+from optparse import OptionParser
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+
+import hipsr_ingest
+from hipsr_ingest import json, IngestWorker
+from hipsr_generator import PacketGenerator
+from hipsr_monitor import HipsrMonitor
+
+beam_ids = ["beam_%02i"%(ii+1) for ii in range(13)]
+
+
+def make_json_frame(nchan=256):
+    """ Create a JSON packet holding all 13 beams plus TCS keys, as sent by HIPSR """
+    data = {
+        "tcs-frequency" : 1355.0,
+        "tcs-bandwidth" : -400.0,
+        "tcs-ra"        : 10.0,
+        "tcs-dec"       : -20.0,
+        }
+    for beam in beam_ids:
+        data[beam] = {
+            "xx": np.round(np.random.random(nchan) * 100, 2).tolist(),
+            "yy": np.round(np.random.random(nchan) * 100, 2).tolist()
+            }
+    return json.dumps(data)
+
+
+def make_binary_frame(nchan=256):
+    """ Create the 13 binary packets that carry the same data as make_json_frame """
+    packets = []
+    for ii in range(13):
+        xx, yy = np.random.random(nchan) * 100, np.random.random(nchan) * 100
+        packets.append(hipsr_ingest.encode_binary_packet(ii+1, xx, yy, time.time(),
+                                                         1355.0, -400.0, 10.0, -20.0))
+    return packets
+
+
+def bench_decode(n_frames=500, nchan=256):
+    """ Time decode_packet on JSON and binary versions of a 13-beam frame.
+
+    Parameters
+    ----------
+    n_frames: int
+        number of 13-beam frames to decode in each format
+    nchan: int
+        number of channels per polarisation
+    """
+    json_frame = make_json_frame(nchan)
+    binary_frame = make_binary_frame(nchan)
+
+    t0 = time.time()
+    for ii in range(n_frames):
+        hipsr_ingest.decode_packet(json_frame)
+    t_json = time.time() - t0
+
+    t0 = time.time()
+    for ii in range(n_frames):
+        for packet in binary_frame:
+            hipsr_ingest.decode_packet(packet)
+    t_binary = time.time() - t0
+
+    print "Decode benchmark: %i frames of 13 beams x %i channels"%(n_frames, nchan)
+    print "  %-8s %10s %12s %12s"%("format", "bytes", "frames/s", "beams/s")
+    for name, t, nbytes in (("json", t_json, len(json_frame)),
+                            ("binary", t_binary, sum([len(p) for p in binary_frame]))):
+        print "  %-8s %10i %12.1f %12.1f"%(name, nbytes, n_frames / t, 13 * n_frames / t)
+    print "  binary speedup: %2.1fx"%(t_json / t_binary)
+
+
+def _run_generator(port, rate, duration, fmt, nchan, n_sent):
+    """ Generator process for bench_gui """
+    gen = PacketGenerator(nchan, fmt)
+    n_sent.value = gen.send("127.0.0.1", port, rate, duration)
+
+
+def bench_gui(duration=10.0, rate=1300.0, fmt='binary', nchan=256, fps=10.0,
+              views=("mb", "sb", "p", "wf", "wg"), port=59099, rcvbuf=None):
+    """ Run the GUI update path headless against synthetic UDP traffic.
+
+    The generator runs in a separate process. The monitor is driven exactly as the render
+    timer in hipsr-gui.py drives it: once per frame interval, all decoded frames are added
+    to history and then a frame is rendered unless the scheduler is behind.
+
+    Parameters
+    ----------
+    duration: float
+        seconds to send packets for
+    rate: float
+        beam spectra per second sent by the generator, over all beams
+    fmt: str
+        packet format, 'json' or 'binary'
+    nchan: int
+        number of channels per polarisation
+    fps: float
+        target frame rate
+    views: list
+        views to render, any of "mb", "sb", "p", "wf" and "wg"
+    port: int
+        local UDP port to use
+    rcvbuf: int
+        socket receive buffer size to request, in bytes. OS default if None.
+    """
+    monitor = HipsrMonitor(fps=fps, nchan=nchan)
+    for view in monitor.visible.keys():
+        monitor.setViewVisible(view, view in views)
+
+    ingest = IngestWorker("127.0.0.1", port, perf=monitor.perf, rcvbuf=rcvbuf)
+    ingest.start()
+    n_sent = multiprocessing.Value('i', 0)
+    generator = multiprocessing.Process(target=_run_generator,
+                                        args=(port, rate, duration, fmt, nchan, n_sent))
+
+    t_ingest, n_ingest = 0.0, 0
+    t_render, latencies = [], []
+    oldest_pending = None
+
+    generator.start()
+    t0 = time.time()
+    while generator.is_alive() or len(ingest.frames):
+        tick = time.time()
+        frames = ingest.popFrames()
+        monitor.ingestFrames(frames)
+        t_ingest += time.time() - tick
+        n_ingest += len(frames)
+        if frames and oldest_pending is None:
+            oldest_pending = frames[0].get("timestamp")
+
+        t_start = time.time()
+        if monitor.renderFrame():
+            t_end = time.time()
+            t_render.append(t_end - t_start)
+            if oldest_pending is not None:
+                latencies.append(t_end - oldest_pending)
+            oldest_pending = None
+
+        delay = tick + monitor.frame_interval - time.time()
+        if delay > 0:
+            time.sleep(delay)
+    t_total = time.time() - t0
+    generator.join()
+    ingest.stop()
+
+    stats = ingest.stats()
+    t_render = np.array(t_render) * 1e3
+    latencies = np.array(latencies) * 1e3
+    lost = n_sent.value - stats["received"]
+
+    print "GUI benchmark: %2.1f s of %s packets at %i spectra/s, %i channels, views: %s"%(
+          duration, fmt, rate, nchan, ",".join(views))
+    print "  packets sent       %10i"%n_sent.value
+    print "  packets received   %10i  (%2.2f%% lost in the kernel)"%(stats["received"],
+                                                                     100.0 * lost / max(n_sent.value, 1))
+    if stats["kernel_drops"] is not None:
+        print "  kernel drops       %10i  (%i byte socket buffer)"%(stats["kernel_drops"], stats["rcvbuf"])
+    print "  packets dropped    %10i  (ingest queue overflow, %i frames)"%(stats["dropped"],
+                                                                          ingest.frames.maxlen)
+    print "  decoded            %10.1f packets/s"%(stats["decoded"] / t_total)
+    print "  rendered           %10.1f frames/s  (%i skipped, target %2.1f)"%(
+          monitor.n_rendered / t_total, monitor.n_skipped, fps)
+    print "  decode             %10.1f us/packet"%stats["decode_us"]
+    print "  history update     %10.1f us/packet"%(1e6 * t_ingest / max(n_ingest, 1))
+    if len(t_render):
+        print "  render             %10.1f ms/frame  (p50 %2.1f, p99 %2.1f, max %2.1f)"%(
+              t_render.mean(), np.percentile(t_render, 50), np.percentile(t_render, 99), t_render.max())
+    blits = (monitor.mb_blit, monitor.sb_blit, monitor.p_blit, monitor.wf_blit)
+    print "  full redraws       %10i  (of %i canvas updates)"%(sum([b.n_full for b in blits]),
+                                                              sum([b.n_full + b.n_blit for b in blits]))
+    if len(latencies):
+        print "  end-to-end latency %10.1f ms  (p99 %2.1f)"%(latencies.mean(), np.percentile(latencies, 99))
+    print "  %-18s %10s %10s %10s"%("stage", "calls", "p50 (us)", "p99 (us)")
+    for name, stage in monitor.perf.summary()["stages"].items():
+        print "  %-18s %10i %10.1f %10.1f"%(name, stage["n"], stage["p50"], stage["p99"])
+
+
+if __name__ == '__main__':
+
+    p = OptionParser()
+    p.set_usage('hipsr_bench.py [options] [decode] [gui]')
+    p.set_description(__doc__)
+    p.add_option("-n", "--nframes", dest="nframes", type="int", default=500,
+                 help="number of 13-beam frames per benchmark. Default is 500")
+    p.add_option("-c", "--nchan", dest="nchan", type="int", default=256,
+                 help="number of channels per polarisation. Default is 256")
+    p.add_option("-t", "--duration", dest="duration", type="float", default=10.0,
+                 help="gui benchmark: seconds to send packets for. Default is 10")
+    p.add_option("-r", "--rate", dest="rate", type="float", default=1300.0,
+                 help="gui benchmark: beam spectra per second. Default is 1300 (100 Hz for 13 beams)")
+    p.add_option("-f", "--format", dest="fmt", type="choice", choices=["json", "binary"], default="binary",
+                 help="gui benchmark: packet format, json or binary. Default is binary")
+    p.add_option("--fps", dest="fps", type="float", default=10.0,
+                 help="gui benchmark: target frame rate. Default is 10")
+    p.add_option("--views", dest="views", type="string", default="mb,sb,p,wf,wg",
+                 help="gui benchmark: views to render. Default is all: mb,sb,p,wf,wg")
+    p.add_option("-p", "--port", dest="port", type="int", default=59099,
+                 help="gui benchmark: local UDP port. Default is 59099")
+    p.add_option("--rcvbuf-kib", dest="rcvbuf_kib", type="int", default=None,
+                 help="gui benchmark: socket receive buffer size, in KiB. Default is the OS default")
+
+    (options, args) = p.parse_args(sys.argv[1:])
+    benchmarks = args or ["decode", "gui"]
+
+    for name in benchmarks:
+        if name == "decode":
+            bench_decode(options.nframes, options.nchan)
+        elif name == "gui":
+            bench_gui(options.duration, options.rate, options.fmt, options.nchan, options.fps,
+                      options.views.split(","), options.port,
+                      options.rcvbuf_kib * 1024 if options.rcvbuf_kib else None)
+        else:
+            print "Error: unknown benchmark '%s'"%name
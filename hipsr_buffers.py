@@ -0,0 +1,285 @@
+"""
+hipsr_buffers.py
+================
+
+History buffers for the HIPSR GUI.
+
+These hold the per-beam waterfall and power histories. Appending a spectrum writes a single
+row in place, and an ordered copy is only assembled when a plot is actually drawn.
+"""
+
+import numpy as np
+
+
+class RingBuffer(object):
+    """ Fixed-length history of numpy rows, stored in a preallocated array.
+
+    New rows overwrite the oldest one at a moving write index, so an append costs
+    O(row size) instead of the O(nrows * row size) copy made by np.roll. Memory use
+    is constant.
+
+    Parameters
+    ----------
+    nrows: int
+        number of rows of history to keep
+    shape: int or tuple
+        shape of a single row
+    fill: float
+        initial value of every row
+    dtype: str
+        numpy data type of the buffer
+    data: np.array
+        storage to use instead of allocating it, e.g. a view onto shared memory, of shape
+        (nrows,) + shape. Its contents are kept; fill only applies to allocated storage.
+    """
+    def __init__(self, nrows, shape, fill=0.0, dtype='float64', data=None):
+        if isinstance(shape, int):
+            shape = (shape,)
+        self.nrows = nrows
+        if data is None:
+            data = np.empty((nrows,) + tuple(shape), dtype=dtype)
+            data.fill(fill)
+        self.data  = data
+        self.index = 0      # Row that the next append will overwrite
+        self.count = 0      # Total number of rows appended
+
+    def __len__(self):
+        return self.nrows
+
+    def append(self, row):
+        """ Overwrite the oldest row with a new one """
+        self.data[self.index] = row
+        self.index = (self.index + 1) % self.nrows
+        self.count += 1
+
+    def sync(self, count):
+        """ Move the write position to where count appends would have left it
+        
+        For storage that another process appends to, such as a shared memory block: the
+        rows are already there, and only the position and count are brought up to date.
+        """
+        self.count = int(count)
+        self.index = self.count % self.nrows
+
+    def latest(self):
+        """ Return the most recently appended row (a view, not a copy) """
+        return self.data[self.index - 1]
+
+    def ordered(self, out=None):
+        """ Return the history in time order, oldest row first.
+
+        Parameters
+        ----------
+        out: np.array
+            optional preallocated array to write into, of the same shape as the buffer.
+            Passing the same array on every call avoids allocating at draw time.
+        """
+        if out is None:
+            out = np.empty_like(self.data)
+        n = self.nrows - self.index
+        out[:n] = self.data[self.index:]
+        out[n:] = self.data[:self.index]
+        return out
+
+
+class MinMaxRingBuffer(RingBuffer):
+    """ RingBuffer that also keeps the minimum and maximum of everything it holds.
+
+    The extrema are updated incrementally on append. They are only recomputed from the
+    whole buffer when the row being overwritten held one of them, which for noisy data is
+    rare, so min() and max() cost O(1) amortized instead of a scan of the history.
+
+    Parameters are those of RingBuffer.
+    """
+    def __init__(self, nrows, shape, fill=0.0, dtype='float64', data=None):
+        super(MinMaxRingBuffer, self).__init__(nrows, shape, fill, dtype, data)
+        self._min = self._max = fill
+        self.stale = data is not None   # Extrema need recomputing from the whole buffer
+        self.n_rescans = 0   # Number of times that happened
+
+    def append(self, row):
+        """ Overwrite the oldest row with a new one, updating the extrema """
+        if not self.stale:
+            old = self.data[self.index]
+            if old.min() <= self._min or old.max() >= self._max:
+                self.stale = True
+        super(MinMaxRingBuffer, self).append(row)
+        if not self.stale:
+            new = self.data[self.index - 1]
+            self._min = min(self._min, new.min())
+            self._max = max(self._max, new.max())
+
+    def sync(self, count):
+        """ Move the write position, as RingBuffer.sync. The extrema are recomputed when
+        next asked for, as the rows appended elsewhere are not known. """
+        if count != self.count:
+            self.stale = True
+        super(MinMaxRingBuffer, self).sync(count)
+
+    def _rescan(self):
+        self._min, self._max = self.data.min(), self.data.max()
+        self.stale = False
+        self.n_rescans += 1
+
+    def min(self):
+        """ Return the smallest value held """
+        if self.stale:
+            self._rescan()
+        return self._min
+
+    def max(self):
+        """ Return the largest value held """
+        if self.stale:
+            self._rescan()
+        return self._max
+
+
+class PyramidBuffer(object):
+    """ Multi-resolution history: recent rows at full resolution, older rows decimated.
+
+    Tier 0 holds the most recent nrows rows as appended. Every factor rows appended to a
+    tier are reduced (averaged, or max-held) into one row of the next tier, so tier k spans
+    nrows * factor**k rows of history at 1/factor**k of the time resolution. Every tier has
+    the same number of rows, so memory use is fixed and drawing any tier costs the same.
+
+    Each row carries a timestamp, the time of the newest row it was reduced from.
+
+    Parameters
+    ----------
+    nrows: int
+        number of rows in each tier
+    shape: int or tuple
+        shape of a single row
+    ntiers: int
+        number of tiers, including full resolution
+    factor: int
+        decimation factor between neighbouring tiers
+    reduce: str
+        'mean' to average rows into the next tier, or 'max' to keep their maximum, which
+        keeps short bursts of RFI visible in the decimated tiers
+    fill: float
+        initial value of every row
+    dtype: str
+        numpy data type of the tiers
+    data, times: np.array
+        storage to use for the tiers and their timestamps instead of allocating it, e.g.
+        views onto shared memory, of shape (ntiers, nrows) + shape and (ntiers, nrows).
+        Their contents are kept, as for RingBuffer.
+    """
+    def __init__(self, nrows, shape, ntiers=1, factor=4, reduce='mean', fill=0.0, dtype='float32',
+                 data=None, times=None):
+        if isinstance(shape, int):
+            shape = (shape,)
+        if reduce not in ('mean', 'max'):
+            raise ValueError("reduce must be 'mean' or 'max', not %r"%reduce)
+        self.nrows  = nrows
+        self.shape  = tuple(shape)
+        self.factor = factor
+        self.reduce = reduce
+        self.fill   = fill
+        self.tiers  = [RingBuffer(nrows, shape, fill, dtype, None if data is None else data[ii])
+                       for ii in range(ntiers)]
+        self.times  = [RingBuffer(nrows, (), 0.0, data=None if times is None else times[ii])
+                       for ii in range(ntiers)]
+
+        # Rows waiting to be reduced into each tier above the first
+        self._acc = [np.zeros(shape) for ii in range(ntiers)]
+        self._n   = [0] * ntiers
+
+    def __len__(self):
+        return self.nrows
+
+    @property
+    def count(self):
+        """ Total number of rows appended """
+        return self.tiers[0].count
+
+    def span(self, tier):
+        """ Number of appended rows covered by a tier """
+        return self.nrows * self.factor**tier
+
+    def append(self, row, timestamp=0.0):
+        """ Append a row to the full resolution tier, cascading into coarser tiers """
+        self.tiers[0].append(row)
+        self.times[0].append(timestamp)
+        for tier in range(1, len(self.tiers)):
+            acc = self._acc[tier]
+            if self._n[tier] == 0:
+                acc[:] = row
+            elif self.reduce == 'max':
+                np.maximum(acc, row, out=acc)
+            else:
+                acc += row
+            self._n[tier] += 1
+            if self._n[tier] < self.factor:
+                return
+            if self.reduce == 'mean':
+                acc /= self.factor
+            self._n[tier] = 0
+            self.tiers[tier].append(acc)
+            self.times[tier].append(timestamp)
+            row = self.tiers[tier].latest()
+
+    def sync(self, counts):
+        """ Move the write position of every tier to where counts[tier] appends to it would
+        have left it. See RingBuffer.sync. """
+        for tier, count in enumerate(counts):
+            self.tiers[tier].sync(count)
+            self.times[tier].sync(count)
+
+    def load(self, rows, times):
+        """ Replace the history with a sequence of rows, as if they had been appended in order.
+
+        Each tier is reduced directly from the rows it covers, so only the last span() rows
+        of the coarsest tier are read. rows may be a memory map, e.g. from a BeamArchive.
+
+        Parameters
+        ----------
+        rows: np.array
+            rows to load, oldest first
+        times: np.array
+            timestamp of each row
+        """
+        n = len(rows)
+        for tier in range(len(self.tiers)):
+            size    = self.factor**tier
+            ngroups = n // size
+            used    = min(ngroups, self.nrows)
+            stop    = ngroups * size
+            start   = stop - used * size
+            
+            block = np.asarray(rows[start:stop]).reshape((used, size) + self.shape)
+            ring, ring_times = self.tiers[tier], self.times[tier]
+            ring.data.fill(self.fill)
+            ring_times.data.fill(0.0)
+            if self.reduce == 'max':
+                ring.data[:used] = block.max(axis=1)
+            else:
+                ring.data[:used] = block.mean(axis=1)
+            ring_times.data[:used] = times[start+size-1:stop:size]
+            for buf in (ring, ring_times):
+                buf.index = used % self.nrows
+                buf.count = ngroups
+            
+            # Rows of the tier below still waiting to complete a group of this tier
+            if tier:
+                below = size // self.factor
+                self._n[tier] = (n // below) % self.factor
+                if self._n[tier]:
+                    pending = np.asarray(rows[stop:(n // below) * below])
+                    if self.reduce == 'max':
+                        self._acc[tier][:] = pending.max(axis=0)
+                    else:
+                        self._acc[tier][:] = pending.sum(axis=0) / below
+
+    def latest(self):
+        """ Return the most recently appended full resolution row (a view, not a copy) """
+        return self.tiers[0].latest()
+
+    def ordered(self, tier=0, out=None):
+        """ Return a tier in time order, oldest row first. See RingBuffer.ordered. """
+        return self.tiers[tier].ordered(out)
+
+    def orderedTimes(self, tier=0):
+        """ Return the timestamps of a tier's rows, oldest first. Rows never written are 0. """
+        return self.times[tier].ordered()
@@ -0,0 +1,365 @@
+"""
+hipsr_fanout.py
+===============
+
+Fan-out of the HIPSR stream from one ingest daemon to any number of GUI viewers.
+
+Only one process can listen on the HIPSR UDP port, and every process that does repeats the
+full decode. Instead, hipsr-gui.py --serve runs headless: it receives and decodes the
+stream once and publishes it over TCP with a FanoutServer. GUIs started with --connect
+receive it through a FanoutClient, in place of their own UDP socket.
+
+Protocol
+--------
+A viewer connects and sends a subscription: one line of JSON, e.g.
+
+    {"beams": ["beam_01", "beam_02"], "nchan": 64, "rate": 2.0}
+
+* beams: beams to receive. The viewer only asks for the beams its visible views show.
+* nchan: if given, spectra are averaged down to this many channels before sending.
+* rate: if given, at most this many spectra per second are sent per beam.
+
+A new line replaces the subscription at any time. Newly subscribed beams are first sent
+the recent history the daemon keeps for them, at the subscribed rate, so a viewer's
+waterfall and power monitor fill at once; a beam subscribed to again only gets the
+history it has not been sent yet. The daemon sends one message per beam spectrum: a
+uint32 little-endian length followed by a binary beam packet (see hipsr_ingest.py), so
+the viewer decodes it exactly as it would a UDP datagram. A viewer that cannot keep up
+loses its oldest messages; it never slows the daemon or the other viewers down.
+"""
+
+import select
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+from hipsr_ingest import json, encode_binary_packet, FrameSource
+
+MESSAGE_HEADER = struct.Struct("<I")
+HISTORY_LEN = 150       # Spectra of history the daemon keeps per beam
+
+
+def parse_address(address, default_host="127.0.0.1"):
+    """ Split a [host:]port string into host and port """
+    if ":" in address:
+        host, port = address.rsplit(":", 1)
+        return host, int(port)
+    return default_host, int(address)
+
+
+def downsample(spectrum, nchan):
+    """ Average a spectrum down to nchan channels, if its length is a multiple of nchan """
+    if not nchan or spectrum.size <= nchan or spectrum.size % nchan:
+        return spectrum
+    return spectrum.reshape(nchan, -1).mean(axis=1)
+
+
+class ViewerConnection(threading.Thread):
+    """ Thread that serves one viewer: reads its subscriptions, writes its messages.
+
+    Parameters
+    ----------
+    sock: socket
+        connected viewer socket
+    address: tuple
+        viewer address, for logging
+    server: FanoutServer
+        server that owns the connection
+    maxlen: int
+        maximum number of messages waiting to be sent. The oldest are dropped.
+    """
+    def __init__(self, sock, address, server, maxlen=4096):
+        super(ViewerConnection, self).__init__()
+        self.daemon = True
+        self.sock = sock
+        self.address = address
+        self.server = server
+        self.messages = deque(maxlen=maxlen)
+        self.wakeup = threading.Event()
+
+        self.beams = set()
+        self.nchan = None
+        self.rate  = None
+        self.last_sent = {}     # Timestamp of the last spectrum sent, per beam
+        self.n_sent = 0
+        self.n_dropped = 0
+        self.closed = False
+
+    def wants(self, beam, timestamp):
+        """ Whether the viewer should be sent a spectrum of a beam taken at a UNIX time """
+        if beam not in self.beams:
+            return False
+        last = self.last_sent.get(beam)
+        if self.rate and last is not None and timestamp - last < 1.0 / self.rate:
+            return False
+        self.last_sent[beam] = timestamp
+        return True
+
+    def send(self, message):
+        """ Queue a binary beam packet for sending """
+        if len(self.messages) == self.messages.maxlen:
+            self.n_dropped += 1
+        self.messages.append(message)
+        self.wakeup.set()
+
+    def subscribe(self, subscription):
+        """ Apply a subscription message
+        
+        Holds the server lock, so that publish() cannot queue live spectra in between, or
+        ahead of, the history sent for newly subscribed beams.
+        """
+        with self.server.lock:
+            beams = set(subscription.get("beams", []))
+            added = beams - self.beams
+            self.nchan = subscription.get("nchan")
+            self.rate  = subscription.get("rate")
+            self.beams = beams
+            for beam in sorted(added):
+                self.server.sendHistory(self, beam)
+
+    def run(self):
+        """ Connection loop: apply subscriptions, and send queued messages
+        
+        Sends block this thread only. While a viewer is not reading, messages pile up in
+        the queue, which drops the oldest; the connection is only closed when the viewer
+        disconnects.
+        """
+        self.sock.setblocking(True)
+        pending = ""
+        try:
+            while not self.server.stopped:
+                readable, _, _ = select.select([self.sock], [], [], 0)
+                if readable:
+                    data = self.sock.recv(4096)
+                    if not data:
+                        break
+                    pending += data
+                    while "\n" in pending:
+                        line, pending = pending.split("\n", 1)
+                        if line.strip():
+                            self.subscribe(json.loads(line))
+
+                self.wakeup.clear()
+                while True:
+                    try:
+                        message = self.messages.popleft()
+                    except IndexError:
+                        break
+                    self.sock.sendall(MESSAGE_HEADER.pack(len(message)) + message)
+                    self.n_sent += 1
+                self.wakeup.wait(0.05)
+        except (socket.error, ValueError):
+            pass
+        self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.sock.close()
+            self.server.removeViewer(self)
+
+    def shutdown(self):
+        """ Unblock a send to a viewer that is not reading, so that run() can return """
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+
+class FanoutServer(threading.Thread):
+    """ TCP server that publishes decoded HIPSR spectra to subscribed viewers.
+
+    Parameters
+    ----------
+    host: str
+        IP address to listen on for viewers
+    port: int
+        TCP port to listen on for viewers
+    history: int
+        number of recent spectra kept per beam, sent to viewers when they subscribe
+    """
+    def __init__(self, host, port, history=HISTORY_LEN):
+        super(FanoutServer, self).__init__()
+        self.daemon = True
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((str(host), int(port)))
+        self.sock.listen(16)
+        self.sock.settimeout(0.2)
+
+        self.viewers = []
+        self.lock = threading.Lock()
+        self.stopped = False
+
+        # Latest TCS values, which JSON packets may send separately from the beams
+        self.tcs = {"tcs-frequency": 0.0, "tcs-bandwidth": 0.0, "tcs-ra": 0.0, "tcs-dec": 0.0}
+        self.history = {}
+        self.history_len = history
+        self.n_published = 0
+
+    def run(self):
+        """ Accept viewers until stop() is called """
+        while not self.stopped:
+            try:
+                conn, address = self.sock.accept()
+            except socket.timeout:
+                continue
+            except socket.error:
+                break
+            print "Viewer connected from %s:%s"%address
+            viewer = ViewerConnection(conn, address, self)
+            with self.lock:
+                self.viewers.append(viewer)
+            viewer.start()
+
+    def removeViewer(self, viewer):
+        with self.lock:
+            if viewer in self.viewers:
+                self.viewers.remove(viewer)
+                print "Viewer %s:%s disconnected"%viewer.address
+
+    def encode(self, beam, xx, yy, timestamp, tcs, nchan):
+        """ Encode a spectrum as a binary beam packet, averaged down to nchan channels """
+        return encode_binary_packet(int(beam[-2:]), downsample(xx, nchan), downsample(yy, nchan), timestamp,
+                                    tcs["tcs-frequency"], tcs["tcs-bandwidth"], tcs["tcs-ra"], tcs["tcs-dec"])
+
+    def sendHistory(self, viewer, beam):
+        """ Send the recent history of a beam to a viewer that just subscribed to it
+        
+        Only spectra newer than the last one the viewer was sent are included, so a beam
+        subscribed to again does not get duplicate rows, and they are thinned to the
+        viewer's rate as live spectra are. Call with the lock held.
+        """
+        last = viewer.last_sent.get(beam)
+        for xx, yy, timestamp, tcs in self.history.get(beam, ()):
+            if last is not None and timestamp <= last:
+                continue
+            if viewer.wants(beam, timestamp):
+                viewer.send(self.encode(beam, xx, yy, timestamp, tcs, viewer.nchan))
+
+    def publish(self, frames):
+        """ Send decoded frames to the viewers subscribed to their beams
+
+        Each spectrum is encoded once per channel count requested, however many viewers
+        receive it. Sending only queues messages, so holding the lock throughout is short.
+        """
+        with self.lock:
+            for data in frames:
+                for key in self.tcs:
+                    if key in data:
+                        self.tcs[key] = float(data[key])
+                timestamp = float(data.get("timestamp", time.time()))
+                for beam in data:
+                    if not str(beam).startswith("beam_"):
+                        continue
+                    xx, yy = data[beam]["xx"], data[beam]["yy"]
+                    tcs = dict(self.tcs)
+                    if beam not in self.history:
+                        self.history[beam] = deque(maxlen=self.history_len)
+                    self.history[beam].append((xx, yy, timestamp, tcs))
+
+                    encoded = {}
+                    for viewer in self.viewers:
+                        if not viewer.wants(beam, timestamp):
+                            continue
+                        if viewer.nchan not in encoded:
+                            encoded[viewer.nchan] = self.encode(beam, xx, yy, timestamp, tcs, viewer.nchan)
+                        viewer.send(encoded[viewer.nchan])
+                    self.n_published += 1
+
+    def stop(self):
+        """ Stop accepting viewers and disconnect the connected ones """
+        self.stopped = True
+        if self.is_alive():
+            self.join()
+        self.sock.close()
+        with self.lock:
+            viewers = list(self.viewers)
+        for viewer in viewers:
+            viewer.shutdown()
+            viewer.join(1.0)
+
+
+class FanoutClient(FrameSource):
+    """ Thread that receives HIPSR spectra from an ingest daemon, in place of UDP.
+
+    Parameters
+    ----------
+    host: str
+        daemon IP address
+    port: int
+        daemon TCP port
+    beams: list
+        beams to subscribe to initially
+    nchan: int
+        channels per spectrum to ask for, or None for full resolution
+    rate: float
+        maximum spectra per second per beam to ask for, or None for all
+    maxlen: int
+        Maximum number of decoded frames waiting for the GUI. By default, enough for the
+        history the daemon sends when all 13 beams are subscribed to at once.
+    perf: PerfMonitor
+        if given, decode times are recorded here
+    """
+    def __init__(self, host, port, beams=(), nchan=None, rate=None, maxlen=None, perf=None):
+        super(FanoutClient, self).__init__(maxlen or max(1024, HISTORY_LEN * 13), perf)
+        self.host = host
+        self.port = port
+        self.nchan = nchan
+        self.rate = rate
+        self.sock = socket.create_connection((str(host), int(port)))
+        self.sock.settimeout(0.2)
+        self.beams = None
+        self.connected = True
+        self.subscribe(beams)
+
+    def subscribe(self, beams):
+        """ Ask the daemon for a new set of beams. Does nothing if the set is unchanged,
+        or once the daemon has disconnected. """
+        beams = sorted(beams)
+        if beams == self.beams or not self.connected:
+            return
+        self.beams = beams
+        message = {"beams": beams, "nchan": self.nchan, "rate": self.rate}
+        try:
+            self.sock.sendall(json.dumps(message) + "\n")
+        except socket.error, e:
+            self.connected = False
+            print "Warning: lost connection to ingest daemon at %s port %s: %s"%(self.host, self.port, e)
+
+    def _recvExactly(self, nbytes):
+        """ Read nbytes from the socket, or return None when stopped or disconnected """
+        chunks, remaining = [], nbytes
+        while remaining:
+            try:
+                chunk = self.sock.recv(remaining)
+            except socket.timeout:
+                if self._stop_event.is_set():
+                    return None
+                continue
+            except socket.error:
+                return None
+            if not chunk:
+                return None
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return "".join(chunks)
+
+    def run(self):
+        """ Receive loop: read, decode and queue messages until stop() is called """
+        while not self._stop_event.is_set():
+            header = self._recvExactly(MESSAGE_HEADER.size)
+            if header is None:
+                break
+            message = self._recvExactly(MESSAGE_HEADER.unpack(header)[0])
+            if message is None:
+                break
+            self.queueDatagram(message)
+        self.connected = False
+
+    def stop(self):
+        """ Stop the receive loop and disconnect """
+        super(FanoutClient, self).stop()
+        self.sock.close()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+hipsr_generator.py
+==================
+
+Synthetic HIPSR packet generator.
+
+Sends realistic 13-beam multibeam data to a UDP port, so the GUI can be run and tuned
+without a live HIPSR backend. Each beam has a bandpass-shaped spectrum per polarisation
+with per-beam gains, radiometer noise and a few intermittent RFI spikes, sent together
+with the TCS frequency, bandwidth and a slowly drifting RA/Dec.
+
+Frames of all 13 beams are sent either as a single JSON packet, as HIPSR sends them
+(beam_01 to beam_13, tcs-frequency, tcs-bandwidth, tcs-ra, tcs-dec and timestamp keys),
+or as 13 packets in the binary format described in hipsr_ingest.py, one per beam.
+"""
+
+import sys
+import time
+import socket
+from optparse import OptionParser
+
+import numpy as np
+
+import hipsr_ingest
+from hipsr_ingest import json
+
+MAX_DATAGRAM = 65507    # Largest UDP payload over IPv4
+
+
+class PacketGenerator(object):
+    """ Generates synthetic HIPSR beam packets.
+
+    Parameters
+    ----------
+    nchan: int
+        number of channels per polarisation
+    fmt: str
+        packet format, 'json' or 'binary'
+    frequency, bandwidth: float
+        TCS centre frequency and bandwidth, in MHz
+    seed: int
+        random seed, so that runs are reproducible
+    """
+    def __init__(self, nchan=256, fmt='binary', frequency=1355.0, bandwidth=-400.0, seed=0):
+        self.nchan = nchan
+        self.fmt = fmt
+        self.frequency = frequency
+        self.bandwidth = bandwidth
+        self.rng = np.random.RandomState(seed)
+
+        # Bandpass: flat top, rolling off towards the band edges
+        x = np.linspace(-1, 1, nchan)
+        self.bandpass = 50 * (1 - 0.9 * x**8) * (1 + 0.05 * np.sin(6 * np.pi * x))
+        self.gains = 1 + 0.1 * self.rng.standard_normal((13, 2))
+        self.rfi_chans = self.rng.randint(0, nchan, 4)
+
+        self.ra, self.dec = 180.0, -45.0
+        self.n_generated = 0
+
+    def spectra(self, beam):
+        """ Return synthetic xx and yy spectra for a beam (1-13) """
+        xx = self.bandpass * self.gains[beam-1, 0]
+        yy = self.bandpass * self.gains[beam-1, 1]
+        xx = xx * (1 + 0.01 * self.rng.standard_normal(self.nchan))
+        yy = yy * (1 + 0.01 * self.rng.standard_normal(self.nchan))
+        for chan in self.rfi_chans:
+            if self.rng.random_sample() < 0.2:
+                xx[chan] += 20 * self.rng.random_sample()
+                yy[chan] += 20 * self.rng.random_sample()
+        return xx, yy
+
+    def frame(self):
+        """ Return the datagrams of the next frame of all 13 beams: a single JSON packet,
+        or one binary packet per beam """
+        timestamp = time.time()
+        self.ra  = (self.ra + 1e-4) % 360
+        self.dec = self.dec + 1e-5
+        self.n_generated += 13
+
+        if self.fmt == 'binary':
+            packets = []
+            for beam in range(1, 14):
+                xx, yy = self.spectra(beam)
+                packets.append(hipsr_ingest.encode_binary_packet(beam, xx, yy, timestamp, self.frequency,
+                                                                 self.bandwidth, self.ra, self.dec))
+            return packets
+        data = {
+            "tcs-frequency" : self.frequency,
+            "tcs-bandwidth" : self.bandwidth,
+            "tcs-ra"        : self.ra,
+            "tcs-dec"       : self.dec,
+            "timestamp"     : timestamp,
+            }
+        for beam in range(1, 14):
+            # Two decimals, so that a frame of 256 channels fits in one datagram
+            xx, yy = self.spectra(beam)
+            data["beam_%02i"%beam] = {"xx": np.round(xx, 2).tolist(), "yy": np.round(yy, 2).tolist()}
+        return [json.dumps(data)]
+
+    def send(self, host, port, rate, duration=None):
+        """ Send frames of all 13 beams at a fixed rate.
+
+        Parameters
+        ----------
+        host: str
+            destination IP address
+        port: int
+            destination UDP port
+        rate: float
+            beam spectra per second, over all beams. A JSON packet holds 13, a binary
+            packet one.
+        duration: float
+            seconds to run for. Runs until interrupted if None.
+
+        Returns the number of packets sent.
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        per_packet = 1 if self.fmt == 'binary' else 13
+        n_sent = 0
+        t0 = time.time()
+        try:
+            while duration is None or time.time() - t0 < duration:
+                for datagram in self.frame():
+                    if len(datagram) > MAX_DATAGRAM:
+                        raise ValueError("A %i byte packet does not fit in a UDP datagram. Use fewer "
+                                         "channels or the binary format."%len(datagram))
+                    sock.sendto(datagram, (host, port))
+                    n_sent += 1
+
+                    # Pace sending against the start time, so the average rate stays exact
+                    delay = t0 + n_sent * per_packet / float(rate) - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sock.close()
+        return n_sent
+
+
+if __name__ == '__main__':
+
+    p = OptionParser()
+    p.set_usage('hipsr_generator.py [options]')
+    p.set_description(__doc__)
+    p.add_option("-i", "--hostip", dest="hostip", type="string", default="127.0.0.1",
+                 help="destination IP address. Default is localhost (127.0.0.1)")
+    p.add_option("-p", "--hostport", dest="hostport", type="int", default=59012,
+                 help="destination UDP port. Default is 59012")
+    p.add_option("-r", "--rate", dest="rate", type="float", default=130.0,
+                 help="beam spectra per second, over all beams. Default is 130 (10 Hz for 13 beams)")
+    p.add_option("-t", "--duration", dest="duration", type="float", default=None,
+                 help="seconds to send for. Default is to run until interrupted")
+    p.add_option("-c", "--nchan", dest="nchan", type="int", default=256,
+                 help="number of channels per polarisation. Default is 256")
+    p.add_option("-f", "--format", dest="fmt", type="choice", choices=["json", "binary"], default="json",
+                 help="packet format, json or binary. Default is json")
+
+    (options, args) = p.parse_args(sys.argv[1:])
+
+    gen = PacketGenerator(options.nchan, options.fmt)
+    print "Sending %s packets to %s port %s at %s spectra/s..."%(options.fmt, options.hostip,
+                                                               options.hostport, options.rate)
+    n_sent = gen.send(options.hostip, options.hostport, options.rate, options.duration)
+    print "Sent %i packets"%n_sent
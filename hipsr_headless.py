@@ -0,0 +1,242 @@
+"""
+hipsr_headless.py
+=================
+
+Headless rendering of the HIPSR monitor to PNG snapshots or video, without Qt or a
+display. Started with hipsr-gui.py --headless; all the GUI's data source options
+(UDP, --replay, --connect, --connect-shm) work as usual.
+
+The main process only receives and decodes the stream. Every view that is written out
+gets its own worker process (a ViewRenderer), which runs the same HipsrMonitor data path
+as the GUI on the Agg backend with only that view visible, so the figures render in
+parallel. Decoded frames are passed to every worker; a worker that falls behind loses
+frames, never the main process.
+
+Output
+------
+Each worker renders its view at most once per --snapshot-interval seconds, and writes it
+to the --snapshot-dir directory as:
+
+* VIEW.png, replaced atomically each time, e.g. for an observatory status page, or
+* VIEW.mp4 with --video, one video frame per snapshot, encoded by ffmpeg.
+
+Frames are taken from the canvas after a blitted update, so a snapshot costs no more
+than a frame in the GUI.
+"""
+
+import os
+import time
+import signal
+import subprocess
+import multiprocessing
+from Queue import Empty, Full
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import pylab as plt
+
+from hipsr_ingest import IngestWorker, Replayer
+from hipsr_fanout import FanoutClient, parse_address
+from hipsr_shm import SharedMemorySource
+from hipsr_monitor import HipsrMonitor, parse_beams
+
+view_names = {"mb": "multibeam", "sb": "beamscope", "p": "power", "wf": "waterfall", "wg": "waterfalls"}
+batch_interval = 0.1    # Seconds of frames passed to the renderers at a time
+
+
+class ViewRenderer(multiprocessing.Process):
+    """ Worker process that renders one view of the monitor to PNG or video.
+
+    Parameters
+    ----------
+    view: str
+        view to render, "mb", "sb", "p", "wf" or "wg"
+    directory: str
+        output directory
+    interval: float
+        minimum seconds between snapshots
+    size: tuple
+        (width, height) of the output, in pixels
+    video: bool
+        if True, frames are encoded into a video instead of written as PNG files
+    monitor_args: dict
+        keyword arguments for the worker's HipsrMonitor
+    maxlen: int
+        maximum number of frame batches waiting for the worker. Further batches are
+        dropped, and counted in n_dropped.
+    """
+    def __init__(self, view, directory, interval=10.0, size=(800, 600), video=False, monitor_args=None,
+                 maxlen=256):
+        super(ViewRenderer, self).__init__()
+        self.daemon = True
+        self.view = view
+        self.interval = float(interval)
+        self.size = size
+        self.video = video
+        self.monitor_args = monitor_args or {}
+        self.queue = multiprocessing.Queue(maxlen)
+        self.ready = multiprocessing.Event()
+        self.n_dropped = 0
+        extension = "mp4" if video else "png"
+        self.filename = os.path.join(directory, "%s.%s"%(view_names[view], extension))
+
+    def send(self, frames):
+        """ Pass decoded frames to the worker, without waiting """
+        try:
+            self.queue.put_nowait(frames)
+        except Full:
+            self.n_dropped += 1
+
+    def finish(self):
+        """ Ask the worker to write its last snapshot and exit, then wait for it """
+        self.queue.put(None)
+        self.join()
+
+    def createMonitor(self):
+        """ Create a monitor that only renders this view, at the output size """
+        monitor = HipsrMonitor(**self.monitor_args)
+        for view in monitor.visible.keys():
+            monitor.setViewVisible(view, view == self.view)
+        canvas = monitor.canvas(self.view)
+        canvas.figure.set_size_inches(self.size[0] / canvas.figure.dpi, self.size[1] / canvas.figure.dpi)
+        monitor.onMultiBeamResize()
+        for blit in (monitor.mb_blit, monitor.sb_blit, monitor.p_blit, monitor.wf_blit, monitor.wg_blit):
+            blit.invalidate()
+        return monitor
+
+    def openVideo(self, width, height):
+        """ Start an ffmpeg process encoding raw RGBA frames from its stdin """
+        command = ["ffmpeg", "-y", "-loglevel", "error",
+                   "-f", "rawvideo", "-pix_fmt", "rgba", "-s", "%ix%i"%(width, height),
+                   "-r", "%f"%(1.0 / self.interval), "-i", "-",
+                   "-pix_fmt", "yuv420p", self.filename]
+        try:
+            return subprocess.Popen(command, stdin=subprocess.PIPE)
+        except OSError:
+            print "Error: cannot run ffmpeg, which is needed for --video. Writing PNG snapshots instead."
+            self.video = False
+            self.filename = os.path.splitext(self.filename)[0] + ".png"
+            return None
+
+    def snapshot(self, monitor, encoder):
+        """ Render the view and write it out """
+        monitor.updateAllPlots()
+        canvas = monitor.canvas(self.view)
+        width, height = canvas.get_width_height()
+        image = np.frombuffer(canvas.buffer_rgba(), dtype='uint8').reshape(height, width, 4)
+        if encoder is not None:
+            encoder.stdin.write(image.tobytes())
+        else:
+            # Write then rename, so readers never see a partly written file
+            partial = self.filename + ".part"
+            plt.imsave(partial, image, format='png')
+            os.rename(partial, self.filename)
+
+    def run(self):
+        """ Worker loop: add frames to history, and render at most once per interval """
+        # Ctrl-C is handled by the main process, which then calls finish()
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        monitor = self.createMonitor()
+        encoder = None
+        if self.video:
+            width, height = monitor.canvas(self.view).get_width_height()
+            encoder = self.openVideo(width, height)
+        self.ready.set()
+
+        next_snapshot = 0.0
+        finished = False
+        try:
+            while not finished:
+                try:
+                    frames = self.queue.get(timeout=0.1)
+                except Empty:
+                    frames = []
+                if frames is None:
+                    finished = True
+                else:
+                    monitor.ingestFrames(frames)
+
+                now = time.time()
+                if monitor.received.any() and (now >= next_snapshot or finished):
+                    next_snapshot = now + self.interval
+                    self.snapshot(monitor, encoder)
+        finally:
+            if encoder is not None:
+                encoder.stdin.close()
+                encoder.wait()
+
+
+def open_source(options, perf=None):
+    """ Open the data source selected by the command line options """
+    if options.connect_shm:
+        print "Reading from ingest daemon shared memory %s..."%options.connect_shm
+        return SharedMemorySource(options.connect_shm, perf=perf)
+    if options.connect:
+        host, port = parse_address(options.connect)
+        print "Connecting to ingest daemon at %s port %s..."%(host, port)
+        return FanoutClient(host, port, parse_beams(options.beams), nchan=options.subscribe_nchan or None,
+                            rate=options.subscribe_rate or None, perf=perf)
+    if options.replay:
+        print "Replaying %s at %sx speed..."%(options.replay, options.speed or "max")
+        return Replayer(options.replay, options.speed, perf=perf)
+    print "Listening on %s port %s..."%(options.hostip, options.hostport)
+    return IngestWorker(options.hostip, options.hostport, perf=perf, rcvbuf=options.rcvbuf_kib * 1024)
+
+
+def run(options):
+    """ Run headless: receive the stream, and render snapshots until interrupted
+
+    A replay ends when the recording has been rendered in full.
+    """
+    print "Starting HIPSR headless renderer..."
+    if not os.path.isdir(options.snapshot_dir):
+        os.makedirs(options.snapshot_dir)
+    width, height = [int(n) for n in options.snapshot_size.lower().split("x")]
+    monitor_args = {
+        "history": 3600 * options.history,
+        "wf_reduce": options.wf_reduce,
+        "nchan": options.nchan,
+        "beams": parse_beams(options.beams),
+        "rfi_sigma": options.rfi_sigma,
+        }
+
+    renderers = []
+    for view in options.snapshot_views.split(","):
+        renderer = ViewRenderer(view, options.snapshot_dir, options.snapshot_interval,
+                                (width - width % 2, height - height % 2), options.video, monitor_args)
+        print "Writing %s every %2.1f s"%(renderer.filename, options.snapshot_interval)
+        renderers.append(renderer)
+        renderer.start()
+
+    for renderer in renderers:
+        renderer.ready.wait()
+    
+    # Frames are passed on in batches, to keep pickling and queue overheads down
+    source = open_source(options)
+    source.start()
+    n_frames, batch, t_batch = 0, [], time.time()
+    try:
+        while True:
+            frames = source.popFrames()
+            batch += frames
+            done = isinstance(source, Replayer) and not source.is_alive() and not frames
+            if batch and (time.time() - t_batch > batch_interval or done):
+                n_frames += len(batch)
+                for renderer in renderers:
+                    renderer.send(batch)
+                batch, t_batch = [], time.time()
+            if done:
+                break
+            if not frames:
+                time.sleep(0.01)
+    except KeyboardInterrupt:
+        pass
+
+    source.stop()
+    for renderer in renderers:
+        renderer.finish()
+    print "Ingest: %(received)i received, %(decoded)i decoded, %(errors)i errors, " \
+          "%(dropped)i dropped"%source.stats()
+    print "Passed on %i frames. Batches dropped by slow renderers: %s"%(
+          n_frames, ", ".join(["%s %i"%(r.view, r.n_dropped) for r in renderers]))
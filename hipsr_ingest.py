@@ -0,0 +1,490 @@
+"""
+hipsr_ingest.py
+===============
+
+Background UDP ingest for the HIPSR GUI.
+
+The ingest worker owns the UDP socket and decodes every packet into ready-to-plot numpy
+arrays on its own thread, so that slow matplotlib redraws on the Qt event loop never stand
+between the kernel socket buffer and the decoder. Decoded frames are handed over to the GUI
+through a bounded deque: appends and pops on a deque are atomic, so no locking is needed.
+
+Packet formats
+--------------
+Two wire formats are understood, told apart by the first byte of the datagram:
+
+* JSON: a dictionary with any of the keys tcs-frequency, tcs-bandwidth, tcs-ra, tcs-dec and
+  beam_01 .. beam_13, where each beam is {"xx": [...], "yy": [...]}. Starts with '{'.
+* Binary: one beam per datagram, a fixed little-endian header followed by the raw float32
+  xx and yy spectra. Starts with BINARY_MAGIC. The header is, in order:
+
+  ======= ============= =====================================
+  uint8   magic         BINARY_MAGIC (0xB7)
+  uint8   version       BINARY_VERSION
+  uint16  beam          beam number, 1-13
+  uint32  nchan         number of channels per polarisation
+  float64 timestamp     UNIX time the spectrum was taken
+  float64 tcs-frequency centre frequency (MHz)
+  float64 tcs-bandwidth bandwidth (MHz), negative if inverted
+  float64 tcs-ra        right ascension
+  float64 tcs-dec       declination
+  ======= ============= =====================================
+
+  The header is 48 bytes long, so the float32 payload that follows stays aligned and is
+  decoded with np.frombuffer without copying.
+
+Socket buffering
+----------------
+Packets arrive in bursts of 13 beams, so the kernel socket receive buffer (SO_RCVBUF) has to
+hold a whole burst while the ingest thread is busy. Its size is set from the GUI's
+--rcvbuf-kib option; the kernel may grant less than requested (on Linux, up to
+net.core.rmem_max), so the granted size is read back and reported. Datagrams the kernel discards because the buffer was
+full are read from /proc/net/udp, where available.
+
+Recording and replay
+--------------------
+A Recorder writes every raw datagram and its receive time to disk, and a Replayer feeds a
+recording back through the same decode path at real time, N times real time or as fast as
+the GUI can take it.
+"""
+
+import os
+import mmap
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+try:
+    print "Using uJson"
+    import ujson as json
+except:
+    print "Warning: uJson not installed. Reverting to python's native Json (slower)"
+    import json
+
+BINARY_MAGIC   = 0xB7
+BINARY_VERSION = 1
+BINARY_HEADER  = struct.Struct("<BBHI5d")
+
+_binary_magic_byte = struct.pack("<B", BINARY_MAGIC)
+
+RECORDING_MAGIC   = b"HIPSRREC"
+RECORDING_VERSION = 1
+RECORDING_HEADER  = struct.Struct("<8sII")
+RECORD_HEADER     = struct.Struct("<dI")
+
+# A 256 channel binary beam packet; used to turn socket buffer sizes into packet counts
+TYPICAL_PACKET_SIZE = BINARY_HEADER.size + 2 * 4 * 256
+
+
+def encode_binary_packet(beam, xx, yy, timestamp=0.0, frequency=0.0, bandwidth=0.0, ra=0.0, dec=0.0):
+    """ Pack a single beam spectrum into a binary HIPSR packet.
+
+    Parameters
+    ----------
+    beam: int
+        beam number, 1-13
+    xx, yy: array_like
+        spectra for the two polarisations, of equal length
+    timestamp: float
+        UNIX time the spectrum was taken
+    frequency, bandwidth: float
+        TCS centre frequency and bandwidth, in MHz
+    ra, dec: float
+        TCS pointing
+    """
+    xx = np.asarray(xx, dtype='<f4')
+    yy = np.asarray(yy, dtype='<f4')
+    header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, beam, xx.size,
+                                timestamp, frequency, bandwidth, ra, dec)
+    return header + xx.tostring() + yy.tostring()
+
+
+def decode_binary_packet(datagram):
+    """ Decode a binary HIPSR packet into a dictionary of ready-to-plot values.
+
+    The spectra are read-only numpy views onto the datagram itself; no per-channel
+    Python objects are created.
+
+    Parameters
+    ----------
+    datagram: str
+        raw UDP payload
+    """
+    magic, version, beam, nchan, timestamp, freq, bw, ra, dec = BINARY_HEADER.unpack_from(datagram)
+    if version != BINARY_VERSION:
+        raise ValueError("Unsupported binary packet version: %i"%version)
+    spectra = np.frombuffer(datagram, dtype='<f4', count=2*nchan, offset=BINARY_HEADER.size)
+    return {
+        "timestamp"     : timestamp,
+        "tcs-frequency" : freq,
+        "tcs-bandwidth" : bw,
+        "tcs-ra"        : ra,
+        "tcs-dec"       : dec,
+        "beam_%02i"%beam: {"xx": spectra[:nchan], "yy": spectra[nchan:]},
+        }
+
+
+def decode_json_packet(datagram):
+    """ Decode a HIPSR JSON packet into a dictionary of ready-to-plot values.
+
+    Beam entries are converted from lists of floats into numpy arrays here, once,
+    so that the GUI thread only ever deals with arrays.
+
+    Parameters
+    ----------
+    datagram: str
+        raw UDP payload
+    """
+    data = json.loads(datagram)
+    for key in data.keys():
+        if str(key).startswith("beam_"):
+            data[key] = {"xx": np.array(data[key]["xx"]), "yy": np.array(data[key]["yy"])}
+    return data
+
+
+def decode_packet(datagram):
+    """ Decode a HIPSR packet in either wire format, detected from its first byte.
+
+    Parameters
+    ----------
+    datagram: str
+        raw UDP payload
+    """
+    if datagram[:1] == _binary_magic_byte:
+        return decode_binary_packet(datagram)
+    else:
+        return decode_json_packet(datagram)
+
+
+def queue_length(rcvbuf, minimum=1024):
+    """ Number of decoded frames to queue for the GUI, for a given socket buffer size.
+
+    The queue holds as many frames as the socket buffer holds typical packets, so a
+    burst that fits in the kernel buffer also fits in the queue.
+
+    Parameters
+    ----------
+    rcvbuf: int
+        socket receive buffer size, in bytes
+    minimum: int
+        smallest queue length returned
+    """
+    return max(minimum, int(rcvbuf) // TYPICAL_PACKET_SIZE)
+
+
+def kernel_udp_stats(sock):
+    """ Return (rx_queue, drops) for a UDP socket, as reported by the Linux kernel.
+
+    rx_queue is the number of bytes waiting in the socket receive buffer, and drops the
+    number of datagrams the kernel discarded because that buffer was full. The socket is
+    found in /proc/net/udp (or udp6) by its inode. Returns None if the counters are not
+    available, e.g. on other operating systems.
+    """
+    try:
+        inode = os.fstat(sock.fileno()).st_ino
+        for path in ("/proc/net/udp", "/proc/net/udp6"):
+            if not os.path.exists(path):
+                continue
+            with open(path) as fh:
+                fh.readline()
+                for line in fh:
+                    fields = line.split()
+                    if int(fields[9]) == inode:
+                        return int(fields[4].split(":")[1], 16), int(fields[-1])
+    except (IOError, OSError, ValueError, IndexError, socket.error):
+        pass
+    return None
+
+
+class FrameSource(threading.Thread):
+    """ Base class for threads that decode HIPSR packets and queue them for the GUI.
+
+    Subclasses implement run(), passing each datagram to queueDatagram().
+
+    Parameters
+    ----------
+    maxlen: int
+        Maximum number of decoded frames waiting for the GUI. If the GUI falls behind,
+        the oldest frames are discarded and counted in n_dropped.
+    perf: PerfMonitor
+        if given, the decode time of every packet is recorded in its "decode" stage
+    """
+    def __init__(self, maxlen=1024, perf=None):
+        super(FrameSource, self).__init__()
+        self.daemon = True
+        self.frames = deque(maxlen=maxlen)
+
+        self.n_received = 0     # Datagrams read from the source
+        self.n_decoded  = 0     # Datagrams successfully decoded
+        self.n_errors   = 0     # Datagrams that could not be decoded
+        self.n_dropped  = 0     # Decoded frames discarded because the queue was full
+        self.t_decode   = 0.0   # Total time spent decoding, in seconds
+
+        self._stop_event = threading.Event()
+        self.decode_timer = perf.stage("decode") if perf is not None else None
+
+    def queueDatagram(self, datagram):
+        """ Decode a datagram and queue the result for the GUI """
+        self.n_received += 1
+
+        t0 = time.time()
+        try:
+            frame = decode_packet(datagram)
+        except Exception:
+            self.n_errors += 1
+            return
+        dt = time.time() - t0
+        self.t_decode += dt
+        self.n_decoded += 1
+        if self.decode_timer is not None:
+            self.decode_timer.add(dt)
+
+        if len(self.frames) == self.frames.maxlen:
+            self.n_dropped += 1
+        self.frames.append(frame)
+
+    def stop(self):
+        """ Stop the thread """
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+
+    def popFrames(self):
+        """ Return all decoded frames queued since the last call, oldest first """
+        frames = []
+        while True:
+            try:
+                frames.append(self.frames.popleft())
+            except IndexError:
+                return frames
+
+    def stats(self):
+        """ Return a dictionary of ingest counters """
+        if self.n_decoded:
+            t_avg = self.t_decode / self.n_decoded
+        else:
+            t_avg = 0.0
+        return {
+            "received" : self.n_received,
+            "decoded"  : self.n_decoded,
+            "errors"   : self.n_errors,
+            "dropped"  : self.n_dropped,
+            "queued"   : len(self.frames),
+            "decode_us": t_avg * 1e6,
+            }
+
+
+class IngestWorker(FrameSource):
+    """ Thread that receives and decodes HIPSR UDP packets.
+
+    Parameters
+    ----------
+    host: str
+        IP address to listen on
+    port: int
+        UDP port to listen on
+    maxlen: int
+        Maximum number of decoded frames waiting for the GUI. If None, the queue is
+        sized from the granted socket buffer, see queue_length().
+    recorder: Recorder
+        if given, every datagram received is also written to this recording
+    perf: PerfMonitor
+        if given, decode times are recorded here
+    rcvbuf: int
+        socket receive buffer size to request, in bytes. If None, the OS default is kept.
+    """
+    def __init__(self, host, port, maxlen=None, recorder=None, perf=None, rcvbuf=None):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if rcvbuf:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, int(rcvbuf))
+        self.rcvbuf_requested = rcvbuf
+        self.rcvbuf = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+
+        if maxlen is None:
+            maxlen = queue_length(self.rcvbuf)
+        super(IngestWorker, self).__init__(maxlen, perf)
+        self.host = host
+        self.port = port
+        self.recorder = recorder
+
+        self.sock.bind((str(host), int(port)))
+        self.sock.settimeout(0.2)
+
+        # Kernel drop count at startup, so that stats() only counts drops on our watch
+        self.kernel_stats = kernel_udp_stats(self.sock)
+        self.kernel_drops_start = self.kernel_stats[1] if self.kernel_stats is not None else 0
+        self.closed = False
+
+    def run(self):
+        """ Receive loop: read, decode and queue packets until stop() is called """
+        while not self._stop_event.is_set():
+            try:
+                datagram = self.sock.recv(65535)
+            except socket.timeout:
+                continue
+            except socket.error:
+                break
+            if self.recorder is not None:
+                self.recorder.write(datagram, time.time())
+            self.queueDatagram(datagram)
+
+    def stop(self):
+        """ Stop the receive loop and close the socket """
+        super(IngestWorker, self).stop()
+        self.kernel_stats = kernel_udp_stats(self.sock)
+        self.closed = True
+        self.sock.close()
+
+    def stats(self):
+        """ Return a dictionary of ingest counters, including socket buffer size and usage.
+
+        kernel_drops and rx_queue are None where the kernel does not report them.
+        """
+        stats = super(IngestWorker, self).stats()
+        if not self.closed:
+            self.kernel_stats = kernel_udp_stats(self.sock)
+        kernel = self.kernel_stats
+        stats["rcvbuf"] = self.rcvbuf
+        stats["rx_queue"] = kernel[0] if kernel is not None else None
+        stats["kernel_drops"] = kernel[1] - self.kernel_drops_start if kernel is not None else None
+        return stats
+
+
+class Recorder(object):
+    """ Append-only recording of raw HIPSR datagrams and their receive times.
+
+    The file starts with a 16 byte header (the magic string RECORDING_MAGIC and a uint32
+    version), followed by one record per datagram: a float64 UNIX receive time, the uint32
+    datagram length and then the datagram itself, all little-endian. Records can be
+    appended indefinitely, and a recording cut short by a crash is still readable.
+
+    Parameters
+    ----------
+    filename: str
+        file to record to. An existing recording is appended to.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.fh = open(filename, 'ab')
+        if self.fh.tell() == 0:
+            self.fh.write(RECORDING_HEADER.pack(RECORDING_MAGIC, RECORDING_VERSION, 0))
+        self.n_records = 0
+
+    def write(self, datagram, timestamp):
+        """ Append a datagram received at a given UNIX time """
+        self.fh.write(RECORD_HEADER.pack(timestamp, len(datagram)))
+        self.fh.write(datagram)
+        self.n_records += 1
+
+    def close(self):
+        self.fh.close()
+
+
+class Recording(object):
+    """ Read access to a file written by Recorder.
+
+    The file is memory-mapped and indexed on opening, so that any datagram can be read
+    without scanning the file again. Datagrams are accessed by index, like a list.
+
+    Parameters
+    ----------
+    filename: str
+        recording to open
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.fh = open(filename, 'rb')
+        self.fh.seek(0, os.SEEK_END)
+        size = self.fh.tell()
+        if size < RECORDING_HEADER.size:
+            raise ValueError("%s is not a HIPSR recording"%filename)
+        self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, reserved = RECORDING_HEADER.unpack_from(self.mm)
+        if magic != RECORDING_MAGIC:
+            raise ValueError("%s is not a HIPSR recording"%filename)
+        if version != RECORDING_VERSION:
+            raise ValueError("Unsupported recording version: %i"%version)
+
+        # Build the index: offset, length and receive time of every complete record
+        offsets, lengths, timestamps = [], [], []
+        pos = RECORDING_HEADER.size
+        while pos + RECORD_HEADER.size <= size:
+            timestamp, length = RECORD_HEADER.unpack_from(self.mm, pos)
+            pos += RECORD_HEADER.size
+            if pos + length > size:
+                break
+            offsets.append(pos)
+            lengths.append(length)
+            timestamps.append(timestamp)
+            pos += length
+        self.offsets    = np.array(offsets, dtype='int64')
+        self.lengths    = np.array(lengths, dtype='int64')
+        self.timestamps = np.array(timestamps, dtype='float64')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, idx):
+        offset = self.offsets[idx]
+        return self.mm[offset:offset + self.lengths[idx]]
+
+    def duration(self):
+        """ Time between the first and last datagram, in seconds """
+        if len(self) < 2:
+            return 0.0
+        return self.timestamps[-1] - self.timestamps[0]
+
+    def close(self):
+        self.mm.close()
+        self.fh.close()
+
+
+class Replayer(FrameSource):
+    """ Thread that replays a recording through the same decode path as live UDP data.
+
+    Parameters
+    ----------
+    filename: str
+        recording written by Recorder
+    speed: float
+        replay speed relative to real time, e.g. 1 or 10. If 0, datagrams are replayed as
+        fast as the GUI takes them: instead of dropping frames when the queue is full,
+        replay waits for it to drain.
+    maxlen: int
+        Maximum number of decoded frames waiting for the GUI.
+    perf: PerfMonitor
+        if given, decode times are recorded here
+    """
+    def __init__(self, filename, speed=1.0, maxlen=1024, perf=None):
+        super(Replayer, self).__init__(maxlen, perf)
+        self.recording = Recording(filename)
+        self.speed = float(speed)
+
+    def run(self):
+        """ Replay loop: queue datagrams at their recorded times, scaled by speed """
+        rec = self.recording
+        if not len(rec):
+            return
+        t0_rec, t0 = rec.timestamps[0], time.time()
+        for idx in range(len(rec)):
+            if self._stop_event.is_set():
+                break
+            if self.speed > 0:
+                delay = (rec.timestamps[idx] - t0_rec) / self.speed - (time.time() - t0)
+                if delay > 0:
+                    self._stop_event.wait(delay)
+            else:
+                while len(self.frames) == self.frames.maxlen and not self._stop_event.is_set():
+                    time.sleep(0.001)
+            self.queueDatagram(rec[idx])
+
+    def stop(self):
+        """ Stop the replay and close the recording """
+        super(Replayer, self).stop()
+        self.recording.close()
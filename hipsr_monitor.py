@@ -0,0 +1,1202 @@
+"""
+hipsr_monitor.py
+================
+
+The HIPSR monitor data path: turns decoded packets into history buffers and matplotlib
+figures, without any Qt widgets.
+
+HipsrMonitor owns the figures (multibeam, beam scope, power monitor, waterfall and the
+waterfall grid of all beams), the per-beam history buffers and the render scheduler. The
+Qt GUI in hipsr-gui.py wraps it in windows and docks; benchmarks and headless tools drive
+it directly. The matplotlib backend must be selected before this module is imported.
+"""
+
+import copy
+import time
+from collections import deque
+
+import numpy as np
+import matplotlib
+import matplotlib.gridspec as gridspec
+import pylab as plt
+
+from hipsr_buffers import RingBuffer, MinMaxRingBuffer, PyramidBuffer
+from hipsr_render import BlitManager, minmax_envelope, envelope_channels, max_bins
+from hipsr_perf import PerfMonitor
+from hipsr_archive import SpectrumArchive
+from hipsr_stats import SpectralStats, RobustLevels
+
+ntime = 120
+wf_rows = 150               # Rows in the waterfall image, and in each tier of its history
+wf_factor = 4               # Decimation factor between waterfall history tiers
+wf_hysteresis = 0.1         # Fraction of the colour range waterfall limits must drift to be applied
+wg_nchan = 128              # Channels of each beam's tile in the waterfall grid
+spectrum_interval = 2.0     # Nominal seconds between spectra of a beam, for sizing history
+n_snapshots = 300           # Frames of all beams' spectra kept for scrubbing while paused
+snapshot_bytes = 64 * 2**20 # Memory limit on those frames, for high channel counts
+
+beam_ids = ["beam_01","beam_02","beam_03","beam_04","beam_05","beam_06","beam_07", "beam_08","beam_09","beam_10","beam_11","beam_12","beam_13"]
+
+
+def parse_beams(text):
+    """ Parse a beam list such as "1-7" or "1,2,5" into beam names, in beam order """
+    numbers = set()
+    for part in text.split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            numbers.update(range(int(first), int(last) + 1))
+        else:
+            numbers.add(int(part))
+    beams = ["beam_%02i"%number for number in sorted(numbers)]
+    for beam in beams:
+        if beam not in beam_ids:
+            raise ValueError("No such beam: %s. Beams are numbered 1-%i."%(beam, len(beam_ids)))
+    return beams
+
+
+def waterfall_tiers(history):
+    """ Number of waterfall history tiers needed to cover history seconds """
+    ntiers = 1
+    while wf_rows * wf_factor**(ntiers - 1) * spectrum_interval < history:
+        ntiers += 1
+    return ntiers
+
+
+class FrequencyAxis(object):
+    """ Channel to frequency mapping of the displayed spectra, shared by all views
+    
+    Spectra are displayed in ascending frequency (flushFrame flips them if the bandwidth
+    is negative). Get instances from frequency_axis(), which computes each one once.
+    
+    Parameters
+    ----------
+    frequency: float
+        TCS centre frequency, in MHz
+    bandwidth: float
+        TCS bandwidth, in MHz, positive
+    nchan: int
+        number of channels per polarisation
+    nticks: int
+        approximate number of labelled ticks on channel axes
+    """
+    def __init__(self, frequency, bandwidth, nchan, nticks=8):
+        self.key = (frequency, bandwidth, nchan)
+        self.limits = (frequency - bandwidth/2, frequency + bandwidth/2)
+        self.freqs = np.linspace(self.limits[0], self.limits[1], nchan)
+        step = max(1, nchan // nticks)
+        self.tick_channels = range(0, nchan, step)
+        self.tick_labels = [int(f) for f in self.freqs[::step]]
+
+
+_frequency_axes = {}
+
+def frequency_axis(frequency, bandwidth, nchan):
+    """ Return the FrequencyAxis for a TCS frequency, bandwidth and channel count
+    
+    Axes are memoized, so switching back and forth between receiver settings does not
+    recompute them, and an unchanged setting returns the very same object.
+    """
+    key = (frequency, bandwidth, nchan)
+    try:
+        return _frequency_axes[key]
+    except KeyError:
+        if len(_frequency_axes) >= 16:
+            _frequency_axes.clear()
+        axis = _frequency_axes[key] = FrequencyAxis(frequency, bandwidth, nchan)
+        return axis
+
+
+def waterfall_grid(nbeams):
+    """ Number of (rows, columns) of tiles in the waterfall grid, for a number of beams """
+    ncols = int(np.ceil(np.sqrt(nbeams)))
+    return int(np.ceil(nbeams / float(ncols))), ncols
+
+
+def multibeam_grid(plot_size=4):
+    """ Hexagonal layout of the 13 beam panels on a (5*plot_size+1) square grid
+    
+    Returns a dictionary of the (row, column) of the centre of each beam's panel.
+    """
+    c, s = (5*plot_size+1)//2, plot_size
+    return {
+        "beam_01" : (c, c),
+        "beam_03" : (c+s, c),
+        "beam_06" : (c-s, c),
+        "beam_13" : (c-3*s//2, c-s),
+        "beam_07" : (c-s//2, c-s),
+        "beam_02" : (c+s//2, c-s),
+        "beam_09" : (c+3*s//2, c-s),
+        "beam_12" : (c-3*s//2, c+s),
+        "beam_05" : (c-s//2, c+s),
+        "beam_04" : (c+s//2, c+s),
+        "beam_10" : (c+3*s//2, c+s),
+        "beam_08" : (c, c-2*s),
+        "beam_11" : (c, c+2*s),
+        }
+
+
+class HipsrMonitor(object):
+    """ HIPSR monitor class
+    
+    Maintains history buffers and matplotlib plots for data decoded from UDP packets.
+    
+    Parameters
+    ----------
+    canvas_class: FigureCanvas
+        canvas class to attach to each figure, e.g. FigureCanvasQTAgg. If None, the
+        canvases created by pylab for the current backend are used.
+    fps: float
+        target frame rate of the render scheduler
+    history: float
+        length of waterfall history to keep per beam, in seconds at the nominal spectrum
+        interval. Older history is kept at progressively lower time resolution.
+    wf_reduce: str
+        how waterfall history is decimated, 'mean' or 'max' (max-hold)
+    archive: SpectrumArchive
+        if given, every spectrum is also archived here, and the history of a beam is
+        loaded from it when the beam is first selected
+    nchan: int
+        number of channels per polarisation to start with. If the stream carries spectra
+        of another length, buffers and plots are resized to match (see setChannels).
+    beams: list
+        beams to monitor, a subset of beam_ids. Other beams in the stream are ignored.
+    rfi_sigma: float
+        channels further than this many standard deviations from their running mean are
+        flagged as RFI (see hipsr_stats.py)
+    """
+    def __init__(self, canvas_class=None, fps=10.0, history=wf_rows*spectrum_interval, wf_reduce='mean',
+                 archive=None, nchan=256, beams=beam_ids, rfi_sigma=5.0):
+        
+        # Hot-path timing of each stage
+        self.perf = PerfMonitor()
+        for stage in ("decode", "keyLookup", "flushFrame", "render"):
+            self.perf.stage(stage)
+        
+        self.nchan = int(nchan)
+        self.beams = list(beams)
+        self.beam_index = dict([(beam, idx) for idx, beam in enumerate(self.beams)])
+        self.rfi_sigma = rfi_sigma
+        
+        # Create plots
+        self.createViews(canvas_class)
+        
+        self.sb_c_freq    = 1355.0
+        self.sb_bandwidth = -400.0
+        self.freq_axis    = None     # FrequencyAxis the channel axes are labelled with
+        self.wf_thr       = 3
+        
+        self.ra = 0.0
+        self.dec = 0.0
+        self.timestamp = 0.0
+        
+        # Views that are not visible are not rendered
+        self.visible = {"mb": True, "sb": True, "p": True, "wf": True, "wg": True}
+        
+        self.activeBeam = self.beams[0]
+        self.time_series_data = {}
+        
+        # Waterfall history tiers: enough to cover the requested history length
+        self.wf_ntiers = waterfall_tiers(history)
+        self.wf_tier = 0
+        self.wf_reduce = wf_reduce
+        self.wf_yticklabels = None
+        self.wf_levels = RobustLevels(wf_rows)
+        
+        self.archive = archive
+        self.archive_loaded = set()
+        self.lookback = 0.0     # Seconds the waterfall and beam scope are paged back in the archive
+        self.power_data = {}
+        self.p_counts = {}   # Power history length last copied into each pair of plot lines
+        self.shared_history = False     # Waterfall and power history are kept elsewhere
+        self.paused = False
+        self.allocateBuffers()
+        
+        # Multibeam panels show a min/max envelope, one bin per pixel column, once they
+        # are narrower than half the number of channels. The beam scope is never decimated.
+        self.mb_nbins = None
+        self.mb_shape = None
+        self.onMultiBeamResize()
+        
+        # Packet keys and their handlers, built once
+        self.key_handlers = {
+            "tcs-bandwidth": self.keyTcsBandwidth,
+            "tcs-frequency": self.keyTcsFrequency,
+            "tcs-ra"  : self.keyRa,
+            "tcs-dec" : self.keyDec,
+            "timestamp" : self.keyTimestamp,
+            }
+        for beam in beam_ids:
+            self.key_handlers[beam] = self.keyBeam if beam in self.beam_index else self.keyIgnore
+        
+        for beam in self.beams:
+            self.power_data[beam] = MinMaxRingBuffer(ntime, 2, fill=1e4)
+        
+        # Render scheduler: draw at a fixed frame rate, independent of packet rate
+        self.frame_times = deque(maxlen=50)
+        self.next_render = 0.0
+        self.n_rendered  = 0
+        self.n_skipped   = 0
+        self.setTargetFps(fps)
+        
+        self.loadArchivedHistory(self.activeBeam)
+    
+    def allocateBuffers(self):
+        """ Create the buffers sized by the number of beams and channels
+        
+        Spectra are held as (beam, pol, channel) arrays. Beams are collected into
+        frame_spectra as packets arrive, then added to history and to spectra in one go.
+        """
+        shape = (len(self.beams), 2, self.nchan)
+        self.frame_spectra = np.zeros(shape)
+        self.pending  = np.zeros(shape[0], dtype='bool')   # Beams collected in frame_spectra
+        self.spectra  = np.ones(shape)                     # Latest spectrum of each beam
+        self.updated  = np.zeros(shape[0], dtype='bool')   # Beams updated since the last render
+        self.received = np.zeros(shape[0], dtype='bool')   # Beams received at least once
+        
+        # Recent frames, for scrubbing through while paused
+        nrows = max(1, min(n_snapshots, snapshot_bytes // (4 * np.prod(shape))))
+        self.snapshots = RingBuffer(nrows, shape, fill=1.0, dtype='float32')
+        self.snapshot_times = RingBuffer(nrows, ())
+        
+        if not self.shared_history:
+            for beam in self.beams:
+                self.time_series_data[beam] = PyramidBuffer(wf_rows, self.nchan, self.wf_ntiers, wf_factor,
+                                                            self.wf_reduce, fill=1.0)
+        
+        # Running per-channel statistics and RFI flags of every beam
+        self.stats = SpectralStats(shape[0], self.nchan, nsigma=self.rfi_sigma)
+        self.wg_count = np.zeros(shape[0], dtype='int64')   # Rows written to each waterfall grid tile
+    
+    def setSharedHistory(self, waterfall, power):
+        """ Draw the waterfall and power monitor from history kept elsewhere, e.g. by an
+        ingest daemon in shared memory (see hipsr_shm.py), instead of keeping it here
+        
+        Spectra passed to ingestFrames() then only update the other views and statistics.
+        Whoever keeps the history also keeps the buffers' write positions up to date.
+        
+        Parameters
+        ----------
+        waterfall: dict
+            PyramidBuffer of each beam, with wf_rows rows per tier
+        power: dict
+            MinMaxRingBuffer of each beam, with ntime rows
+        """
+        for beam in self.beams:
+            if len(waterfall[beam]) != wf_rows or len(power[beam]) != ntime:
+                raise ValueError("shared history has %i waterfall and %i power rows, not %i and %i"%(
+                                 len(waterfall[beam]), len(power[beam]), wf_rows, ntime))
+        nchan = waterfall[self.beams[0]].shape[-1]
+        if nchan != self.nchan:
+            self.setChannels(nchan)
+        
+        self.shared_history = True
+        for beam in self.beams:
+            self.time_series_data[beam] = waterfall[beam]
+            self.power_data[beam] = power[beam]
+        self.wf_ntiers = len(waterfall[self.beams[0]].tiers)
+        self.wf_tier = min(self.wf_tier, self.wf_ntiers - 1)
+        self.wf_yticklabels = None
+        self.p_counts = {}
+        self.wf_blit.invalidate()
+        self.p_blit.invalidate()
+
+    def setChannels(self, nchan):
+        """ Switch to spectra of a different number of channels, e.g. a new spectrometer mode
+        
+        The spectra collected so far are flushed, then history is restarted at the new
+        channel count. Plot lines and the waterfall image are resized in place, so nothing
+        is rebuilt unless the channel count actually changes.
+        """
+        self.flushFrame()
+        print "Info: spectra now have %i channels (was %i)"%(nchan, self.nchan)
+        self.nchan = int(nchan)
+        self.allocateBuffers()
+        
+        if self.archive is not None:
+            directory = self.archive.directory
+            self.archive.close()
+            try:
+                self.archive = SpectrumArchive(directory, self.beams, self.nchan)
+            except ValueError, e:
+                print "Warning: archiving stopped: %s"%e
+                self.archive = None
+                self.lookback = 0.0
+            self.archive_loaded = set()
+            self.loadArchivedHistory(self.activeBeam)
+        
+        self.resizeViews()
+
+    def resizeViews(self):
+        """ Resize the channel axes of all plots to the current number of channels """
+        x, y = np.arange(1, self.nchan + 1), np.ones(self.nchan)
+        self.sb_xpol.set_data(x, y)
+        self.sb_ypol.set_data(x, y)
+        self.sb_flags.set_data([], [])
+        self.sb_ax.set_xlim(0, self.nchan)
+        for key in self.beams:
+            self.mb_ax[key].set_xlim(0, self.nchan)
+        self.onMultiBeamResize()
+        
+        self.wf_data = np.zeros((wf_rows, self.nchan))
+        self.wf_imshow.set_data(self.wf_data)
+        self.wf_imshow.set_extent((-0.5, self.nchan - 0.5, wf_rows - 0.5, -0.5))
+        self.wf_ax.set_xlim(-0.5, self.nchan - 0.5)
+        self.wf_ax.set_aspect(self.nchan / 256.)     # Keep the shape the image has at 256 channels
+        if self.freq_axis is not None:
+            self.updateFrequencyAxis()
+        
+        # Grid tiles are a fixed number of channels wide, so the grid image keeps its size
+        self.wg_data.fill(0)
+        self.wg_imshow.set_data(self.wg_data)
+        
+        for blit in (self.mb_blit, self.sb_blit, self.wf_blit, self.wg_blit):
+            blit.clearFrames()
+            blit.invalidate()
+
+    def createViews(self, canvas_class=None):
+        """ Create the four plots and the blit managers that redraw them
+        
+        This is the plotting backend: subclasses that draw with something other than
+        matplotlib override it, together with canvas().
+        """
+        self.mb_fig, self.mb_ax, self.mb_xpols, self.mb_ypols = self.createMultiBeamPlot(self.nchan)
+        self.sb_fig, self.sb_ax, self.sb_xpol,  self.sb_ypol, self.sb_title = self.createSingleBeamPlot(self.nchan,
+                                                                                                       self.beams[0])
+        self.sb_flags = self.createFlagOverlay()
+        self.p_fig, self.p_ax, self.p_lines = self.createOverallPowerPlot()
+        self.wf_fig, self.wf_ax, self.wf_imshow, self.wf_data, self.wf_colorbar = self.createWaterfallPlot()
+        self.wg_fig, self.wg_ax, self.wg_imshow, self.wg_data, self.wg_overlay = self.createWaterfallGridPlot()
+        
+        if canvas_class is not None:
+            for fig in (self.mb_fig, self.sb_fig, self.p_fig, self.wf_fig, self.wg_fig):
+                canvas_class(fig)
+        
+        # Blitting: only the data artists are redrawn unless axes change
+        self.mb_blit = BlitManager(self.mb_fig.canvas, self.mb_xpols.values() + self.mb_ypols.values() + [self.ra_dec_text],
+                                   timer=self.perf.stage("draw_mb"))
+        self.sb_blit = BlitManager(self.sb_fig.canvas, [self.sb_xpol, self.sb_ypol, self.sb_flags],
+                                   timer=self.perf.stage("draw_sb"))
+        self.p_blit  = BlitManager(self.p_fig.canvas, self.p_lines, timer=self.perf.stage("draw_p"))
+        self.wf_blit = BlitManager(self.wf_fig.canvas, [self.wf_imshow], timer=self.perf.stage("draw_wf"))
+        self.wg_blit = BlitManager(self.wg_fig.canvas, [self.wg_imshow] + self.wg_overlay,
+                                   timer=self.perf.stage("draw_wg"))
+        self.mb_fig.canvas.mpl_connect('resize_event', self.onMultiBeamResize)
+
+    def canvas(self, view):
+        """ Return the widget that displays a view ("mb", "sb", "p", "wf" or "wg") """
+        return getattr(self, view + "_fig").canvas
+
+    def keyLookup(self, key, data):
+        """ A pythonic case statement that searches for keys in a dict. """
+        self.key_handlers.get(key, self.keyNoMatch)(key, data)    # keyNoMatch is default if key not found
+
+    def keyNoMatch(self, key, data=0):
+        print "Info: Unexpected key encountered."
+
+    def keyIgnore(self, key, data=0):
+        """ Beams that are not monitored are dropped quietly """
+        pass
+
+    def keyRa(self, key, data):
+        """ update RA  """
+        self.ra = float(data[key])
+
+    def keyDec(self, key, data):
+        """ update DEC  """
+        self.dec = float(data[key])
+
+    def keyTimestamp(self, key, data):
+        """ update timestamp of latest spectrum """
+        self.timestamp = float(data[key])
+
+    def keyTcsFrequency(self, key, data):
+        """ Update plots with new TCS Frequency """
+        cf = float(data[key])
+        if cf != self.sb_c_freq or self.freq_axis is None:
+            self.sb_c_freq = cf
+            self.updateFrequencyAxis()
+
+    def updateFrequencyAxis(self):
+        """ Label channel axes in frequency, from the TCS frequency and bandwidth
+        
+        Artists are only touched (forcing a full redraw) when the frequency axis changes,
+        i.e. on retune or a new channel count, not for every packet.
+        """
+        axis = frequency_axis(self.sb_c_freq, np.abs(self.sb_bandwidth), self.nchan)
+        if axis is self.freq_axis:
+            return
+        if self.freq_axis is not None:
+            # Retuned: channel statistics no longer apply
+            self.stats.reset()
+        self.freq_axis = axis
+        
+        self.sb_xpol.set_xdata(axis.freqs)
+        self.sb_ypol.set_xdata(axis.freqs)
+        self.sb_ax.set_xlabel("Frequency (MHz)")
+        self.sb_ax.set_xlim(*axis.limits)
+        
+        self.wf_ax.set_xlabel("Frequency (MHz)")
+        self.wf_ax.set_xticks(axis.tick_channels)
+        self.wf_ax.set_xticklabels(axis.tick_labels)
+        
+        for beam in ["beam_09", "beam_10"]:
+            if beam not in self.mb_ax:
+                continue
+            self.mb_ax[beam].set_xlabel("Frequency (MHz)")
+            self.mb_ax[beam].set_xticks(axis.tick_channels)
+            self.mb_ax[beam].set_xticklabels(axis.tick_labels, rotation=45)
+        
+        self.mb_blit.invalidate()
+        self.sb_blit.invalidate()
+        self.wf_blit.invalidate()
+
+    def keyTcsBandwidth(self, key, data):
+        """ Update with new TCS bandwidth """
+        bandwidth = float(data[key])
+        if bandwidth == self.sb_bandwidth:
+            return
+        if (bandwidth < 0) != (self.sb_bandwidth < 0):
+            # Beams collected so far are flipped according to the old bandwidth
+            self.flushFrame()
+        self.sb_bandwidth = bandwidth
+        if self.freq_axis is not None:
+            self.updateFrequencyAxis()
+
+    def keyBeam(self, key, data):
+        """ Collect beam data into the current frame """
+        idx = self.beam_index[key]
+        if len(data[key]["xx"]) != self.nchan:
+            self.setChannels(len(data[key]["xx"]))
+        elif self.pending[idx]:
+            # A beam repeats: the previous frame is complete
+            self.flushFrame()
+        self.frame_spectra[idx, 0] = data[key]["xx"]
+        self.frame_spectra[idx, 1] = data[key]["yy"]
+        self.pending[idx] = True
+
+    def flushFrame(self):
+        """ Add the beams collected in the current frame to history.
+        
+        Bandwidth flips and total powers are computed for all collected beams at once.
+        """
+        idx = np.flatnonzero(self.pending)
+        if not len(idx):
+            return
+        t0 = time.time()
+        spectra = self.frame_spectra[idx]
+        if self.sb_bandwidth < 0:
+            spectra = spectra[:, :, ::-1]
+        powers = spectra.sum(axis=2)
+        timestamp = self.timestamp or time.time()
+        self.stats.update(idx, spectra)
+        self.updateWaterfallGrid(idx)
+        
+        for ii, beam_idx in enumerate(idx):
+            key = self.beams[beam_idx]
+            if not self.shared_history:
+                self.updateOverallPowerPlot(key, powers[ii, 0], powers[ii, 1])
+                self.updateTimeSeriesData(key, spectra[ii, 0], timestamp)
+            if self.archive is not None:
+                self.archive.append(key, spectra[ii], timestamp)
+        
+        # Only the latest spectrum per beam is plotted on the next frame
+        self.spectra[idx] = spectra
+        self.updated[idx] = True
+        self.received[idx] = True
+        self.pending[:] = False
+        if not self.paused:
+            self.snapshots.append(self.spectra)
+            self.snapshot_times.append(timestamp)
+        self.perf.add("flushFrame", time.time() - t0)
+
+    def updateMultiBeamPlot(self, key, xx, yy, dmin=None, dmax=None):
+        """ Update a multibeam subplot with a new spectrum
+        
+        dmin and dmax, the data limits excluding the edge channels, are computed if not given.
+        """
+        self.mb_xpols[key].set_ydata(xx)
+        self.mb_ypols[key].set_ydata(yy)
+        if dmin is None or dmax is None:
+            dmax, dmin = np.max([xx[1:-1], yy[1:-1]]), np.min([xx[1:-1], yy[1:-1]])
+        
+        # Only rescale (forcing a full redraw) if the data leave the axes or shrink well inside them.
+        # The 10% margin keeps noise from triggering a rescale on every spectrum. Shrinking
+        # compares the limits the data would get, margin included, so that limits just set
+        # from the data are kept.
+        ymin, ymax = self.mb_ax[key].get_ylim()
+        lo, hi = dmin*0.9, dmax*1.1
+        if dmax > ymax or dmin < ymin or (hi - lo) < 0.5 * (ymax - ymin):
+            self.mb_ax[key].set_ylim(lo, hi)
+            self.mb_blit.invalidate()
+
+    def multiBeamPanelWidth(self):
+        """ Width of a multibeam panel on screen, in pixels """
+        return self.mb_ax[self.beams[0]].get_window_extent().width
+
+    def onMultiBeamResize(self, event=None):
+        """ Match the multibeam level of detail to the new panel width """
+        self.setMultiBeamResolution(self.multiBeamPanelWidth())
+
+    def setMultiBeamResolution(self, npixels):
+        """ Set the number of envelope bins plotted in each multibeam panel
+        
+        Parameters
+        ----------
+        npixels: int
+            panel width in pixels. Spectra with fewer than twice as many channels, or any
+            spectra if None, are plotted at full resolution.
+        """
+        nchan = self.spectra.shape[-1]
+        nbins = int(npixels) if npixels and 2 * int(npixels) < nchan else None
+        if (nchan, nbins) == self.mb_shape:
+            return
+        self.mb_shape = (nchan, nbins)
+        self.mb_nbins = nbins
+        
+        x = envelope_channels(nchan, nbins) if nbins else np.arange(1, nchan + 1)
+        lines = self.decimateMultiBeam(self.spectra)
+        for idx, key in enumerate(self.beams):
+            self.mb_xpols[key].set_data(x, lines[idx, 0])
+            self.mb_ypols[key].set_data(x, lines[idx, 1])
+        self.mb_blit.clearFrames()
+        self.mb_blit.invalidate()
+
+    def decimateMultiBeam(self, spectra):
+        """ Reduce (beam, pol, channel) spectra to what the multibeam panels plot """
+        if self.mb_nbins is None:
+            return spectra
+        return minmax_envelope(spectra, self.mb_nbins)
+
+    def setTargetFps(self, fps):
+        """ Set the frame rate the render scheduler aims for """
+        if not fps > 0:
+            raise ValueError("Target frame rate must be greater than 0, not %r"%fps)
+        self.target_fps = float(fps)
+        self.frame_interval = 1.0 / self.target_fps
+
+    def measuredFps(self):
+        """ Frame rate achieved over the last few rendered frames """
+        if len(self.frame_times) < 2 or self.frame_times[-1] == self.frame_times[0]:
+            return 0.0
+        return (len(self.frame_times) - 1) / (self.frame_times[-1] - self.frame_times[0])
+
+    def setViewVisible(self, view, visible):
+        """ Mark a view ("mb", "sb", "p", "wf" or "wg") as visible or hidden.
+        
+        Hidden views are not rendered, although their history keeps being updated.
+        A view that becomes visible is brought up to date from history in one draw.
+        """
+        self.visible[view] = visible
+        if not visible:
+            return
+        if view == "mb":
+            self.mb_blit.update()
+        elif view == "sb" and self.lookback:
+            spectra, times = self.archiveWindow()
+            if len(spectra):
+                self.sb_flags.set_data([], [])     # Flags are only known for live data
+                self.updateSingleBeamPlot(*spectra[-1])
+        elif view == "sb" and self.received[self.beam_index[self.activeBeam]]:
+            self.updateSingleBeamPlot(*self.spectra[self.beam_index[self.activeBeam]])
+        elif view == "p":
+            self.redrawOverallPowerPlot()
+            self.p_blit.update()
+        elif view == "wf":
+            self.updateWaterfallPlot()
+            self.wf_blit.update()
+        elif view == "wg":
+            self.wg_imshow.set_data(self.wg_data)
+            self.wg_blit.update()
+
+    def ingestFrames(self, frames):
+        """ Add decoded frames to the history buffers """
+        for data in frames:
+            #print data.keys()
+            t0 = time.time()
+            for key in data.keys():
+                self.keyLookup(key, data)
+            self.perf.add("keyLookup", time.time() - t0)
+        self.flushFrame()
+
+    def renderFrame(self):
+        """ Render scheduler tick
+        
+        Renders a new frame, unless the previous frame overran its time slot; in that case
+        frames are dropped (not data) until rendering has caught up. Returns True if a
+        frame was rendered.
+        """
+        t_start = time.time()
+        if self.paused:
+            return False
+        if t_start < self.next_render:
+            self.n_skipped += 1
+            return False
+        self.updateAllPlots()
+        t_end = time.time()
+        self.perf.add("render", t_end - t_start)
+        
+        self.next_render = t_end + max(0.0, (t_end - t_start) - self.frame_interval)
+        self.n_rendered += 1
+        self.frame_times.append(t_end)
+        return True
+
+    def pause(self):
+        """ Freeze the display. Data keep going into history, but nothing is rendered.
+        
+        While paused, the frames received just before pausing can be shown with
+        showSnapshot(), and the plots can be zoomed and panned without live updates
+        getting in the way.
+        """
+        self.paused = True
+
+    def resume(self):
+        """ Return to live display, showing the latest data straight away
+        
+        Only the latest spectrum of each beam is drawn; frames received while paused
+        are not replayed.
+        """
+        self.paused = False
+        self.updated |= self.received
+        self.next_render = 0.0
+        for blit in (self.mb_blit, self.sb_blit, self.p_blit, self.wf_blit, self.wg_blit):
+            blit.clearFrames()
+            blit.invalidate()
+
+    def nSnapshots(self):
+        """ Number of frames that can be shown with showSnapshot() """
+        return min(self.snapshots.count, self.snapshots.nrows)
+
+    def snapshotTime(self, index):
+        """ Timestamp of a snapshot, 0 being the oldest """
+        return self.snapshot_times.data[self._snapshotRow(index)]
+
+    def _snapshotRow(self, index):
+        return (self.snapshots.index - self.nSnapshots() + index) % self.snapshots.nrows
+
+    def showSnapshot(self, index):
+        """ Show a frame received before pausing in the multibeam plot and beam scope
+        
+        Frames are cached once rendered, so scrubbing back over them only costs a blit.
+        
+        Parameters
+        ----------
+        index: int
+            snapshot to show, from 0 (oldest) to nSnapshots() - 1 (newest)
+        """
+        row = self._snapshotRow(index)
+        frame = self.snapshots.data[row]
+        frame_id = self.snapshots.count - self.nSnapshots() + index
+        
+        if self.visible["mb"] and not self.mb_blit.showFrame(frame_id):
+            inner = frame[:, :, 1:-1]
+            dmax = inner.max(axis=2).max(axis=1)
+            dmin = inner.min(axis=2).min(axis=1)
+            lines = self.decimateMultiBeam(frame)
+            for idx, key in enumerate(self.beams):
+                self.updateMultiBeamPlot(key, lines[idx, 0], lines[idx, 1], dmin[idx], dmax[idx])
+            self.mb_blit.update()
+            self.mb_blit.cacheFrame(frame_id)
+        
+        active = self.beam_index[self.activeBeam]
+        if self.visible["sb"] and not self.sb_blit.showFrame((frame_id, active)):
+            self.sb_flags.set_data([], [])     # Flags are only known for live data
+            self.updateSingleBeamPlot(frame[active, 0], frame[active, 1])
+            self.sb_blit.cacheFrame((frame_id, active))
+
+    def setActiveBeam(self, beam):
+        """ Select the beam shown in the beam scope and waterfall plot """
+        self.activeBeam = str(beam)
+        self.loadArchivedHistory(self.activeBeam)
+        self.sb_title.set_text("Beam monitor: %s"%beam)
+        self.sb_blit.invalidate()
+        self.wf_blit.invalidate()
+        self.setViewVisible("sb", self.visible["sb"])
+        self.setViewVisible("wf", self.visible["wf"])
+
+    def setLookback(self, seconds):
+        """ Page the waterfall and beam scope back through the archive of the active beam
+        
+        The waterfall shows the wf_rows archived spectra up to a time before the latest
+        archived spectrum, at full resolution, and the beam scope the spectrum at that time.
+        Only those records are read from disk. Live updates of both views stop until the
+        look back is set to 0 again. Does nothing without an archive.
+        
+        Parameters
+        ----------
+        seconds: float
+            how far back to look, in seconds. 0 returns to live display.
+        """
+        if self.archive is None:
+            return
+        self.lookback = max(0.0, float(seconds))
+        self.sb_blit.clearFrames()
+        self.sb_blit.invalidate()
+        self.wf_blit.invalidate()
+        self.updated[self.beam_index[self.activeBeam]] = True
+        self.setViewVisible("sb", self.visible["sb"])
+        self.setViewVisible("wf", self.visible["wf"])
+
+    def archiveWindow(self):
+        """ Archived spectra of the active beam shown while looking back, and their timestamps """
+        archive = self.archive[self.activeBeam]
+        times = archive.times()
+        if not len(times):
+            return archive.spectra(), times
+        return archive.window(times[-1] - self.lookback, wf_rows)
+
+    def createSingleBeamPlot(self, numchans=256, beamid='beam_01'):
+        """ Creates a single pylab plot for HIPSR data. """
+
+        fig = plt.figure(figsize=(3,4),dpi=80)
+        xpol_color = '#00CC00'
+        ypol_color = '#CC0000'
+        title = fig.suptitle("Beam monitor: %s"%beamid)
+        title.set_fontsize(14)
+        ax = plt.subplot(111)
+
+        xpol, = ax.plot(np.cumsum(np.ones(numchans)),np.ones(numchans), color=xpol_color)
+        ypol, = ax.plot(np.cumsum(np.ones(numchans)),np.ones(numchans), color=ypol_color)
+        
+        # Format plot
+        ax.set_ylim(0, 2)
+        ax.set_xlim(0,numchans)
+        ax.set_xlabel("Channel (-)")
+        ax.set_ylabel("Power (-)")  
+        
+        # Set border colour  
+        for child in ax.get_children():
+          if isinstance(child, matplotlib.spines.Spine):
+            child.set_color('#666666')
+              
+        fig.canvas.draw()
+        self.sb_max = 2
+        self.sb_min = 0
+      
+        return fig, ax, xpol, ypol, title
+
+    def createFlagOverlay(self):
+        """ Creates the markers for RFI flagged channels on the beam scope """
+        flag_color = '#3355FF'
+        flags, = self.sb_ax.plot([], [], linestyle='none', marker='v', markersize=6, color=flag_color)
+        return flags
+
+    def createWaterfallPlot(self):
+        """ Creates a single imshow plot for HIPSR data. """
+        fig  = plt.figure(figsize=(3,4),dpi=80)
+        ax   = plt.subplot(111)
+        data = np.zeros([wf_rows,self.nchan])
+        data[0] = np.ones_like(data[0]) * 100
+        wf   = ax.imshow(data, cmap=plt.cm.gist_heat_r)
+        
+        ax.set_ylabel("Elapsed Time (m)")
+        ax.set_yticks(np.linspace(0, wf_rows, 6))
+        ax.set_yticklabels([5,4,3,2,1,0])
+        ax.set_xlabel("Channel")
+        #ax.set_aspect(256./150)
+        
+        cb = fig.colorbar(wf)
+        cb.set_clim(0,80)
+        cb.set_label("Power (-)")
+        #cb.set_ticks([0,2,4,6,8,10])
+        fig.canvas.draw()
+        
+        return fig, ax, wf, data, cb
+
+    def createWaterfallGridPlot(self):
+        """ Creates a single imshow plot holding a waterfall tile for every beam
+        
+        The tiles are parts of one preallocated image, so the grid is drawn as a single
+        image however many beams there are. Returns the figure, axes, image, image data
+        and the tile borders and beam labels, which are drawn over the image.
+        """
+        fig  = plt.figure(figsize=(3,4),dpi=80)
+        ax   = plt.subplot(111)
+        nrows, ncols = waterfall_grid(len(self.beams))
+        data = np.zeros([nrows * wf_rows, ncols * wg_nchan], dtype='float32')
+        
+        # Blank rows (the sweep position) are NaN, drawn in the flag colour. Noise stays
+        # pale, and flagged channels are at least half way up the colour scale.
+        cmap = copy.copy(plt.cm.gist_heat_r)
+        cmap.set_bad('#3355FF')
+        wg   = ax.imshow(data, cmap=cmap, interpolation='nearest', vmin=0, vmax=2*self.rfi_sigma)
+        
+        overlay = []
+        for row in range(1, nrows):
+            overlay.append(ax.axhline(row * wf_rows - 0.5, color='#666666'))
+        for col in range(1, ncols):
+            overlay.append(ax.axvline(col * wg_nchan - 0.5, color='#666666'))
+        for idx, key in enumerate(self.beams):
+            row, col = divmod(idx, ncols)
+            overlay.append(ax.text(col * wg_nchan + 4, row * wf_rows + 4, key[-2:], size=12,
+                                   color='#1a4876', verticalalignment='top'))
+        ax.set_xticks([])
+        ax.set_yticks([])
+        ax.set_title("All beams")
+        
+        cb = fig.colorbar(wg)
+        cb.set_label("Deviation (sigma)")
+        fig.canvas.draw()
+        
+        return fig, ax, wg, data, overlay
+
+    def createMultiBeamPlot(self, numchans=256):
+          """ Creates a subplot for each monitored beam, in a hexagonal array representing the multibeam feeds """
+     
+          fig = plt.figure(figsize=(3,4),dpi=80)
+          
+          # Label the plots. There's gotta be a better way...
+          labels = {
+              "beam_01" : (0.53, 0.46),
+              "beam_06" : (0.53, 0.46+0.15),
+              "beam_03" : (0.53, 0.46-0.15),
+              "beam_04" : (0.53+0.15, 0.46-0.075),
+              "beam_05" : (0.53+0.15, 0.46+0.075),
+              "beam_10" : (0.53+0.15, 0.46-0.075-0.15),
+              "beam_12" : (0.53+0.15, 0.46+0.075+0.15),
+              "beam_02" : (0.53-0.15, 0.46-0.075),
+              "beam_07" : (0.53-0.15, 0.46+0.075),
+              "beam_09" : (0.53-0.15, 0.46-0.075-0.15),
+              "beam_13" : (0.53-0.15, 0.46+0.075+0.15),
+              "beam_08" : (0.53-0.3, 0.46),
+              "beam_11" : (0.53+0.3, 0.46),
+              }
+          for key in self.beams:
+            fig.text(labels[key][0], labels[key][1], key[-2:], size=20)
+
+          self.ra_dec_text = fig.text(0.05, 0.05, "RA: 00.00, DEC: 00.00", size=20)
+          #self.ra_dec_text.set_text("RA: 10.00, DEC: 20.00")
+
+          xpol_color = '#00CC00'
+          ypol_color = '#CC0000'
+      
+          title = fig.suptitle("Multibeam monitor")
+          title.set_fontsize(20)
+          
+          # Create subplots arranged on a hexagonal grid
+          plotSize = 4
+          gridSize = 5*plotSize+1
+          gs = gridspec.GridSpec(gridSize, gridSize)
+          def beam(posx, posy, size): return gs[posx-size:posx+size, posy-size:posy+size]
+          axes = {}
+          grid = multibeam_grid(plotSize)
+          for key in self.beams:
+            row, col = grid[key]
+            axes[key] = plt.subplot(beam(row, col, plotSize/2))
+          
+          xpols, ypols = {}, {}  
+      
+          for key in axes.keys():
+            # Create xpol and ypol lines
+            xpols[key], = axes[key].plot(np.cumsum(np.ones(numchans)),np.ones(numchans), color=xpol_color)
+            ypols[key], = axes[key].plot(np.cumsum(np.ones(numchans)),np.ones(numchans), color=ypol_color)
+        
+            # Format plot
+            dmax, dmin = 0, 2
+            axes[key].set_ylim(dmin, dmax)
+            axes[key].set_xlim(0,numchans)
+            
+            # Plot styling
+            axes[key].get_xaxis().set_visible(True)
+            axes[key].get_yaxis().set_visible(True)
+            
+            axes[key].set_yticklabels(["" for i in range(len(axes[key].get_yticks() ))])
+            axes[key].set_xticklabels(["" for i in range(len(axes[key].get_xticks() ))])
+            #axes["beam_08"].get_yaxis().set_visible(True)
+            #axes["beam_09"].get_xaxis().set_visible(True)
+            #axes["beam_10"].get_xaxis().set_visible(True)
+
+          fig.canvas.draw()
+          
+          return fig, axes, xpols, ypols
+
+    def createOverallPowerPlot(self, numchans=ntime, beamid='beam_01'):
+          """ Creates an overall power vs time plot. """
+          
+          fig = plt.figure(figsize=(3,4),dpi=80)
+          ax = plt.subplot(111)
+          
+          # Create two lines per beam, coloured by beam number
+          lines = []
+          colors = [
+              '#cd4a4a', '#ff6e4a', '#9f8170', '#ffcf48', '#bab86c', '#c5e384', '#1dacd6',
+              '#71bc78', '#9aceeb', '#1a4876', '#9d81ba', '#cdc5c2', '#fc89ac'
+              ]
+           
+          x, y = np.cumsum(np.ones(numchans))*2, np.ones(numchans) * 1e4
+          numbers = [int(key[-2:]) for key in self.beams]
+          for num in numbers:
+              line, = ax.plot(x, y, color=colors[num-1], lw=1.5, label='%02da'%num)
+              lines.append(line)
+              
+          for num in numbers:
+              line, = ax.plot(x, y, color=colors[num-1], lw=1.5, label='%02db'%num, linestyle='--')
+              lines.append(line)
+        
+          # Format plot
+          ax.set_ylim(0, 2)
+          ax.set_xlim(0,numchans*2)
+          ax.set_xlabel("Elapsed Time (s)")
+          ax.set_ylabel("Overall Power")
+
+          # Shink current axis by 20%
+          box = ax.get_position()
+          ax.set_position([box.x0, box.y0, box.width * 0.8, box.height])
+
+          # Put a legend to the right of the current axis
+          ax.legend(loc='center left', bbox_to_anchor=(1, 0.5), ncol=2)
+            
+          fig.canvas.draw()
+          
+          return fig, ax, lines
+
+    def updateOverallPowerPlot(self, key, xx, yy):
+        """ Update power monitor history with new total powers. """
+        self.power_data[key].append((xx, yy))
+
+    def redrawOverallPowerPlot(self):
+        """ Copy new power monitor history into the plot lines, newest first, and autoscale """
+        for key, history in self.power_data.items():
+            if self.p_counts.get(key) == history.count:
+                continue
+            self.p_counts[key] = history.count
+            idx = self.beam_index[key]
+            line_data = history.ordered()[::-1]
+            self.p_lines[idx].set_ydata(line_data[:, 0])
+            self.p_lines[idx+len(self.beams)].set_ydata(line_data[:, 1])
+        
+        # Extrema are kept up to date by the history buffers, so this is O(1) per beam
+        g_max = max([history.max() for history in self.power_data.values()])
+        g_min = min([history.min() for history in self.power_data.values()])
+        
+        # Only rescale (forcing a full redraw) if the data leave the axes or shrink well inside
+        # them, comparing the limits the data would get, margin included, as for the multibeam
+        ymin, ymax = self.p_ax.get_ylim()
+        lo, hi = g_min/1.01, g_max*1.01
+        if g_max > ymax or g_min < ymin or (hi - lo) < 0.5 * (ymax - ymin):
+            self.p_ax.set_ylim(lo, hi)
+            self.p_blit.invalidate()
+
+    def updateTimeSeriesData(self, key, new_data, timestamp=None):
+        """ Update time series data for waterfall plot """
+        self.time_series_data[key].append(new_data, timestamp or self.timestamp or time.time())
+
+    def updateWaterfallGrid(self, idx):
+        """ Write the latest deviations of beams into their waterfall grid tiles, in place
+        
+        Each tile shows a beam's deviation from its running per-channel statistics (see
+        SpectralStats.score), the larger of the two polarisations, reduced to wg_nchan
+        channels by their maximum so single-channel RFI stays visible. Tiles are sweep
+        displays: rows are written from top to bottom and wrap round, and the row after the
+        newest is blanked to show the sweep position. Nothing is moved or copied, so this
+        costs the same for any amount of history.
+        
+        Parameters
+        ----------
+        idx: np.array
+            indexes of the beams just added to the statistics
+        """
+        score = self.stats.score[idx].max(axis=1)
+        nchan = score.shape[-1]
+        if nchan > wg_nchan:
+            score = max_bins(score, wg_nchan)
+        elif nchan < wg_nchan:
+            score = score[:, np.arange(wg_nchan) * nchan // wg_nchan]
+        
+        ncols = self.wg_data.shape[1] // wg_nchan
+        top   = (idx // ncols) * wf_rows
+        cols  = (idx % ncols)[:, np.newaxis] * wg_nchan + np.arange(wg_nchan)
+        count = self.wg_count[idx]
+        self.wg_data[(top + count % wf_rows)[:, np.newaxis], cols] = score
+        self.wg_data[(top + (count + 1) % wf_rows)[:, np.newaxis], cols] = np.nan
+        self.wg_count[idx] = count + 1
+
+    def loadArchivedHistory(self, key):
+        """ Replace the waterfall history of a beam with its full archived history
+        
+        Done once per beam, the first time it is selected; from then on the history is
+        kept up to date as spectra arrive. If the beam has not been received yet, its
+        latest archived spectrum is shown in the beam scope.
+        """
+        if self.archive is None or self.shared_history or key in self.archive_loaded:
+            return
+        self.archive_loaded.add(key)
+        archive = self.archive[key]
+        if not len(archive):
+            return
+        spectra = archive.spectra()
+        self.time_series_data[key].load(spectra[:, 0], archive.times())
+        
+        idx = self.beam_index[key]
+        if not self.received[idx]:
+            self.spectra[idx] = spectra[-1]
+            self.received[idx] = True
+            self.updated[idx] = True
+
+    def setWaterfallTier(self, tier):
+        """ Show a waterfall history tier, 0 being full resolution
+        
+        Every tier has the same number of rows, so drawing costs the same whichever tier is
+        shown. The GUI lists the tiers by the time span they cover (see waterfallSpans).
+        """
+        self.wf_tier = int(tier)
+        self.wf_blit.invalidate()
+        if self.visible["wf"]:
+            self.updateWaterfallPlot()
+            self.wf_blit.update()
+
+    def waterfallSpans(self):
+        """ Nominal time span of each waterfall history tier, in seconds """
+        history = self.time_series_data[self.activeBeam]
+        return [history.span(tier) * spectrum_interval for tier in range(self.wf_ntiers)]
+
+    def updateWaterfallTicks(self, times, latest=None):
+        """ Label waterfall rows with their age
+        
+        Parameters
+        ----------
+        times: np.array
+            timestamp of every row, oldest first, 0 for empty rows
+        latest: float
+            time ages are counted from. Defaults to the time of the last row.
+        """
+        times = times[np.linspace(0, wf_rows - 1, 6).astype('int')]
+        ages  = (times[-1] if latest is None else latest) - times
+        
+        # Rows never written have no timestamp, and neither set the unit nor get a label
+        written = times > 0
+        unit, scale = ("h", 3600.) if written.any() and ages[written].max() > 7200 else ("m", 60.)
+        labels = ["%2.1f"%(age / scale) if w else "" for w, age in zip(written, ages)]
+        if (labels, unit) != self.wf_yticklabels:
+            self.wf_yticklabels = (labels, unit)
+            self.wf_ax.set_ylabel("Elapsed Time (%s)"%unit)
+            self.wf_ax.set_yticklabels(labels)
+            self.wf_blit.invalidate()
+
+    def updateWaterfallPlot(self):
+        """ Updates waterfall plot with new values """
+        
+        # Oldest spectrum at the top, newest at the bottom
+        history = self.time_series_data[self.activeBeam]
+        if self.lookback:
+            # Archived spectra at full resolution fill the bottom rows
+            spectra, times = self.archiveWindow()
+            n = len(spectra)
+            self.wf_data[:wf_rows - n] = history.fill
+            self.wf_data[wf_rows - n:] = spectra[:, 0]
+            row_times = np.zeros(wf_rows)
+            row_times[wf_rows - n:] = times
+            self.updateWaterfallTicks(row_times, self.archive[self.activeBeam].times()[-1] if n else None)
+            key, count = (self.activeBeam, "archive", row_times[-1], self.nchan), n
+        else:
+            history.ordered(self.wf_tier, out=self.wf_data)
+            self.updateWaterfallTicks(history.orderedTimes(self.wf_tier))
+            key, count = (self.activeBeam, self.wf_tier, self.nchan), history.tiers[self.wf_tier].count
+        self.wf_imshow.set_data(self.wf_data)
+        self.wf_levels.update(key, count, self.wf_data)
+        
+        self.wf_ax.set_title("Beam: %s"%self.activeBeam)
+        limits = self.waterfallLimits()
+        if limits is not None and self.waterfallLimitsDrifted(limits):
+            # The colorbar follows the image limits, so needs a full redraw
+            self.wf_imshow.set_clim(*limits)
+            self.wf_blit.invalidate()
+
+    def waterfallLimits(self):
+        """ Waterfall colour limits: wf_thr standard deviations either side of the typical level
+        
+        The level and spread are the median and MAD of the rows shown (see RobustLevels),
+        so RFI does not throw the colour scale. Returns None if there is nothing to scale to.
+        """
+        levels = self.wf_levels.levels()
+        if levels is None or not levels[1] > 0:
+            return None
+        level, spread = levels
+        return level - self.wf_thr*spread, level + self.wf_thr*spread
+
+    def waterfallLimitsDrifted(self, limits):
+        """ Whether new colour limits differ from those shown by more than wf_hysteresis of the range
+        
+        Limits that only wander within that margin are not applied, so the colours and colorbar
+        stay put, and the waterfall is blitted rather than redrawn.
+        """
+        vmin, vmax = self.wf_imshow.get_clim()
+        margin = wf_hysteresis * abs(vmax - vmin)
+        return abs(limits[0] - vmin) > margin or abs(limits[1] - vmax) > margin
+
+    def channelFrequencies(self):
+        """ x values of the beam scope: channel frequencies once known, else channel numbers """
+        if self.freq_axis is not None:
+            return self.freq_axis.freqs
+        return np.arange(1, self.nchan + 1)
+
+    def updateFlagOverlay(self, beam):
+        """ Mark the channels of a beam flagged as RFI, in either polarisation, on the beam scope """
+        channels = np.flatnonzero(self.stats.flags[beam].any(axis=0))
+        self.sb_flags.set_data(self.channelFrequencies()[channels], self.spectra[beam][:, channels].max(axis=0))
+
+    def updateSingleBeamPlot(self, xx, yy):
+        """ Updates single beam plot with new data """
+        self.sb_xpol.set_ydata(xx)
+        self.sb_ypol.set_ydata(yy)
+        
+        update_ax = False
+        dmax, dmin = np.max([xx[1:-1], yy[1:-1]]), np.min([xx[1:-1], yy[1:-1]])
+        if dmax > self.sb_max:
+            update_ax = True
+            self.sb_max = dmax
+        if dmin < self.sb_min:
+            update_ax = True 
+            self.sb_min = dmin
+        if dmax < 2 * self.sb_max:
+            update_ax = True
+        if dmin > 2 * self.sb_min:
+            update_ax = True
+        if update_ax and self.sb_ax.get_ylim() != (self.sb_min, self.sb_max):
+             self.sb_ax.set_ylim(self.sb_min, self.sb_max)
+             self.sb_blit.invalidate()
+             
+        self.sb_blit.update()
+
+    def setWaterfallThreshold(self, thr):
+        """ Change the threshold value for the waterfall plot """
+        self.wf_thr = thr
+        limits = self.waterfallLimits()
+        if limits is not None:
+            self.wf_imshow.set_clim(*limits)
+        self.wf_blit.invalidate()
+        self.wf_blit.update()
+
+    def updateAllPlots(self):
+        """ Redraw all graphs in GUI with the latest spectrum of each beam """ 
+        idx = np.flatnonzero(self.updated)
+        if len(idx):
+            # Limits of all updated beams in one pass, excluding the edge channels
+            inner = self.spectra[idx, :, 1:-1]
+            dmax = inner.max(axis=2).max(axis=1)
+            dmin = inner.min(axis=2).min(axis=1)
+            lines = self.decimateMultiBeam(self.spectra[idx])
+            for ii, beam_idx in enumerate(idx):
+                self.updateMultiBeamPlot(self.beams[beam_idx], lines[ii, 0], lines[ii, 1], dmin[ii], dmax[ii])
+        
+        active = self.beam_index[self.activeBeam]
+        if self.updated[active] and not self.lookback:
+            if self.visible["sb"]:
+                self.updateFlagOverlay(active)
+                self.updateSingleBeamPlot(*self.spectra[active])
+            if self.visible["wf"]:
+                self.updateWaterfallPlot()
+        self.updated[:] = False
+        
+        # Redraw plots that can be seen
+        if self.visible["mb"]:
+            self.ra_dec_text.set_text("RA: %2.2f, DEC: %2.2f"%(self.ra, self.dec))
+            self.mb_blit.update()
+        
+        if self.visible["p"]:
+            self.redrawOverallPowerPlot()
+            self.p_blit.update()
+        if self.visible["wf"]:
+            self.wf_blit.update()
+        if self.visible["wg"] and len(idx):
+            self.wg_imshow.set_data(self.wg_data)
+            self.wg_blit.update()
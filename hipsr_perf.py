@@ -0,0 +1,119 @@
+"""
+hipsr_perf.py
+=============
+
+Lightweight hot-path instrumentation for the HIPSR GUI.
+
+Each stage of the data path (decode, history update, key dispatch, canvas draws) records
+how long it took into a rolling window, from which p50/p99 latencies are computed on
+demand. Recording a sample is a single in-place array write, so timing hooks can stay
+on permanently.
+"""
+
+import time
+import json
+from collections import OrderedDict
+
+import numpy as np
+
+from hipsr_buffers import RingBuffer
+
+
+class StageTimer(object):
+    """ Rolling window of durations for one stage of the data path.
+
+    Parameters
+    ----------
+    maxlen: int
+        number of most recent samples kept
+    """
+    def __init__(self, maxlen=1000):
+        self.samples = RingBuffer(maxlen, ())
+        self.n_total = 0
+        self.t_total = 0.0
+
+    def add(self, dt):
+        """ Record a duration, in seconds """
+        self.samples.append(dt)
+        self.n_total += 1
+        self.t_total += dt
+
+    def percentile(self, q):
+        """ Return the q-th percentile of the recent durations, in seconds """
+        n = min(self.samples.count, self.samples.nrows)
+        if not n:
+            return 0.0
+        return np.percentile(self.samples.data[:n], q)
+
+
+class PerfMonitor(object):
+    """ Collection of stage timers and counters for the HIPSR GUI.
+
+    Parameters
+    ----------
+    maxlen: int
+        number of samples kept per stage
+    """
+    def __init__(self, maxlen=1000):
+        self.maxlen = maxlen
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+
+    def stage(self, name):
+        """ Return the timer for a stage, creating it if needed.
+
+        Threads other than the GUI thread should fetch their timers up front and
+        call add() on them directly.
+        """
+        try:
+            return self.stages[name]
+        except KeyError:
+            self.stages[name] = StageTimer(self.maxlen)
+            return self.stages[name]
+
+    def add(self, stage, dt):
+        """ Record a duration, in seconds, for a stage """
+        self.stage(stage).add(dt)
+
+    def setCounters(self, counters):
+        """ Update counters (packets received, frames rendered, ...)
+
+        Parameters
+        ----------
+        counters: list
+            (name, value) pairs, in the order they should be displayed
+        """
+        self.counters.update(counters)
+
+    def summary(self):
+        """ Return counters and per-stage statistics as a dictionary.
+
+        Durations are in microseconds.
+        """
+        stages = OrderedDict()
+        for name, stage in self.stages.items():
+            stages[name] = {
+                "n"  : stage.n_total,
+                "p50": stage.percentile(50) * 1e6,
+                "p99": stage.percentile(99) * 1e6,
+                }
+        return {"time": time.time(), "counters": self.counters, "stages": stages}
+
+    def text(self):
+        """ Return a one-line summary, for the status bar """
+        parts = ["%s %s"%(name, value) for name, value in self.counters.items()]
+        for name, stage in self.stages.items():
+            parts.append("%s %s/%s"%(name, _fmt_time(stage.percentile(50)), _fmt_time(stage.percentile(99))))
+        return " | ".join(parts)
+
+    def writeJson(self, fh):
+        """ Append the summary to an open file as a single JSON line """
+        fh.write(json.dumps(self.summary()) + "\n")
+        fh.flush()
+
+
+def _fmt_time(dt):
+    """ Format a duration in seconds with sensible units """
+    if dt >= 1e-3:
+        return "%2.1fms"%(dt * 1e3)
+    return "%ius"%(dt * 1e6)
@@ -0,0 +1,341 @@
+"""
+hipsr_pyqtgraph.py
+==================
+
+pyqtgraph plotting backend for the HIPSR GUI.
+
+matplotlib's Qt4Agg backend rasterizes every frame in software, which limits the frame
+rate of the multibeam display, with a panel per beam. PyqtgraphMonitor draws the same
+views with pyqtgraph, which paints lines and images directly with QPainter.
+
+The monitor's data path (history buffers, render scheduler, autoscaling) is shared with
+the matplotlib backend: the pyqtgraph items are wrapped in small adapters that provide the
+handful of matplotlib Axes/Line2D/AxesImage methods HipsrMonitor calls, and ViewUpdater
+stands in for BlitManager. Select it with hipsr-gui.py --backend pyqtgraph.
+"""
+
+import time
+
+import numpy as np
+import pyqtgraph as pg
+import pylab as plt
+
+from hipsr_monitor import HipsrMonitor, multibeam_grid, waterfall_grid, ntime, wf_rows, wg_nchan
+
+xpol_color = '#00CC00'
+ypol_color = '#CC0000'
+flag_color = '#3355FF'
+
+
+class AxesAdapter(object):
+    """ matplotlib Axes-like wrapper around a pyqtgraph PlotItem """
+    def __init__(self, plot):
+        self.plot = plot
+        self.xticks = self.yticks = None
+
+    def get_ylim(self):
+        return tuple(self.plot.viewRange()[1])
+
+    def set_ylim(self, ymin, ymax):
+        self.plot.setYRange(ymin, ymax, padding=0)
+
+    def set_xlim(self, xmin, xmax):
+        self.plot.setXRange(xmin, xmax, padding=0)
+
+    def set_aspect(self, aspect):
+        pass     # Images are stretched to fill the plot
+
+    def set_xlabel(self, label):
+        self.plot.setLabel('bottom', label)
+
+    def set_ylabel(self, label):
+        self.plot.setLabel('left', label)
+
+    def set_title(self, title):
+        self.plot.setTitle(title)
+
+    def set_xticks(self, ticks):
+        self.xticks = list(ticks)
+
+    def set_yticks(self, ticks):
+        self.yticks = list(ticks)
+
+    def set_xticklabels(self, labels, **kwargs):
+        self.plot.getAxis('bottom').setTicks([zip(self.xticks, [str(l) for l in labels])])
+
+    def set_yticklabels(self, labels, **kwargs):
+        self.plot.getAxis('left').setTicks([zip(self.yticks, [str(l) for l in labels])])
+
+
+class LineAdapter(object):
+    """ matplotlib Line2D-like wrapper around a pyqtgraph PlotDataItem """
+    def __init__(self, item, x, y):
+        self.item = item
+        self.x, self.y = x, y
+
+    def set_xdata(self, x):
+        self.x = x
+        self.item.setData(self.x, self.y)
+
+    def set_ydata(self, y):
+        self.y = y
+        self.item.setData(self.x, self.y)
+
+    def set_data(self, x, y):
+        self.x, self.y = x, y
+        self.item.setData(self.x, self.y)
+
+
+class TextAdapter(object):
+    """ matplotlib Text-like wrapper around a pyqtgraph LabelItem """
+    def __init__(self, item):
+        self.item = item
+        self.text = None
+
+    def set_text(self, text):
+        if text != self.text:
+            self.text = text
+            self.item.setText(text)
+
+
+class ImageAdapter(object):
+    """ matplotlib AxesImage-like wrapper around a pyqtgraph ImageItem
+
+    Data are given as (time, channel) rows, as for imshow, with the first row at the top.
+    """
+    def __init__(self, item, data, clim):
+        self.item = item
+        self.data = data
+        self.clim = clim
+
+    def set_data(self, data):
+        self.data = data
+        self.item.setImage(data.T, autoLevels=False, levels=self.clim)
+
+    def set_extent(self, extent):
+        pass     # The image item is sized by its data
+
+    def get_clim(self):
+        return self.clim
+
+    def set_clim(self, vmin, vmax):
+        self.clim = (vmin, vmax)
+        self.item.setLevels(self.clim)
+
+
+class ViewUpdater(object):
+    """ Stand-in for BlitManager on pyqtgraph views.
+
+    pyqtgraph repaints only the items whose data changed, so there is no background to
+    cache: update() just schedules a repaint. Rendered frames are not cached, so
+    showFrame() always returns False and scrubbing redraws each frame.
+
+    Parameters
+    ----------
+    widget: GraphicsLayoutWidget
+        widget displaying the view
+    timer: StageTimer
+        if given, the duration of every update is recorded here
+    """
+    def __init__(self, widget, timer=None):
+        self.widget = widget
+        self.timer = timer
+        self.dirty = True
+        self.n_full = 0
+        self.n_blit = 0
+
+    def invalidate(self):
+        self.dirty = True
+
+    def update(self):
+        t0 = time.time()
+        self.widget.update()
+        if self.dirty:
+            self.dirty = False
+            self.n_full += 1
+        else:
+            self.n_blit += 1
+        if self.timer is not None:
+            self.timer.add(time.time() - t0)
+
+    def cacheFrame(self, key):
+        pass
+
+    def showFrame(self, key):
+        return False
+
+    def clearFrames(self):
+        pass
+
+
+class PyqtgraphMonitor(HipsrMonitor):
+    """ HIPSR monitor that draws with pyqtgraph instead of matplotlib.
+
+    Takes the same parameters as HipsrMonitor; canvas_class is ignored. A QApplication
+    must exist before it is created.
+    """
+    def createViews(self, canvas_class=None):
+        """ Create the plots as pyqtgraph widgets """
+        pg.setConfigOptions(background='w', foreground='k', antialias=False)
+        self.widgets = {}
+        self.mb_ax, self.mb_xpols, self.mb_ypols = self.createMultiBeamPlot(self.nchan)
+        self.sb_ax, self.sb_xpol, self.sb_ypol, self.sb_title = self.createSingleBeamPlot(self.nchan, self.beams[0])
+        self.sb_flags = self.createFlagOverlay()
+        self.p_ax, self.p_lines = self.createOverallPowerPlot()
+        self.wf_ax, self.wf_imshow, self.wf_data = self.createWaterfallPlot()
+        self.wf_colorbar = None
+        self.wg_ax, self.wg_imshow, self.wg_data = self.createWaterfallGridPlot()
+
+        self.mb_blit = ViewUpdater(self.widgets["mb"], timer=self.perf.stage("draw_mb"))
+        self.sb_blit = ViewUpdater(self.widgets["sb"], timer=self.perf.stage("draw_sb"))
+        self.p_blit  = ViewUpdater(self.widgets["p"], timer=self.perf.stage("draw_p"))
+        self.wf_blit = ViewUpdater(self.widgets["wf"], timer=self.perf.stage("draw_wf"))
+        self.wg_blit = ViewUpdater(self.widgets["wg"], timer=self.perf.stage("draw_wg"))
+
+    def canvas(self, view):
+        """ Return the widget that displays a view ("mb", "sb", "p", "wf" or "wg") """
+        return self.widgets[view]
+
+    def multiBeamPanelWidth(self):
+        """ Multibeam lines are decimated by pyqtgraph, so are always given in full """
+        return None
+
+    def createMultiBeamPlot(self, numchans=256):
+        """ Creates a plot for each monitored beam, in a hexagonal array representing the multibeam feeds """
+        widget = pg.GraphicsLayoutWidget()
+        self.widgets["mb"] = widget
+        plotSize = 4
+        gridSize = 5*plotSize+1
+        widget.addLabel("Multibeam monitor", row=0, col=0, colspan=gridSize, size='20pt')
+
+        x = np.cumsum(np.ones(numchans))
+        axes, xpols, ypols = {}, {}, {}
+        grid = multibeam_grid(plotSize)
+        for key in self.beams:
+            row, col = grid[key]
+            plot = widget.addPlot(row=row-plotSize/2+1, col=col-plotSize/2, rowspan=plotSize, colspan=plotSize,
+                                  title=key[-2:])
+            plot.hideAxis('left')
+            plot.getAxis('bottom').setTicks([[]])
+            plot.setMouseEnabled(x=False, y=False)
+            plot.hideButtons()
+            axes[key] = AxesAdapter(plot)
+            axes[key].set_xlim(0, numchans)
+            axes[key].set_ylim(0, 2)
+            # pyqtgraph does its own min/max ("peak") decimation to the panel width
+            for lines, color in ((xpols, xpol_color), (ypols, ypol_color)):
+                item = plot.plot(x, np.ones(numchans), pen=color, autoDownsample=True,
+                                 downsampleMethod='peak', clipToView=True)
+                lines[key] = LineAdapter(item, x, np.ones(numchans))
+
+        self.ra_dec_text = TextAdapter(widget.addLabel("RA: 00.00, DEC: 00.00", row=gridSize+1, col=0,
+                                                       colspan=gridSize, size='14pt'))
+        return axes, xpols, ypols
+
+    def createSingleBeamPlot(self, numchans=256, beamid='beam_01'):
+        """ Creates a single plot for HIPSR data. """
+        widget = pg.GraphicsLayoutWidget()
+        self.widgets["sb"] = widget
+        title = TextAdapter(widget.addLabel("Beam monitor: %s"%beamid, row=0, col=0, size='14pt'))
+        plot = widget.addPlot(row=1, col=0)
+
+        x = np.cumsum(np.ones(numchans))
+        xpol = LineAdapter(plot.plot(x, np.ones(numchans), pen=xpol_color), x, np.ones(numchans))
+        ypol = LineAdapter(plot.plot(x, np.ones(numchans), pen=ypol_color), x, np.ones(numchans))
+
+        ax = AxesAdapter(plot)
+        ax.set_ylim(0, 2)
+        ax.set_xlim(0, numchans)
+        ax.set_xlabel("Channel (-)")
+        ax.set_ylabel("Power (-)")
+        self.sb_max = 2
+        self.sb_min = 0
+
+        return ax, xpol, ypol, title
+
+    def createFlagOverlay(self):
+        """ Creates the markers for RFI flagged channels on the beam scope """
+        item = self.sb_ax.plot.plot([], [], pen=None, symbol='t', symbolPen=None, symbolBrush=flag_color)
+        return LineAdapter(item, np.zeros(0), np.zeros(0))
+
+    def createWaterfallPlot(self):
+        """ Creates a single image plot for HIPSR data. """
+        widget = pg.GraphicsLayoutWidget()
+        self.widgets["wf"] = widget
+        plot = widget.addPlot(row=0, col=0)
+        plot.invertY(True)
+
+        data = np.zeros([wf_rows,self.nchan])
+        data[0] = np.ones_like(data[0]) * 100
+        lut = (plt.cm.gist_heat_r(np.linspace(0, 1, 256))[:, :3] * 255).astype('uint8')
+        item = pg.ImageItem()
+        item.setLookupTable(lut)
+        plot.addItem(item)
+        wf = ImageAdapter(item, data, (0, 80))
+        wf.set_data(data)
+
+        ax = AxesAdapter(plot)
+        ax.set_ylabel("Elapsed Time (m)")
+        ax.set_yticks(np.linspace(0, wf_rows, 6))
+        ax.set_yticklabels([5,4,3,2,1,0])
+        ax.set_xlabel("Channel")
+
+        return ax, wf, data
+
+    def createWaterfallGridPlot(self):
+        """ Creates a single image plot holding a waterfall tile for every beam """
+        widget = pg.GraphicsLayoutWidget()
+        self.widgets["wg"] = widget
+        plot = widget.addPlot(row=0, col=0, title="All beams")
+        plot.invertY(True)
+        plot.hideAxis('left')
+        plot.hideAxis('bottom')
+
+        nrows, ncols = waterfall_grid(len(self.beams))
+        data = np.zeros([nrows * wf_rows, ncols * wg_nchan], dtype='float32')
+        lut = (plt.cm.gist_heat_r(np.linspace(0, 1, 256))[:, :3] * 255).astype('uint8')
+        item = pg.ImageItem()
+        item.setLookupTable(lut)
+        plot.addItem(item)
+        wg = ImageAdapter(item, data, (0, 2 * self.rfi_sigma))
+        wg.set_data(data)
+
+        # Tile borders and beam labels; NaN rows (the sweep position) are transparent
+        for row in range(1, nrows):
+            plot.addItem(pg.InfiniteLine(pos=row * wf_rows, angle=0, pen='#666666'))
+        for col in range(1, ncols):
+            plot.addItem(pg.InfiniteLine(pos=col * wg_nchan, angle=90, pen='#666666'))
+        for idx, key in enumerate(self.beams):
+            row, col = divmod(idx, ncols)
+            label = pg.TextItem(key[-2:], color='#1a4876', anchor=(0, 0))
+            label.setPos(col * wg_nchan, row * wf_rows)
+            plot.addItem(label)
+
+        return AxesAdapter(plot), wg, data
+
+    def createOverallPowerPlot(self, numchans=ntime, beamid='beam_01'):
+        """ Creates an overall power vs time plot. """
+        widget = pg.GraphicsLayoutWidget()
+        self.widgets["p"] = widget
+        plot = widget.addPlot(row=0, col=0)
+        plot.addLegend()
+
+        colors = [
+            '#cd4a4a', '#ff6e4a', '#9f8170', '#ffcf48', '#bab86c', '#c5e384', '#1dacd6',
+            '#71bc78', '#9aceeb', '#1a4876', '#9d81ba', '#cdc5c2', '#fc89ac'
+            ]
+        lines = []
+        x, y = np.cumsum(np.ones(numchans))*2, np.ones(numchans) * 1e4
+        for style, suffix in ((pg.QtCore.Qt.SolidLine, 'a'), (pg.QtCore.Qt.DashLine, 'b')):
+            for num in [int(key[-2:]) for key in self.beams]:
+                pen = pg.mkPen(colors[num-1], width=1.5, style=style)
+                item = plot.plot(x, y, pen=pen, name='%02d%s'%(num, suffix))
+                lines.append(LineAdapter(item, x, y))
+
+        ax = AxesAdapter(plot)
+        ax.set_ylim(0, 2)
+        ax.set_xlim(0, numchans*2)
+        ax.set_xlabel("Elapsed Time (s)")
+        ax.set_ylabel("Overall Power")
+
+        return ax, lines
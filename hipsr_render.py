@@ -0,0 +1,197 @@
+"""
+hipsr_render.py
+===============
+
+Rendering helpers for the HIPSR GUI's matplotlib canvases.
+
+Level of detail
+---------------
+A multibeam panel is only a few dozen pixels wide, far fewer than the channels in a
+spectrum. minmax_envelope() reduces spectra to the minimum and maximum of each pixel
+column before they are plotted, so drawing cost depends on the panel width rather than
+the channel count, and a single-channel RFI spike still reaches its full height.
+"""
+
+import time
+from collections import OrderedDict
+
+import numpy as np
+from matplotlib.transforms import Bbox
+
+
+class BlitManager(object):
+    """ Incremental redraw of a matplotlib canvas using blitting.
+
+    The static parts of the figure (axes, ticks, labels, legends) are rendered once and
+    cached as a background image. On update, the background is restored and only the
+    registered artists, which change with every spectrum, are redrawn on top of it.
+
+    A full redraw happens when the background is invalidated, i.e. whenever limits,
+    ticks, labels or layout change. Call invalidate() after changing any of those.
+    Any full draw of the canvas (resize, toolbar zoom/pan) refreshes the background.
+
+    Parameters
+    ----------
+    canvas: FigureCanvas
+        canvas to manage. Must support copy_from_bbox / restore_region (Agg based).
+    artists: list
+        artists that are redrawn on every update
+    timer: StageTimer
+        if given, the duration of every update is recorded here
+    max_frames: int
+        number of rendered frames kept by cacheFrame()
+    max_bytes: int
+        memory limit on the rendered frames kept by cacheFrame(). The oldest are dropped.
+    """
+    def __init__(self, canvas, artists=(), timer=None, max_frames=64, max_bytes=32 * 2**20):
+        self.canvas = canvas
+        self.timer = timer
+        self.artists = []
+        self.background = None
+        self.dirty = True
+        self.n_full = 0     # Number of full redraws
+        self.n_blit = 0     # Number of blitted redraws
+        self.frames = OrderedDict()     # Cached rendered frames, oldest first
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.frame_bytes = 0            # Memory used by the cached frames
+        self._drawing = False
+        for artist in artists:
+            self.addArtist(artist)
+        self.cid = canvas.mpl_connect('draw_event', self.onDraw)
+
+    def addArtist(self, artist):
+        """ Register an artist to be redrawn on every update """
+        artist.set_animated(True)
+        self.artists.append(artist)
+
+    def invalidate(self):
+        """ Force a full redraw on the next update """
+        self.dirty = True
+
+    def onDraw(self, event):
+        """ Callback for full canvas draws: cache the new background """
+        self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self.drawArtists()
+        if not self._drawing:
+            # Resize or toolbar zoom/pan: cached frames no longer match the canvas
+            self.clearFrames()
+
+    def drawArtists(self):
+        """ Draw the registered artists onto the canvas """
+        fig = self.canvas.figure
+        for artist in self.artists:
+            fig.draw_artist(artist)
+
+    def update(self):
+        """ Redraw the canvas, blitting if the cached background is still valid """
+        t0 = time.time()
+        if self.dirty or self.background is None:
+            self.dirty = False
+            self._drawing = True
+            try:
+                self.canvas.draw()
+            finally:
+                self._drawing = False
+            self.n_full += 1
+        else:
+            self.canvas.restore_region(self.background)
+            self.drawArtists()
+            self.canvas.blit(self.canvas.figure.bbox)
+            self.n_blit += 1
+        if self.timer is not None:
+            self.timer.add(time.time() - t0)
+
+    def frameBbox(self):
+        """ Region of the canvas that changes between frames: the axes of the registered
+        artists, with their tick labels, or the whole figure if they have no axes """
+        renderer = self.canvas.get_renderer()
+        axes = set([artist.axes for artist in self.artists if artist.axes is not None])
+        if not axes:
+            return self.canvas.figure.bbox
+        bbox = Bbox.union([ax.get_tightbbox(renderer) for ax in axes])
+        return Bbox.intersection(bbox, self.canvas.figure.bbox) or self.canvas.figure.bbox
+
+    def cacheFrame(self, key):
+        """ Keep a copy of the canvas as currently rendered, to be shown again by showFrame()
+        
+        Only frameBbox() is kept, and at most max_frames frames or max_bytes of them.
+        """
+        bbox = self.frameBbox()
+        nbytes = int(bbox.width * bbox.height * 4)
+        if key in self.frames:
+            self.frame_bytes -= self.frames.pop(key)[2]
+        self.frames[key] = (self.canvas.copy_from_bbox(bbox), bbox, nbytes)
+        self.frame_bytes += nbytes
+        while len(self.frames) > self.max_frames or (self.frame_bytes > self.max_bytes and len(self.frames) > 1):
+            self.frame_bytes -= self.frames.popitem(last=False)[1][2]
+
+    def showFrame(self, key):
+        """ Put a cached frame back on the canvas. Returns False if it is not cached. """
+        try:
+            image, bbox, nbytes = self.frames[key]
+        except KeyError:
+            return False
+        self.canvas.restore_region(image)
+        self.canvas.blit(bbox)
+        return True
+
+    def clearFrames(self):
+        """ Discard all cached frames """
+        self.frames.clear()
+        self.frame_bytes = 0
+
+
+def envelope_bins(nchan, nbins):
+    """ Return the first channel of each of nbins near-equal bins spanning nchan channels """
+    return np.linspace(0, nchan, nbins + 1).astype('int')[:-1]
+
+
+def minmax_envelope(data, nbins):
+    """ Min/max decimation of spectra along their last (channel) axis
+    
+    Parameters
+    ----------
+    data: np.array
+        spectra, of shape (..., nchan). Any leading axes (beams, polarisations) are
+        decimated in the same call.
+    nbins: int
+        number of channel bins, at most nchan. Typically the plot width in pixels.
+    
+    Returns an array of shape (..., 2*nbins) holding the minimum then the maximum of each
+    bin; plotted against envelope_channels() it draws one vertical stroke per bin.
+    """
+    nchan = data.shape[-1]
+    if nchan % nbins == 0:
+        binned = data.reshape(data.shape[:-1] + (nbins, nchan // nbins))
+        lo, hi = binned.min(axis=-1), binned.max(axis=-1)
+    else:
+        starts = envelope_bins(nchan, nbins)
+        lo = np.minimum.reduceat(data, starts, axis=-1)
+        hi = np.maximum.reduceat(data, starts, axis=-1)
+    envelope = np.empty(data.shape[:-1] + (nbins, 2), dtype=data.dtype)
+    envelope[..., 0] = lo
+    envelope[..., 1] = hi
+    return envelope.reshape(data.shape[:-1] + (2 * nbins,))
+
+
+def max_bins(data, nbins):
+    """ Max decimation of spectra along their last (channel) axis
+    
+    Returns an array of shape (..., nbins) holding the maximum of each bin, so narrow RFI
+    survives decimation, as with minmax_envelope(). nbins is at most nchan.
+    """
+    nchan = data.shape[-1]
+    if nchan % nbins == 0:
+        return data.reshape(data.shape[:-1] + (nbins, nchan // nbins)).max(axis=-1)
+    return np.maximum.reduceat(data, envelope_bins(nchan, nbins), axis=-1)
+
+
+def envelope_channels(nchan, nbins):
+    """ x values for minmax_envelope() output: the centre of each bin, twice
+    
+    Channels are numbered from 1, as in the full resolution plots.
+    """
+    starts = envelope_bins(nchan, nbins)
+    stops = np.append(starts[1:], nchan)
+    return np.repeat((starts + stops + 1) / 2.0, 2)
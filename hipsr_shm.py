@@ -0,0 +1,448 @@
+"""
+hipsr_shm.py
+============
+
+Shared-memory transport from a HIPSR ingest daemon to GUIs on the same machine.
+
+The daemon (hipsr-gui.py --serve-shm NAME) decodes the UDP stream and writes every beam
+spectrum into a block of shared memory; GUIs started with --connect-shm NAME read them
+straight out of it. Nothing is serialized or sent through a pipe, and neither side ever
+waits for the other.
+
+Layout
+------
+The block is a memory-mapped file, in /dev/shm where available. Python 2 has no
+multiprocessing.shared_memory, but a shared file mapping is what that module uses too.
+All values are little-endian:
+
+  ============================ ===============================================
+  header (40 bytes)            SHM_MAGIC, uint32 version, nbeams, nchan, nrows,
+                               ntiers, factor, npower
+  int64 control[8]             control[0] is the generation counter, control[1]
+                               is set once the block has been replaced
+  int64 counts[nbeams]         spectra written per beam, ever
+  int64 tier_counts[nbeams,    rows written to each waterfall history tier
+        ntiers]
+  float64 meta[nbeams, nrows,  timestamp, tcs-frequency, tcs-bandwidth, tcs-ra
+          5]                   and tcs-dec of each spectrum
+  float64 power[nbeams,        total power of xx and yy of the last npower
+          npower, 2]           spectra, a ring indexed by count % npower
+  float64 tier_times[nbeams,   timestamp of each waterfall history row
+          ntiers, nrows]
+  float32 spectra[nbeams,      xx and yy of the last nrows spectra of each
+          nrows, 2, nchan]     beam, a ring indexed by count % nrows
+  float32 tiers[nbeams,        waterfall history of each beam, as kept by a
+          ntiers, nrows,       PyramidBuffer: xx in ascending frequency, older
+          nchan]               rows averaged or max-held by factor per tier
+  ============================ ===============================================
+
+The daemon keeps the waterfall and power history, in the block itself: viewers wrap
+buffers from hipsr_buffers.py around its arrays (see SharedSpectra.history) and draw from
+them in place, so no viewer repeats that work or copies the history.
+
+Consistency
+-----------
+The writer fills a ring row, its metadata and the history first, then increments the
+beam's count and finally the generation. A reader that sees the generation unchanged has
+nothing to do. Otherwise it copies the spectra between the counts it last saw and the
+current ones, then reads the counts again: any row the writer may have overwritten during
+the copy, or may be writing now (one that is now nrows or more behind), is discarded, as
+with a seqlock retry, and counted in n_torn. Only the torn rows are lost, so the reader
+never has to wait or retry.
+
+History is drawn straight from the block instead, without a retry: a row the writer is
+writing while a frame is drawn shows partly updated until the next frame.
+
+If the channel count of the stream changes, the writer creates a new block under the
+same name (atomically, by renaming it into place) and marks the old one replaced.
+Readers then reopen the block by name and carry on at the new channel count. A daemon
+that stops marks its block replaced too, and readers also reopen the block if the file
+under its name is a different one, e.g. after the daemon crashed and was restarted. A
+replaced block stays mapped for as long as buffers around it are still in use.
+"""
+
+import os
+import mmap
+import struct
+import tempfile
+import time
+
+import numpy as np
+
+from hipsr_buffers import RingBuffer, MinMaxRingBuffer, PyramidBuffer
+
+SHM_MAGIC   = b"HIPSRSHM"
+SHM_VERSION = 2
+SHM_HEADER  = struct.Struct("<8sIIIIIII4x")
+
+TCS_KEYS = ("tcs-frequency", "tcs-bandwidth", "tcs-ra", "tcs-dec")
+
+# Initial history values, as in a HipsrMonitor keeping its own history
+WATERFALL_FILL = 1.0
+POWER_FILL     = 1e4
+
+
+def shm_path(name):
+    """ Return the file backing a named shared memory block """
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, name)
+
+
+class SharedSpectra(object):
+    """ Memory-mapped block of the most recent spectra of every beam.
+
+    Use create() in the writing process and open() in reading processes.
+
+    Parameters
+    ----------
+    filename: str
+        file backing the block
+    fh: file
+        file opened on it, read-write for the writer
+    writable: bool
+        whether this process writes to the block
+    """
+    def __init__(self, filename, fh, writable):
+        self.filename = filename
+        self.fh = fh
+        access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+        self.mm = mmap.mmap(fh.fileno(), 0, access=access)
+        self.inode = os.fstat(fh.fileno()).st_ino
+        (magic, version, self.nbeams, self.nchan, self.nrows,
+         self.ntiers, self.factor, self.npower) = SHM_HEADER.unpack_from(self.mm)
+        if magic != SHM_MAGIC:
+            raise ValueError("%s is not a HIPSR shared memory block"%filename)
+        if version != SHM_VERSION:
+            raise ValueError("Unsupported shared memory version: %i"%version)
+
+        # numpy views onto the shared memory
+        offset = SHM_HEADER.size
+        for name, dtype, shape in self.layout(self.nbeams, self.nchan, self.nrows, self.ntiers, self.npower):
+            view = np.frombuffer(self.mm, dtype=dtype, count=int(np.prod(shape)), offset=offset)
+            setattr(self, name, view.reshape(shape))
+            offset += view.nbytes
+
+    @staticmethod
+    def layout(nbeams, nchan, nrows, ntiers, npower):
+        """ Name, data type and shape of each array in a block, in order """
+        return [
+            ("control",     '<i8', (8,)),
+            ("counts",      '<i8', (nbeams,)),
+            ("tier_counts", '<i8', (nbeams, ntiers)),
+            ("meta",        '<f8', (nbeams, nrows, 5)),
+            ("power",       '<f8', (nbeams, npower, 2)),
+            ("tier_times",  '<f8', (nbeams, ntiers, nrows)),
+            ("spectra",     '<f4', (nbeams, nrows, 2, nchan)),
+            ("tiers",       '<f4', (nbeams, ntiers, nrows, nchan)),
+            ]
+
+    @classmethod
+    def size(cls, nbeams, nchan, nrows, ntiers=1, npower=120):
+        """ Size of a block, in bytes """
+        return SHM_HEADER.size + sum([np.dtype(dtype).itemsize * np.prod(shape) for name, dtype, shape
+                                      in cls.layout(nbeams, nchan, nrows, ntiers, npower)])
+
+    @classmethod
+    def create(cls, name, nbeams=13, nchan=256, nrows=150, ntiers=1, factor=4, npower=120):
+        """ Create (or replace) a named block, for writing
+        
+        Readers that have the block it replaces open keep their mapping of it. History
+        starts at WATERFALL_FILL and POWER_FILL.
+
+        Parameters
+        ----------
+        name: str
+            block name, shared by the daemon and the GUIs
+        nbeams: int
+            number of beams
+        nchan: int
+            number of channels per polarisation
+        nrows: int
+            number of recent spectra kept per beam, and of rows in each waterfall history tier
+        ntiers: int
+            number of waterfall history tiers
+        factor: int
+            decimation factor between neighbouring tiers
+        npower: int
+            number of total powers kept per beam
+        """
+        filename = shm_path(name)
+        fh = open(filename + ".new", 'w+b')
+        fh.truncate(cls.size(nbeams, nchan, nrows, ntiers, npower))
+        fh.write(SHM_HEADER.pack(SHM_MAGIC, SHM_VERSION, nbeams, nchan, nrows, ntiers, factor, npower))
+        fh.flush()
+        block = cls(filename, fh, True)
+        block.tiers.fill(WATERFALL_FILL)
+        block.power.fill(POWER_FILL)
+        os.rename(filename + ".new", filename)
+        return block
+
+    @classmethod
+    def open(cls, name):
+        """ Open an existing named block, for reading """
+        filename = shm_path(name)
+        return cls(filename, open(filename, 'rb'), False)
+
+    @property
+    def generation(self):
+        return int(self.control[0])
+
+    @property
+    def replaced(self):
+        return bool(self.control[1])
+
+    def history(self, reduce='mean'):
+        """ Return buffers around the waterfall and power history of every beam in the block
+        
+        The buffers hold views of the block, not copies. The writer appends to them; readers
+        call sync() with the block's counts to see what the writer has appended since.
+        
+        Parameters
+        ----------
+        reduce: str
+            how the writer reduces waterfall rows into coarser tiers, 'mean' or 'max'
+        
+        Returns
+        -------
+        (waterfall, power): a dict of PyramidBuffer and a dict of MinMaxRingBuffer,
+        keyed by beam name
+        """
+        waterfall, power = {}, {}
+        for beam in range(self.nbeams):
+            key = "beam_%02i"%(beam + 1)
+            waterfall[key] = PyramidBuffer(self.nrows, self.nchan, self.ntiers, self.factor, reduce,
+                                           WATERFALL_FILL, data=self.tiers[beam], times=self.tier_times[beam])
+            power[key] = MinMaxRingBuffer(self.npower, 2, POWER_FILL, data=self.power[beam])
+        return waterfall, power
+
+    def write(self, beam, xx, yy, timestamp, tcs):
+        """ Write a spectrum of a beam (0-based index) into its ring
+
+        Parameters
+        ----------
+        beam: int
+            beam index, 0 for beam_01
+        xx, yy: np.array
+            spectra, nchan channels each
+        timestamp: float
+            UNIX time the spectrum was taken
+        tcs: list
+            tcs-frequency, tcs-bandwidth, tcs-ra and tcs-dec
+        """
+        row = self.counts[beam] % self.nrows
+        self.spectra[beam, row, 0] = xx
+        self.spectra[beam, row, 1] = yy
+        self.meta[beam, row, 0] = timestamp
+        self.meta[beam, row, 1:] = tcs
+        self.counts[beam] += 1
+
+    def close(self):
+        """ Release the block. It is unmapped once no buffer from history() is left either,
+        so that those never refer to memory that has gone. """
+        for name, dtype, shape in self.layout(0, 0, 0, 0, 0):
+            setattr(self, name, None)
+        self.mm = None
+        self.fh.close()
+
+
+class SharedSpectraWriter(object):
+    """ Publishes decoded frames and their history into a shared memory block, for the
+    ingest daemon.
+
+    Parameters
+    ----------
+    name: str
+        block name
+    nchan: int
+        number of channels per polarisation to start with. The block is replaced when
+        spectra of another length arrive.
+    nrows: int
+        number of recent spectra kept per beam, and of rows in each waterfall history tier
+    ntiers: int
+        number of waterfall history tiers
+    factor: int
+        decimation factor between neighbouring tiers
+    reduce: str
+        'mean' or 'max', how waterfall rows are reduced into coarser tiers
+    npower: int
+        number of total powers kept per beam
+    """
+    def __init__(self, name, nchan=256, nrows=150, ntiers=1, factor=4, reduce='mean', npower=120):
+        self.name = name
+        self.reduce = reduce
+        self.block = SharedSpectra.create(name, 13, nchan, nrows, ntiers, factor, npower)
+        self.waterfall, self.power = self.block.history(reduce)
+        self.tcs = [0.0, 0.0, 0.0, 0.0]
+        self.n_published = 0
+        self.n_skipped = 0
+
+    def publish(self, frames):
+        """ Write decoded frames to the block, bumping the generation once per call """
+        block = self.block
+        for data in frames:
+            for ii, key in enumerate(TCS_KEYS):
+                if key in data:
+                    self.tcs[ii] = float(data[key])
+            timestamp = float(data.get("timestamp", time.time()))
+            for key in data:
+                if not str(key).startswith("beam_"):
+                    continue
+                xx, yy = data[key]["xx"], data[key]["yy"]
+                if len(xx) != len(yy):
+                    self.n_skipped += 1
+                    continue
+                if len(xx) != block.nchan:
+                    block = self.setChannels(len(xx))
+                
+                # History first: readers only look at it once the count has moved on
+                beam = int(key[-2:]) - 1
+                self.waterfall[key].append(xx[::-1] if self.tcs[1] < 0 else xx, timestamp)
+                self.power[key].append((np.sum(xx), np.sum(yy)))
+                block.tier_counts[beam] = [tier.count for tier in self.waterfall[key].tiers]
+                block.write(beam, xx, yy, timestamp, self.tcs)
+                self.n_published += 1
+        if frames:
+            block.control[0] += 1
+
+    def setChannels(self, nchan):
+        """ Replace the block with one for spectra of nchan channels, and return it """
+        old = self.block
+        self.block = SharedSpectra.create(self.name, old.nbeams, nchan, old.nrows, old.ntiers,
+                                          old.factor, old.npower)
+        self.waterfall, self.power = self.block.history(self.reduce)
+        old.control[0] += 1
+        old.control[1] = 1
+        old.close()
+        return self.block
+
+    def stop(self):
+        """ Close and remove the block. Viewers still reading it keep their mapping, and
+        are told to reopen the block, which a restarted daemon creates again. """
+        self.block.control[0] += 1
+        self.block.control[1] = 1
+        self.block.close()
+        os.remove(self.block.filename)
+
+
+class SharedMemorySource(object):
+    """ Reads frames from a shared memory block written by the ingest daemon.
+
+    Has the interface of the ingest workers in hipsr_ingest.py (start, stop, popFrames,
+    stats), but runs on the caller's thread: popFrames() only copies the rows written
+    since the last call, and returns at once if the generation has not changed.
+    
+    The daemon's waterfall and power history is in history, as returned by
+    SharedSpectra.history(), and kept in sync by popFrames(). It is a new pair of dicts
+    whenever the block is reopened, and None until one has been opened.
+
+    Parameters
+    ----------
+    name: str
+        block name
+    perf: PerfMonitor
+        if given, the time taken to read new rows is recorded in its "decode" stage
+    """
+    def __init__(self, name, perf=None):
+        self.name = name
+        self.block = None
+        self.history = None
+        self.reopen()
+        self.decode_timer = perf.stage("decode") if perf is not None else None
+
+        self.n_received = 0     # Spectra read from the block
+        self.n_torn     = 0     # Spectra overwritten while being read, and discarded
+        self.n_dropped  = 0     # Spectra overwritten before they could be read
+
+    def start(self):
+        pass
+
+    def reopen(self):
+        """ Open the block by name, starting with the history it holds. Returns False
+        if it cannot be opened (yet). """
+        if self.block is not None:
+            self.block.close()
+            self.block = None
+        try:
+            self.block = SharedSpectra.open(self.name)
+        except (IOError, ValueError):
+            return False
+        # The oldest row of a full ring is the next to be overwritten, so is not read
+        self.seen = np.array(self.block.counts)
+        self.seen -= np.minimum(self.seen, self.block.nrows - 1)
+        self.generation = None
+        self.history = self.block.history()
+        return True
+
+    def moved(self):
+        """ Whether the block's name now refers to another file than the one open """
+        try:
+            return os.stat(self.block.filename).st_ino != self.block.inode
+        except OSError:
+            return True
+
+    def stop(self):
+        if self.block is not None:
+            self.block.close()
+
+    def popFrames(self):
+        """ Return a frame for every spectrum written since the last call, oldest first """
+        if self.block is None or self.block.replaced:
+            # The writer moved on to a new block, e.g. for a new channel count
+            if not self.reopen():
+                return []
+        block = self.block
+        generation = block.generation
+        if generation == self.generation:
+            # Nothing new, which is also how a block left behind by a crashed writer looks
+            if self.moved() and self.reopen():
+                return self.popFrames()
+            return []
+        t0 = time.time()
+        self.generation = generation
+
+        counts = np.array(block.counts)
+        frames = []
+        for beam in np.flatnonzero(counts > self.seen):
+            first = self.seen[beam]
+            if counts[beam] - first >= block.nrows:
+                self.n_dropped += counts[beam] - (block.nrows - 1) - first
+                first = counts[beam] - (block.nrows - 1)
+            rows = np.arange(first, counts[beam]) % block.nrows
+            spectra = block.spectra[beam, rows]     # Fancy indexing copies
+            meta = block.meta[beam, rows]
+
+            # Discard rows the writer may have reused while they were being copied
+            valid = np.arange(first, counts[beam]) > block.counts[beam] - block.nrows
+            self.n_torn += len(valid) - valid.sum()
+            key = "beam_%02i"%(beam + 1)
+            for spectrum, values in zip(spectra[valid], meta[valid]):
+                frames.append({
+                    "timestamp"     : values[0],
+                    "tcs-frequency" : values[1],
+                    "tcs-bandwidth" : values[2],
+                    "tcs-ra"        : values[3],
+                    "tcs-dec"       : values[4],
+                    key             : {"xx": spectrum[0], "yy": spectrum[1]},
+                    })
+        self.seen = counts
+        frames.sort(key=lambda frame: frame["timestamp"])
+        
+        waterfall, power = self.history
+        for beam, key in enumerate(sorted(waterfall)):
+            waterfall[key].sync(block.tier_counts[beam])
+            power[key].sync(counts[beam])
+        self.n_received += len(frames)
+        if self.decode_timer is not None:
+            self.decode_timer.add(time.time() - t0)
+        return frames
+
+    def stats(self):
+        """ Return a dictionary of counters, with the same keys as FrameSource.stats() """
+        return {
+            "received" : self.n_received,
+            "decoded"  : self.n_received,
+            "errors"   : self.n_torn,
+            "dropped"  : self.n_dropped,
+            "queued"   : 0,
+            "decode_us": 0.0,
+            }
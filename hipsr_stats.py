@@ -0,0 +1,178 @@
+"""
+hipsr_stats.py
+==============
+
+Online statistics of the HIPSR spectra, for RFI flagging and waterfall colour scaling.
+
+SpectralStats keeps an exponentially weighted running mean and variance of every channel
+of every beam and polarisation. Each frame of spectra is compared with the statistics so
+far: channels more than nsigma standard deviations from their running mean are flagged,
+and each channel's deviation, in standard deviations, is kept as its score.
+The threshold is capped by the band's typical relative noise (see noise()), as RFI that is
+present often enough would otherwise inflate its channel's variance until it is never
+flagged. The statistics are then updated with the spectra. Flagged values are clipped to
+nsigma and left out of the variance, so a burst of RFI barely moves the statistics, while
+a genuine change of level is still followed, if slowly.
+
+All beams of a frame are processed in a handful of numpy operations on (beam, pol,
+channel) arrays, so the cost per spectrum is a few array passes.
+
+Until a beam has warmup spectra, its weights are 1/n, i.e. exact running (Welford)
+statistics, and nothing is flagged.
+
+RobustLevels summarises the rows of a waterfall by their median and median absolute
+deviation as they arrive, and combines the summaries over a sliding window of rows, to
+set colour limits that neither flicker from row to row nor get thrown by RFI.
+"""
+
+import numpy as np
+
+from hipsr_buffers import RingBuffer
+
+
+class SpectralStats(object):
+    """ Running per-channel mean and variance, with N-sigma flags, for all beams.
+
+    Parameters
+    ----------
+    nbeams: int
+        number of beams
+    nchan: int
+        number of channels per polarisation
+    alpha: float
+        weight of each new spectrum once warmed up; the statistics follow changes over
+        about 1/alpha spectra
+    nsigma: float
+        flagging threshold, in standard deviations
+    warmup: int
+        number of spectra per beam before channels are flagged
+    """
+    def __init__(self, nbeams, nchan, alpha=0.01, nsigma=5.0, warmup=10):
+        self.shape = (nbeams, 2, nchan)
+        self.alpha = float(alpha)
+        self.nsigma = float(nsigma)
+        self.warmup = int(warmup)
+        self.reset()
+
+    def reset(self):
+        """ Forget all statistics and flags, e.g. after a retune """
+        self.mean  = np.zeros(self.shape)
+        self.var   = np.zeros(self.shape)
+        self.flags = np.zeros(self.shape, dtype='bool')
+        self.score = np.zeros(self.shape)    # Latest deviation from the mean, in noise units
+        self.count = np.zeros(self.shape[0], dtype='int64')
+
+    def update(self, idx, spectra):
+        """ Flag and add spectra of several beams
+
+        Parameters
+        ----------
+        idx: np.array
+            beam indexes
+        spectra: np.array
+            (len(idx), 2, nchan) spectra of those beams
+        """
+        count = self.count[idx] + 1
+        self.count[idx] = count
+        weight = np.maximum(1.0 / count, self.alpha)[:, np.newaxis, np.newaxis]
+        mean, var = self.mean[idx], self.var[idx]
+
+        diff = spectra - mean
+        noise = self.noise(mean, var)
+        limit = self.nsigma * noise
+        warm = (count > self.warmup)[:, np.newaxis, np.newaxis]
+        flags = warm & (np.abs(diff) > limit)
+        self.flags[idx] = flags
+        self.score[idx] = np.where(warm, diff / np.maximum(noise, 1e-30), 0.0)
+
+        # Flagged values only pull the mean as far as the threshold, and leave the
+        # variance alone, so that intermittent RFI does not hide itself by inflating it
+        clipped = np.where(flags, np.clip(diff, -limit, limit), diff)
+        incr = weight * clipped
+        self.mean[idx] = mean + incr
+        self.var[idx]  = np.where(flags, var, (1 - weight) * (var + clipped * incr))
+
+    def noise(self, mean, var):
+        """ Noise level used for flagging, from running statistics of shape (..., nchan)
+        
+        The smaller of a channel's own standard deviation and the typical noise of the band
+        at the channel's level. The latter is the median across channels of the relative
+        standard deviation, which a few channels with RFI cannot move; radiometer noise is
+        proportional to the signal level, so it scales to every channel.
+        """
+        std = np.sqrt(var)
+        level = np.abs(mean)
+        relative = np.median(std / np.maximum(level, 1e-30), axis=-1)[..., np.newaxis]
+        return np.minimum(std, relative * level)
+
+    def std(self, beam):
+        """ Running standard deviation of a beam, as a (2, nchan) array """
+        return np.sqrt(self.var[beam])
+
+    def nFlagged(self, beam):
+        """ Number of channels of a beam flagged in either polarisation """
+        return int(self.flags[beam].any(axis=0).sum())
+
+
+class RobustLevels(object):
+    """ Robust level and spread of the rows of a ring buffer, over a sliding window.
+
+    Each row is summarised once, when it first appears, by the median and the median
+    absolute deviation (MAD) of its channels. The levels are the medians of the summaries
+    of the last nrows rows, so a few channels or rows with RFI barely move them, and
+    keeping them up to date costs one row's median per new row.
+
+    Parameters
+    ----------
+    nrows: int
+        number of rows in the window
+    edge: int
+        channels at either end of the band that are left out, at most 1/8 of them
+    """
+    def __init__(self, nrows, edge=20):
+        self.summaries = RingBuffer(nrows, 2)
+        self.edge = edge
+        self.reset()
+
+    def reset(self, key=None):
+        """ Empty the window, to be filled from the ring identified by key """
+        self.summaries.index = self.summaries.count = 0
+        self.key = key
+        self.count = 0      # Rows of that ring summarised so far
+
+    def update(self, key, count, rows):
+        """ Summarise the rows added to a ring since the last update
+
+        Parameters
+        ----------
+        key: object
+            identifies the ring, e.g. (beam, tier). The window restarts if it changes.
+        count: int
+            total number of rows ever appended to the ring
+        rows: np.array
+            (nrows, nchan) rows of the ring in time order, newest last
+        """
+        if key != self.key or count < self.count:
+            self.reset(key)
+        new = min(count - self.count, len(rows), self.summaries.nrows)
+        self.count = count
+        if new <= 0:
+            return
+        nchan = rows.shape[1]
+        edge = min(self.edge, nchan // 8)
+        inner = rows[len(rows) - new:, edge:nchan - edge]
+        median = np.median(inner, axis=1)
+        mad = np.median(np.abs(inner - median[:, np.newaxis]), axis=1)
+        for summary in zip(median, mad):
+            self.summaries.append(summary)
+
+    def levels(self):
+        """ Return the level and spread of the window, or None if it is empty
+
+        The spread is the MAD scaled to the standard deviation of Gaussian noise.
+        """
+        n = min(self.summaries.count, self.summaries.nrows)
+        if not n:
+            return None
+        median, mad = np.median(self.summaries.data[:n], axis=0)
+        return median, 1.4826 * mad
@@ -0,0 +1,65 @@
+"""
+Tests for hipsr_archive.py
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from hipsr_archive import BeamArchive, SpectrumArchive
+
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "beam_01.dat")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_append_and_window(self):
+        archive = BeamArchive(self.filename, nchan=4)
+        for ii in range(10):
+            archive.append(np.ones((2, 4)) * ii, 100.0 + ii)
+        self.assertEqual(len(archive), 10)
+        self.assertEqual(archive.indexAt(104.5), 4)
+        self.assertEqual(archive.indexAt(50.0), -1)
+        spectra, times = archive.window(104.0, 3)
+        self.assertEqual(list(times), [102, 103, 104])
+        self.assertEqual(list(spectra[:, 0, 0]), [2, 3, 4])
+        archive.close()
+
+        reopened = BeamArchive(self.filename, nchan=4)
+        self.assertEqual(len(reopened), 10)
+        reopened.close()
+
+    def test_trims_partial_record(self):
+        archive = BeamArchive(self.filename, nchan=4)
+        archive.append(np.ones((2, 4)), 1.0)
+        archive.close()
+        with open(self.filename, 'ab') as fh:
+            fh.write(b"\0" * 5)
+        reopened = BeamArchive(self.filename, nchan=4)
+        self.assertEqual(len(reopened), 1)
+        reopened.close()
+
+    def test_channel_count(self):
+        # An archive without records takes any channel count, one with records does not
+        BeamArchive(self.filename, nchan=4).close()
+        archive = BeamArchive(self.filename, nchan=8)
+        archive.append(np.ones((2, 8)), 1.0)
+        archive.close()
+        self.assertRaises(ValueError, BeamArchive, self.filename, 4)
+        self.assertRaises(ValueError, SpectrumArchive, self.directory, ["beam_02", "beam_01"], 4)
+
+    def test_foreign_file(self):
+        with open(self.filename, 'wb') as fh:
+            fh.write(b"x" * 64)
+        self.assertRaises(ValueError, BeamArchive, self.filename, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
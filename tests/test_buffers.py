@@ -0,0 +1,89 @@
+"""
+Tests for hipsr_buffers.py
+"""
+
+import unittest
+
+import numpy as np
+
+from hipsr_buffers import RingBuffer, MinMaxRingBuffer, PyramidBuffer
+
+
+class TestRingBuffer(unittest.TestCase):
+    def test_ordered_wraps(self):
+        ring = RingBuffer(4, 2)
+        for ii in range(6):
+            ring.append([ii, -ii])
+        self.assertEqual(ring.count, 6)
+        self.assertEqual(list(ring.ordered()[:, 0]), [2, 3, 4, 5])
+        self.assertEqual(list(ring.latest()), [5, -5])
+
+    def test_ordered_into_out(self):
+        ring = RingBuffer(3, 1, fill=7.0)
+        ring.append([1])
+        out = np.zeros((3, 1))
+        self.assertIs(ring.ordered(out=out), out)
+        self.assertEqual(list(out[:, 0]), [7, 7, 1])
+
+
+class TestMinMaxRingBuffer(unittest.TestCase):
+    def test_extrema_match_contents(self):
+        rng = np.random.RandomState(0)
+        ring = MinMaxRingBuffer(5, 3, fill=0.5)
+        for ii in range(50):
+            ring.append(rng.standard_normal(3))
+            self.assertEqual(ring.min(), ring.data.min())
+            self.assertEqual(ring.max(), ring.data.max())
+
+    def test_rescan_only_when_extremum_overwritten(self):
+        ring = MinMaxRingBuffer(4, 1, fill=0.0)
+        for value in [10, 1, 2, 3]:
+            ring.append([value])
+        n = ring.n_rescans
+        ring.append([2.5])      # Overwrites 10, the maximum
+        self.assertEqual(ring.max(), 3)
+        self.assertEqual(ring.n_rescans, n + 1)
+        ring.append([2.0])      # Overwrites 1, the minimum
+        ring.append([2.2])      # Overwrites 2
+        self.assertEqual(ring.min(), 2.0)
+
+
+class TestPyramidBuffer(unittest.TestCase):
+    def test_mean_tiers(self):
+        pyramid = PyramidBuffer(4, 1, ntiers=3, factor=2)
+        for ii in range(16):
+            pyramid.append([ii], timestamp=ii)
+        self.assertEqual(list(pyramid.ordered(0)[:, 0]), [12, 13, 14, 15])
+        self.assertEqual(list(pyramid.ordered(1)[:, 0]), [8.5, 10.5, 12.5, 14.5])
+        self.assertEqual(list(pyramid.ordered(2)[:, 0]), [1.5, 5.5, 9.5, 13.5])
+        self.assertEqual(list(pyramid.orderedTimes(2)), [3, 7, 11, 15])
+
+    def test_max_tiers(self):
+        pyramid = PyramidBuffer(2, 1, ntiers=2, factor=3, reduce='max')
+        for value in [1, 9, 2, 3, 4, 5]:
+            pyramid.append([value])
+        self.assertEqual(list(pyramid.ordered(1)[:, 0]), [9, 5])
+
+    def test_load_matches_append(self):
+        rng = np.random.RandomState(1)
+        rows, times = rng.standard_normal((37, 3)), np.arange(37.0)
+        appended = PyramidBuffer(5, 3, ntiers=3, factor=2, fill=1.0)
+        for row, t in zip(rows, times):
+            appended.append(row, t)
+        loaded = PyramidBuffer(5, 3, ntiers=3, factor=2, fill=1.0)
+        loaded.load(rows, times)
+        for tier in range(3):
+            np.testing.assert_allclose(loaded.ordered(tier), appended.ordered(tier))
+            np.testing.assert_allclose(loaded.orderedTimes(tier), appended.orderedTimes(tier))
+
+        # Both carry on identically, including partly accumulated groups
+        for pyramid in (appended, loaded):
+            pyramid.append(np.ones(3) * 5, 100.0)
+        np.testing.assert_allclose(loaded.ordered(2), appended.ordered(2))
+
+    def test_bad_reduce(self):
+        self.assertRaises(ValueError, PyramidBuffer, 4, 1, reduce='median')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+"""
+Tests for hipsr_fanout.py
+"""
+
+import socket
+import unittest
+
+import numpy as np
+
+from hipsr_fanout import FanoutServer, ViewerConnection, MESSAGE_HEADER, downsample
+from hipsr_ingest import decode_binary_packet
+
+
+def frames(n, t0=0.0, nchan=16):
+    return [{"timestamp": t0 + ii, "beam_01": {"xx": np.ones(nchan) * (t0 + ii), "yy": np.zeros(nchan)}}
+            for ii in range(n)]
+
+
+class TestFanout(unittest.TestCase):
+    def setUp(self):
+        # Viewers are driven directly, without their threads or the accept loop
+        self.server = FanoutServer("127.0.0.1", 0)
+        self.sock, peer = socket.socketpair()
+        self.viewer = ViewerConnection(peer, ("test", 0), self.server)
+        self.server.viewers.append(self.viewer)
+
+    def tearDown(self):
+        self.sock.close()
+        self.viewer.sock.close()
+        self.server.sock.close()
+
+    def received(self):
+        """ Decode and empty the viewer's message queue """
+        packets = [decode_binary_packet(message) for message in self.viewer.messages]
+        self.viewer.messages.clear()
+        return packets
+
+    def test_history_then_live(self):
+        self.server.publish(frames(10))
+        self.viewer.subscribe({"beams": ["beam_01"]})
+        self.server.publish(frames(2, 10))
+        self.assertEqual([packet["timestamp"] for packet in self.received()], range(12))
+        
+        # Subscribing again sends nothing twice
+        self.viewer.subscribe({"beams": []})
+        self.viewer.subscribe({"beams": ["beam_01"]})
+        self.assertEqual(self.received(), [])
+
+    def test_history_at_subscribed_rate(self):
+        self.server.publish(frames(10))
+        self.viewer.subscribe({"beams": ["beam_01"], "rate": 0.5, "nchan": 4})
+        self.server.publish(frames(4, 10))
+        packets = self.received()
+        self.assertEqual([packet["timestamp"] for packet in packets], [0, 2, 4, 6, 8, 10, 12])
+        self.assertEqual(len(packets[0]["beam_01"]["xx"]), 4)
+
+    def test_downsample(self):
+        spectrum = np.arange(8.0)
+        self.assertEqual(list(downsample(spectrum, 2)), [1.5, 5.5])
+        self.assertIs(downsample(spectrum, 3), spectrum)
+        self.assertIs(downsample(spectrum, None), spectrum)
+
+
+if __name__ == '__main__':
+    unittest.main()
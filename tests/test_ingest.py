@@ -0,0 +1,54 @@
+"""
+Tests for the packet codecs in hipsr_ingest.py
+"""
+
+import unittest
+
+import numpy as np
+
+import hipsr_ingest
+from hipsr_ingest import json, encode_binary_packet, decode_binary_packet, decode_packet
+from hipsr_generator import PacketGenerator
+
+
+class TestCodecs(unittest.TestCase):
+    def test_binary_round_trip(self):
+        xx, yy = np.arange(256, dtype='float32'), -np.arange(256, dtype='float32')
+        packet = encode_binary_packet(7, xx, yy, 1234.5, 1355.0, -400.0, 12.0, -45.0)
+        self.assertEqual(len(packet), hipsr_ingest.BINARY_HEADER.size + 2 * 4 * 256)
+        data = decode_packet(packet)
+        self.assertEqual(data["timestamp"], 1234.5)
+        self.assertEqual(data["tcs-frequency"], 1355.0)
+        self.assertEqual(data["tcs-bandwidth"], -400.0)
+        self.assertEqual((data["tcs-ra"], data["tcs-dec"]), (12.0, -45.0))
+        self.assertEqual(sorted(key for key in data if key.startswith("beam_")), ["beam_07"])
+        np.testing.assert_array_equal(data["beam_07"]["xx"], xx)
+        np.testing.assert_array_equal(data["beam_07"]["yy"], yy)
+
+    def test_binary_version_checked(self):
+        packet = bytearray(encode_binary_packet(1, np.ones(4), np.ones(4)))
+        packet[1] = hipsr_ingest.BINARY_VERSION + 1
+        self.assertRaises(ValueError, decode_binary_packet, bytes(packet))
+
+    def test_json(self):
+        packet = json.dumps({"tcs-frequency": 1400.0, "beam_02": {"xx": [1, 2], "yy": [3, 4]}})
+        data = decode_packet(packet)
+        self.assertEqual(data["tcs-frequency"], 1400.0)
+        self.assertIsInstance(data["beam_02"]["xx"], np.ndarray)
+        self.assertEqual(list(data["beam_02"]["yy"]), [3, 4])
+
+
+    def test_generator_frames(self):
+        for fmt in ('json', 'binary'):
+            frame = PacketGenerator(nchan=64, fmt=fmt).frame()
+            beams = set()
+            for datagram in frame:
+                data = decode_packet(datagram)
+                self.assertEqual(data["tcs-bandwidth"], -400.0)
+                beams.update(key for key in data if key.startswith("beam_"))
+            self.assertEqual(len(frame), 1 if fmt == 'json' else 13)
+            self.assertEqual(len(beams), 13)
+
+
+if __name__ == '__main__':
+    unittest.main()
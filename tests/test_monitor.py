@@ -0,0 +1,127 @@
+"""
+Tests for hipsr_monitor.py, on the Agg backend
+"""
+
+import os
+import unittest
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from hipsr_monitor import HipsrMonitor, wf_rows, ntime
+from hipsr_shm import SharedSpectraWriter, SharedMemorySource
+
+
+def make_frames(rng, beams, level=1.0, noise=0.01):
+    """ One frame per beam, with noisy flat spectra """
+    return [{"beam_%02i"%beam: {"xx": level * (1 + noise * rng.standard_normal(256)),
+                                "yy": level * (1 + noise * rng.standard_normal(256))}}
+            for beam in beams]
+
+
+class MonitorTestCase(unittest.TestCase):
+    def tearDown(self):
+        plt.close('all')
+
+
+class TestMultiBeamRescale(MonitorTestCase):
+    def test_steady_data_is_blitted(self):
+        rng = np.random.RandomState(0)
+        for level, noise in ((1.0, 0.01), (1e4, 0.002)):
+            monitor = HipsrMonitor(beams=["beam_01", "beam_02"])
+            monitor.ingestFrames(make_frames(rng, [1, 2], level, noise))
+            monitor.updateAllPlots()
+            n_full = monitor.mb_blit.n_full
+            for ii in range(20):
+                monitor.ingestFrames(make_frames(rng, [1, 2], level, noise))
+                monitor.updateAllPlots()
+            self.assertEqual(monitor.mb_blit.n_full, n_full)
+
+    def test_rescale_when_data_leave_axes(self):
+        rng = np.random.RandomState(1)
+        monitor = HipsrMonitor(beams=["beam_01"])
+        monitor.ingestFrames(make_frames(rng, [1]))
+        monitor.updateAllPlots()
+        monitor.ingestFrames(make_frames(rng, [1], level=3.0))
+        monitor.updateAllPlots()
+        ymin, ymax = monitor.mb_ax["beam_01"].get_ylim()
+        self.assertTrue(ymin < 3.0 < ymax)
+
+
+class TestPowerRescale(MonitorTestCase):
+    def test_steady_power_is_blitted(self):
+        rng = np.random.RandomState(2)
+        monitor = HipsrMonitor(beams=["beam_01", "beam_02"])
+        # Replace the initial history first, so its fill value no longer sets the limits
+        for ii in range(len(monitor.power_data["beam_01"].data) + 1):
+            monitor.ingestFrames(make_frames(rng, [1, 2]))
+        monitor.updateAllPlots()
+        n_full = monitor.p_blit.n_full
+        for ii in range(20):
+            monitor.ingestFrames(make_frames(rng, [1, 2]))
+            monitor.updateAllPlots()
+        self.assertEqual(monitor.p_blit.n_full, n_full)
+
+
+class TestWaterfallTicks(MonitorTestCase):
+    def test_partly_filled_history(self):
+        rng = np.random.RandomState(3)
+        monitor = HipsrMonitor(beams=["beam_01"])
+        for ii in range(40):
+            frames = make_frames(rng, [1])
+            frames[0]["timestamp"] = 1.4e9 + 2 * ii
+            monitor.ingestFrames(frames)
+        monitor.updateWaterfallPlot()
+        labels, unit = monitor.wf_yticklabels
+        self.assertEqual(unit, "m")
+        self.assertEqual(labels, ["", "", "", "", "1.0", "0.0"])
+
+
+
+class TestSharedHistory(MonitorTestCase):
+    name = "hipsr-test-monitor-%i"%os.getpid()
+
+    def setUp(self):
+        self.writer = SharedSpectraWriter(self.name, nchan=64, nrows=wf_rows, ntiers=2, npower=ntime)
+
+    def tearDown(self):
+        self.writer.stop()
+        super(TestSharedHistory, self).tearDown()
+
+    def test_draws_from_shared_history(self):
+        rng = np.random.RandomState(4)
+        reader = SharedMemorySource(self.name)
+        monitor = HipsrMonitor(beams=["beam_01", "beam_02"])
+        monitor.setSharedHistory(*reader.history)
+        self.assertEqual(monitor.nchan, 64)
+        self.assertEqual(monitor.wf_ntiers, 2)
+        
+        frames = [{"timestamp": 1.4e9 + ii, "tcs-bandwidth": -400.0,
+                   "beam_01": {"xx": rng.uniform(1, 2, 64), "yy": np.ones(64)}}
+                  for ii in range(10)]
+        self.writer.publish(frames)
+        monitor.ingestFrames(reader.popFrames())
+        monitor.updateAllPlots()
+        
+        # History was appended once, by the writer, and is drawn from the block
+        history = reader.history[0]["beam_01"]
+        self.assertIs(monitor.time_series_data["beam_01"], history)
+        self.assertEqual(history.count, 10)
+        np.testing.assert_allclose(monitor.wf_data[-1], frames[-1]["beam_01"]["xx"][::-1], rtol=1e-6)
+        self.assertEqual(monitor.p_counts["beam_01"], 10)
+        reader.stop()
+
+    def test_rejects_other_history_lengths(self):
+        writer = SharedSpectraWriter(self.name + "-short", nchan=64, nrows=10)
+        reader = SharedMemorySource(self.name + "-short")
+        monitor = HipsrMonitor(beams=["beam_01"])
+        self.assertRaises(ValueError, monitor.setSharedHistory, *reader.history)
+        self.assertFalse(monitor.shared_history)
+        reader.stop()
+        writer.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+Tests for hipsr_perf.py
+"""
+
+import json
+import unittest
+from StringIO import StringIO
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+
+from hipsr_perf import StageTimer, PerfMonitor
+from hipsr_render import BlitManager
+
+
+class TestStageTimer(unittest.TestCase):
+    def test_empty(self):
+        self.assertEqual(StageTimer().percentile(50), 0.0)
+
+    def test_percentiles_of_recent_samples(self):
+        timer = StageTimer(maxlen=100)
+        for dt in np.arange(1, 101) * 1e-3:
+            timer.add(dt)
+        self.assertAlmostEqual(timer.percentile(50), 50.5e-3)
+        self.assertAlmostEqual(timer.percentile(99), 99.01e-3)
+
+        # Older samples leave the window, but still count towards the totals
+        for ii in range(100):
+            timer.add(1.0)
+        self.assertEqual(timer.percentile(50), 1.0)
+        self.assertEqual(timer.n_total, 200)
+        self.assertAlmostEqual(timer.t_total, 105.05)
+
+
+class TestPerfMonitor(unittest.TestCase):
+    def test_stages_are_created_once(self):
+        perf = PerfMonitor(maxlen=10)
+        timer = perf.stage("decode")
+        perf.add("decode", 2e-3)
+        self.assertIs(perf.stage("decode"), timer)
+        self.assertEqual(timer.samples.nrows, 10)
+        self.assertEqual(timer.n_total, 1)
+
+    def test_summary_and_text(self):
+        perf = PerfMonitor()
+        perf.add("decode", 20e-6)
+        perf.add("render", 5e-3)
+        perf.setCounters([("rx", 10), ("fps", 9.5)])
+        perf.setCounters([("rx", 12)])
+
+        summary = perf.summary()
+        self.assertEqual(summary["counters"].items(), [("rx", 12), ("fps", 9.5)])
+        self.assertEqual(summary["stages"].keys(), ["decode", "render"])
+        self.assertAlmostEqual(summary["stages"]["decode"]["p50"], 20)
+        self.assertEqual(summary["stages"]["render"]["n"], 1)
+        self.assertEqual(perf.text(), "rx 12 | fps 9.5 | decode 20us/20us | render 5.0ms/5.0ms")
+
+        fh = StringIO()
+        perf.writeJson(fh)
+        perf.writeJson(fh)
+        lines = fh.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[0])["counters"], {"rx": 12, "fps": 9.5})
+
+    def test_blit_manager_records_draws(self):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        line, = fig.add_subplot(111).plot([0, 1], [0, 1])
+        perf = PerfMonitor()
+        blit = BlitManager(fig.canvas, [line], timer=perf.stage("draw"))
+        blit.update()
+        blit.update()
+        self.assertEqual(perf.stage("draw").n_total, 2)
+
+    def test_monitor_records_render(self):
+        from hipsr_monitor import HipsrMonitor
+        monitor = HipsrMonitor(beams=["beam_01"])
+        monitor.ingestFrames([{"beam_01": {"xx": np.ones(256), "yy": np.ones(256)}}])
+        self.assertTrue(monitor.renderFrame())
+        self.assertEqual(monitor.perf.stage("render").n_total, 1)
+        self.assertTrue(monitor.perf.stage("draw_mb").n_total > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
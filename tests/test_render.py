@@ -0,0 +1,42 @@
+"""
+Tests for the decimation helpers in hipsr_render.py
+"""
+
+import unittest
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+
+from hipsr_render import envelope_bins, minmax_envelope, envelope_channels, max_bins
+
+
+class TestDecimation(unittest.TestCase):
+    def test_minmax_envelope_even(self):
+        data = np.arange(8.0)[::-1]
+        self.assertEqual(list(minmax_envelope(data, 4)), [6, 7, 4, 5, 2, 3, 0, 1])
+
+    def test_minmax_envelope_uneven_keeps_spikes(self):
+        rng = np.random.RandomState(0)
+        data = rng.standard_normal((2, 3, 1000))
+        data[1, 2, 617] = 100
+        envelope = minmax_envelope(data, 7)
+        self.assertEqual(envelope.shape, (2, 3, 14))
+        self.assertEqual(envelope.max(), 100)
+        self.assertEqual(envelope[..., 1::2].max(axis=-1).tolist(), data.max(axis=-1).tolist())
+        self.assertEqual(envelope[..., 0::2].min(axis=-1).tolist(), data.min(axis=-1).tolist())
+
+    def test_envelope_channels(self):
+        self.assertEqual(list(envelope_bins(10, 3)), [0, 3, 6])
+        self.assertEqual(list(envelope_channels(8, 2)), [2.5, 2.5, 6.5, 6.5])
+
+    def test_max_bins(self):
+        data = np.array([[1, 5, 2, 0, 3, 3, 9]], dtype=float)
+        self.assertEqual(max_bins(data, 7).tolist(), data.tolist())
+        # Bins start at envelope_bins(7, 3) = [0, 2, 4]
+        self.assertEqual(max_bins(data, 3).tolist(), [[5, 2, 9]])
+        self.assertEqual(max_bins(data[:, :6], 2).tolist(), [[5, 3]])
+
+
+if __name__ == '__main__':
+    unittest.main()
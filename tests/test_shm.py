@@ -0,0 +1,126 @@
+"""
+Tests for hipsr_shm.py
+"""
+
+import os
+import unittest
+
+import numpy as np
+
+from hipsr_buffers import PyramidBuffer
+from hipsr_shm import SharedSpectraWriter, SharedMemorySource, shm_path
+
+
+def frames(n, t0=0.0, beam="beam_01", nchan=16):
+    return [{"timestamp": t0 + ii, beam: {"xx": np.ones(nchan) * (t0 + ii), "yy": np.zeros(nchan)}}
+            for ii in range(n)]
+
+
+class TestSharedMemory(unittest.TestCase):
+    name = "hipsr-test-%i"%os.getpid()
+
+    def setUp(self):
+        self.writer = SharedSpectraWriter(self.name, nchan=16, nrows=8)
+
+    def tearDown(self):
+        if os.path.exists(shm_path(self.name)):
+            self.writer.stop()
+
+    def test_history_then_new_rows(self):
+        self.writer.publish(frames(5))
+        reader = SharedMemorySource(self.name)
+        self.assertEqual([f["timestamp"] for f in reader.popFrames()], [0, 1, 2, 3, 4])
+        self.assertEqual(reader.popFrames(), [])
+        self.writer.publish(frames(2, 10))
+        self.assertEqual([f["beam_01"]["xx"][0] for f in reader.popFrames()], [10, 11])
+        reader.stop()
+
+    def test_slot_under_write_is_not_read(self):
+        # With a full ring, the oldest slot is the next to be written: only nrows - 1 are read
+        self.writer.publish(frames(20))
+        reader = SharedMemorySource(self.name)
+        self.assertEqual([f["timestamp"] for f in reader.popFrames()], range(13, 20))
+        self.assertEqual(reader.n_torn, 0)
+        self.writer.publish(frames(30, 100))
+        received = reader.popFrames()
+        self.assertEqual([f["timestamp"] for f in received], range(123, 130))
+        self.assertEqual(reader.n_dropped, 23)
+        reader.stop()
+
+    def test_reopen_after_restart(self):
+        self.writer.publish(frames(3))
+        reader = SharedMemorySource(self.name)
+        reader.popFrames()
+        self.writer.stop()
+        self.assertEqual(reader.popFrames(), [])
+        self.writer = SharedSpectraWriter(self.name, nchan=16, nrows=8)
+        self.writer.publish(frames(4, 50))
+        self.assertEqual(len(reader.popFrames()), 4)
+        reader.stop()
+
+    def test_reopen_on_new_channel_count(self):
+        reader = SharedMemorySource(self.name)
+        self.writer.publish(frames(2, nchan=32))
+        received = reader.popFrames()
+        self.assertEqual(len(received), 2)
+        self.assertEqual(len(received[0]["beam_01"]["xx"]), 32)
+        reader.stop()
+
+
+
+class TestSharedHistory(unittest.TestCase):
+    name = "hipsr-test-history-%i"%os.getpid()
+
+    def setUp(self):
+        self.writer = SharedSpectraWriter(self.name, nchan=16, nrows=8, ntiers=3, factor=2, npower=5)
+
+    def tearDown(self):
+        if os.path.exists(shm_path(self.name)):
+            self.writer.stop()
+
+    def test_history_read_in_place(self):
+        rng = np.random.RandomState(0)
+        sent = [{"timestamp": 100.0 + ii, "tcs-bandwidth": -400.0,
+                 "beam_03": {"xx": rng.standard_normal(16), "yy": rng.standard_normal(16)}}
+                for ii in range(37)]
+        reader = SharedMemorySource(self.name)
+        self.writer.publish(sent)
+        reader.popFrames()
+        waterfall, power = reader.history
+        
+        # The waterfall is kept as a local PyramidBuffer would be, in ascending frequency
+        expected = PyramidBuffer(8, 16, 3, 2, fill=1.0)
+        for frame in sent:
+            expected.append(frame["beam_03"]["xx"][::-1], frame["timestamp"])
+        for tier in range(3):
+            self.assertEqual(waterfall["beam_03"].tiers[tier].count, expected.tiers[tier].count)
+            np.testing.assert_allclose(waterfall["beam_03"].ordered(tier), expected.ordered(tier), rtol=1e-6)
+            np.testing.assert_array_equal(waterfall["beam_03"].orderedTimes(tier), expected.orderedTimes(tier))
+        
+        powers = [[frame["beam_03"]["xx"].sum(), frame["beam_03"]["yy"].sum()] for frame in sent[-5:]]
+        np.testing.assert_allclose(power["beam_03"].ordered(), powers)
+        self.assertEqual(power["beam_03"].max(), np.max(powers))
+        self.assertEqual(power["beam_01"].min(), 1e4)
+        
+        # Views, not copies: the block's memory is read-only to viewers
+        self.assertFalse(waterfall["beam_03"].tiers[0].data.flags.writeable)
+        reader.stop()
+
+    def test_history_outlives_replaced_block(self):
+        reader = SharedMemorySource(self.name)
+        self.writer.publish(frames(3, beam="beam_01"))
+        reader.popFrames()
+        waterfall, power = reader.history
+        self.writer.publish(frames(3, beam="beam_01", nchan=32))
+        reader.popFrames()
+        self.assertIsNot(reader.history[0], waterfall)
+        self.assertEqual(reader.history[0]["beam_01"].shape, (32,))
+        self.assertEqual(reader.history[0]["beam_01"].count, 3)
+        
+        # Buffers around the old block are still readable
+        self.assertEqual(waterfall["beam_01"].latest()[0], 2)
+        reader.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+"""
+Tests for hipsr_stats.py
+"""
+
+import unittest
+
+import numpy as np
+
+from hipsr_stats import SpectralStats, RobustLevels
+
+
+class TestSpectralStats(unittest.TestCase):
+    def test_welford_during_warmup(self):
+        rng = np.random.RandomState(0)
+        spectra = 10 + rng.standard_normal((8, 1, 2, 16))
+        stats = SpectralStats(1, 16, warmup=100)
+        for spectrum in spectra:
+            stats.update(np.array([0]), spectrum)
+        np.testing.assert_allclose(stats.mean[0], spectra[:, 0].mean(axis=0))
+        np.testing.assert_allclose(stats.var[0], spectra[:, 0].var(axis=0))
+        self.assertFalse(stats.flags.any())
+
+    def test_flags_rfi_only(self):
+        rng = np.random.RandomState(1)
+        stats = SpectralStats(2, 64)
+        idx = np.arange(2)
+        for ii in range(200):
+            stats.update(idx, 50 * (1 + 0.01 * rng.standard_normal((2, 2, 64))))
+        spectra = 50 * (1 + 0.01 * rng.standard_normal((2, 2, 64)))
+        spectra[1, 0, 10] += 20
+        stats.update(idx, spectra)
+        self.assertEqual(np.argwhere(stats.flags).tolist(), [[1, 0, 10]])
+        self.assertEqual(stats.nFlagged(1), 1)
+        self.assertTrue(stats.score[1, 0, 10] > 5)
+
+    def test_reset(self):
+        stats = SpectralStats(1, 4)
+        stats.update(np.array([0]), np.ones((1, 2, 4)))
+        stats.reset()
+        self.assertEqual(stats.count[0], 0)
+        self.assertFalse(stats.mean.any())
+
+
+class TestRobustLevels(unittest.TestCase):
+    def test_levels_ignore_rfi(self):
+        rng = np.random.RandomState(2)
+        rows = 10 + rng.standard_normal((50, 256))
+        rows[:, 100] = 1e6
+        levels = RobustLevels(50)
+        levels.update("ring", 50, rows)
+        level, spread = levels.levels()
+        self.assertAlmostEqual(level, 10, delta=0.1)
+        self.assertAlmostEqual(spread, 1, delta=0.1)
+
+    def test_incremental_update(self):
+        levels = RobustLevels(4, edge=0)
+        self.assertIsNone(levels.levels())
+        rows = np.zeros((4, 8))
+        for count in range(1, 7):
+            rows = np.roll(rows, -1, axis=0)
+            rows[-1] = count
+            levels.update("ring", count, rows)
+        self.assertEqual(levels.summaries.count, 6)
+        self.assertEqual(sorted(levels.summaries.data[:, 0]), [3, 4, 5, 6])
+
+    def test_new_ring_restarts(self):
+        levels = RobustLevels(4, edge=0)
+        levels.update("a", 3, np.ones((4, 8)))
+        levels.update("b", 1, np.ones((4, 8)) * 5)
+        self.assertEqual(levels.summaries.count, 1)
+        self.assertEqual(levels.levels()[0], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()